@@ -0,0 +1,382 @@
+import asyncio
+import os
+import tempfile
+from collections import defaultdict
+from random import random
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+from .botapi import BotAPI, BotAPIError, file_id_of
+from .cache import MediaCache
+from .dataclient import AsyncClient
+from .engine import QueryEngine
+from .fileids import FileIdStore, file_ids_path
+from .imaging import prepare_medium
+from .llm import INSTRUCTION_MESSAGE, LLM
+from .metadata import IMAGE_EXTENSIONS, VIDEO_FORMATS
+from .metrics import Metrics
+from .utils import parse_blocks
+
+
+class AsyncACDReceive(QueryEngine):
+    """
+    asyncio front end of the bot, talking to the Bot API and the storage directly.
+
+    Every update is handled in its own task, so hundreds of downloads and uploads
+    can be in flight in one process. Queries are answered by the same
+    `QueryEngine` as in `ACDReceive`; blocking work (local files, the media
+    cache and image conversion) runs in threads.
+    """
+
+    PAGESIZE = 10
+    ALBUM_SIZE = 10
+    # Updates handled and media retrieved at the same time
+    MAX_UPDATES = 256
+    MAX_DOWNLOADS = 64
+    MEDIA_CACHE_BYTES = 2 * 1024**3
+    # Seconds between the metrics summaries in the log
+    METRICS_INTERVAL = 15 * 60
+
+    def __init__(self, db_path: str, storage_path: str, secrets: Dict[str, Any]):
+        """
+        Args:
+            db_path: Path to the metadata file
+            storage_path: Path to the directory containing the images, or URL of
+                the storage host.
+            secrets: A dictionary containing the Telegram and LLM API tokens
+        """
+        # A smaller table (see `QueryEngine.compact_table`) with "compact": true
+        QueryEngine.__init__(
+            self,
+            Metrics(enabled=secrets.get("metrics", True)),
+            compact=secrets.get("compact", False),
+        )
+        self.user_prefs = defaultdict(dict)
+        self.api = BotAPI(secrets["telegram"])
+        self.downloads = asyncio.Semaphore(self.MAX_DOWNLOADS)
+        # The loop only keeps weak references to tasks
+        self.tasks = set()
+
+        self.db_setup(db_path)
+        self.data_path = storage_path
+        self.data_client = None
+        if storage_path.startswith("http"):
+            self.data_client = AsyncClient(
+                host=storage_path,
+                root=secrets["smartdrive-root"],
+                username=secrets["smartdrive-login"],
+                password=secrets["smartdrive-password"],
+                pool_size=self.MAX_DOWNLOADS,
+            )
+        self.media_cache = MediaCache(
+            secrets.get(
+                "media-cache", os.path.join(tempfile.gettempdir(), "acdreceive-media")
+            ),
+            max_bytes=self.MEDIA_CACHE_BYTES,
+        )
+        self.file_ids = FileIdStore(secrets.get("file-ids", file_ids_path(db_path)))
+        self.joke_llm = LLM(
+            model="meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo",
+            token=secrets["together"],
+            task_prompt=("Erzähl mir einen kurzen Witz zum Thema Fotografieren"),
+            temperature=0.6,
+        )
+
+        self.register_gauges()
+        if "metrics-port" in secrets:
+            self.metrics.serve(secrets["metrics-port"])
+
+    def register_gauges(self):
+        self.metrics.gauge("sessions", self.sessions.stats)
+        self.metrics.gauge("query_cache", self.query_cache.stats)
+        self.metrics.gauge("media_cache", self.media_cache.stats)
+        self.metrics.gauge("file_ids", self.file_ids.stats)
+        if self.data_client is not None:
+            self.metrics.gauge("storage", self.data_client.stats)
+
+    async def handle_update(self, update: Dict[str, Any]):
+        try:
+            if "message" in update and "text" in update["message"]:
+                await self.handle_text_message(update["message"])
+            elif "callback_query" in update:
+                await self.handle_callback_query(update["callback_query"])
+        except Exception:
+            self.metrics.count("errors")
+            logger.exception(f"Failed to handle update {update.get('update_id')}")
+
+    async def handle_text_message(self, message: Dict[str, Any]):
+        chat_id = message["chat"]["id"]
+        user_id = message["from"]["id"]
+        text = message["text"].lower().strip()
+
+        if text.startswith("help") or user_id not in self.user_prefs:
+            self.user_prefs[user_id]["setup_complete"] = True
+            await self.api.call("sendChatAction", chat_id=chat_id, action="typing")
+            await self.api.send_message(
+                chat_id, "Willkommen!\nDas is Michaels ACDReceiver!📷"
+            )
+            await asyncio.sleep(0.7)
+            await self.api.send_message(chat_id, "Hier ist die Anleitung!")
+            await asyncio.sleep(1)
+            instructions = await self.api.send_message(
+                chat_id, INSTRUCTION_MESSAGE, parse_mode="Markdown"
+            )
+            try:
+                await self.api.call("unpinAllChatMessages", chat_id=chat_id)
+            except BotAPIError:
+                logger.warning("Failed to unpin messages")
+            await self.api.call(
+                "pinChatMessage",
+                chat_id=chat_id,
+                message_id=instructions["message_id"],
+            )
+            return
+
+        if random() < 0.01:
+            with self.metrics.timer("llm"):
+                joke = await asyncio.to_thread(self.joke_llm, message["text"])
+            await self.api.send_message(chat_id, joke)
+            return
+
+        if text == "tags":
+            await self.api.send_message(
+                chat_id,
+                f"Die aktuelle Datenbank hat {len(self.db)} Einträge und "
+                f"{len(self.tags)} tags",
+            )
+            await asyncio.sleep(0.6)
+            for chunk in self.tag_distribution():
+                await self.api.send_message(chat_id, chunk)
+            return
+
+        await self.search(chat_id, user_id, text)
+
+    async def search(self, chat_id: int, user_id: int, text: str):
+        """Searches the database and displays the first page of results."""
+        with self.metrics.timer("parse_blocks"):
+            query = parse_blocks(text)
+        self.metrics.count("queries")
+        # The rows refer to this state's table, also if a reload swaps it
+        state = self.state
+        rows, notes = self.query(query, state)
+        for note in notes:
+            await self.api.send_message(chat_id, note)
+        if len(rows) == 0:
+            await self.api.send_message(
+                chat_id, f"Null Ergebnisse für Anfrage: {self.describe(query)}"
+            )
+        elif len(rows) == len(state.db):
+            await self.api.send_message(
+                chat_id,
+                "Das hat nicht geklappt. Probier's nochmal mit einer anderen Anfrage!",
+            )
+        else:
+            self.sessions.put(user_id, rows, state.db)
+            if len(rows) > self.PAGESIZE:
+                msg = f"{len(rows)} Ergebnisse, hier sind die ersten {self.PAGESIZE}"
+            else:
+                msg = f"Hier sind die {len(rows)} Ergebnisse"
+            await self.api.send_message(chat_id, msg)
+            await self.display_results(chat_id, user_id)
+
+    async def handle_callback_query(self, callback_query: Dict[str, Any]):
+        await self.api.call(
+            "answerCallbackQuery", callback_query_id=callback_query["id"]
+        )
+        data = callback_query.get("data", "")
+        if data.startswith("see_more_"):
+            await self.display_results(
+                callback_query["message"]["chat"]["id"],
+                callback_query["from"]["id"],
+                int(data.split("_")[-1]),
+            )
+
+    async def get_medium(self, path: str) -> Optional[bytes]:
+        """Retrieves a medium from the storage, through the media cache."""
+        if self.data_client is None:
+            file = os.path.join(self.data_path, path)
+            stat = await asyncio.to_thread(os.stat, file)
+            validator = f"{stat.st_size}-{stat.st_mtime_ns}"
+        else:
+            validator = await self.data_client.get_validator(path)
+        if validator is not None:
+            content = await asyncio.to_thread(self.media_cache.get, path, validator)
+            if content is not None:
+                return content
+
+        if self.data_client is None:
+            with open(file, "rb") as medium:
+                content = await asyncio.to_thread(medium.read)
+        else:
+            content = await self.data_client.get_file_content(path)
+        if content is None:
+            return None
+        with self.metrics.timer("prepare_medium"):
+            content = await asyncio.to_thread(prepare_medium, path, content)
+        if content is not None and validator is not None:
+            await asyncio.to_thread(self.media_cache.put, path, validator, content)
+        return content
+
+    async def fetch_medium(self, path: str, validator: str):
+        """Returns the `file_id` of an earlier upload, or else the content."""
+        file_id = self.file_ids.get(path, validator)
+        if file_id is not None:
+            return file_id
+        async with self.downloads:
+            try:
+                with self.metrics.timer("get_medium"):
+                    return await self.get_medium(path)
+            except Exception as e:
+                logger.error(f"Failed to retrieve {path}: {e}")
+                return None
+
+    def fetch_page(self, session, start: int, stop: int) -> List[asyncio.Task]:
+        """Starts retrieving the media of one page of a session concurrently."""
+        return [
+            asyncio.create_task(
+                self.fetch_medium(self.medium_path(row), self.asset_validator(row))
+            )
+            for _, row in session.page(start, stop).iterrows()
+        ]
+
+    async def send_items(self, chat_id: int, items: List[tuple]):
+        """
+        Sends `(path, validator, kind, medium, caption)` items as an album, or one
+        by one if there is a single item or Telegram rejects the album.
+        """
+        if len(items) > 1:
+            album = [(kind, medium, caption) for _, _, kind, medium, caption in items]
+            try:
+                with self.metrics.timer("send_album"):
+                    messages = await self.api.send_media_group(chat_id, album)
+            except BotAPIError as e:
+                logger.warning(
+                    f"Telegram rejected album, sending items one by one: {e}"
+                )
+            else:
+                for (path, validator, *_), message in zip(items, messages):
+                    self.record_file_id(path, validator, message)
+                return
+        for path, validator, kind, medium, caption in items:
+            try:
+                message = await self.send_item(chat_id, path, kind, medium, caption)
+            except BotAPIError as e:
+                # Reported like a failed retrieval, the rest of the page goes on
+                logger.error(f"Telegram rejected {path}: {e}")
+                await self.api.send_message(chat_id, f"Failed to retrieve {path}")
+                continue
+            self.record_file_id(path, validator, message)
+
+    async def send_item(
+        self, chat_id: int, path: str, kind: str, medium, caption: Optional[str]
+    ) -> Dict[str, Any]:
+        """Sends one medium, uploading it again if Telegram rejects its `file_id`."""
+        try:
+            with self.metrics.timer("send_medium"):
+                return await self.api.send_medium(chat_id, kind, medium, caption)
+        except BotAPIError as e:
+            if not isinstance(medium, str):
+                raise
+            logger.warning(f"Telegram rejected file_id of {path}: {e}")
+        self.file_ids.discard(path)
+        medium = await self.get_medium(path)
+        if medium is None:
+            raise BotAPIError(f"Could not upload {path} again")
+        return await self.api.send_medium(chat_id, kind, medium, caption)
+
+    def record_file_id(self, path: str, validator: str, message: Dict[str, Any]):
+        file_id = file_id_of(message)
+        if file_id is not None:
+            self.file_ids.put(path, validator, file_id)
+
+    async def display_results(self, chat_id: int, user_id: int, start_index: int = 0):
+        session = self.sessions.get(user_id)
+        if session is None:
+            await self.api.send_message(
+                chat_id, "Die Ergebnisse sind abgelaufen, bitte such nochmal!"
+            )
+            return
+        end_index = start_index + self.PAGESIZE
+        current_page = session.page(start_index, end_index)
+        session.cursor = end_index
+        media = session.take_prefetched(start_index)
+        if media is None:
+            media = self.fetch_page(session, start_index, end_index)
+        # Fetch the next page while the user looks at this one
+        if len(session) > end_index:
+            next_page = self.fetch_page(session, end_index, end_index + self.PAGESIZE)
+            session.prefetch(end_index, next_page)
+
+        items = []
+        for (_, row), pending in zip(current_page.iterrows(), media):
+            path = self.medium_path(row)
+            _, file_extension = os.path.splitext(path)
+            file_extension = file_extension[1:].lower()
+            if file_extension in IMAGE_EXTENSIONS:
+                kind = "photo"
+            elif file_extension in VIDEO_FORMATS:
+                kind = "video"
+            else:
+                await self.api.send_message(
+                    chat_id, f"Unsupported file format: {file_extension}"
+                )
+                continue
+            medium = await pending
+            if medium is None:
+                await self.api.send_message(chat_id, f"Failed to retrieve {path}")
+                continue
+            validator = self.asset_validator(row)
+            items.append((path, validator, kind, medium, self.caption(row)))
+        for i in range(0, len(items), self.ALBUM_SIZE):
+            await self.send_items(chat_id, items[i : i + self.ALBUM_SIZE])
+
+        if len(session) > end_index:
+            button = {
+                "text": "Klicke für mehr!",
+                "callback_data": f"see_more_{end_index}",
+            }
+            await self.api.send_message(
+                chat_id,
+                "Willst du mehr sehen?",
+                reply_markup={"inline_keyboard": [[button]]},
+            )
+        else:
+            await self.api.send_message(chat_id, "Das war alles 🙂")
+
+    async def serve(self):
+        """Long-polls for updates and handles each of them in a task."""
+        logger.info("Starting bot")
+        if self.metrics.enabled:
+            self.spawn(self.log_metrics())
+        # Reloads run in a thread, the loop keeps serving the previous table
+        self.watch()
+        updates = asyncio.Semaphore(self.MAX_UPDATES)
+        offset = 0
+        while True:
+            try:
+                batch = await self.api.get_updates(offset)
+            except Exception as e:
+                logger.warning(f"Failed to get updates: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in batch:
+                offset = update["update_id"] + 1
+                await updates.acquire()
+                task = self.spawn(self.handle_update(update))
+                task.add_done_callback(lambda _: updates.release())
+
+    def spawn(self, coroutine) -> asyncio.Task:
+        """Runs a coroutine in a task that is kept alive until it is done."""
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def log_metrics(self):
+        while True:
+            await asyncio.sleep(self.METRICS_INTERVAL)
+            self.metrics.log_summary()
+
+    def run(self):
+        asyncio.run(self.serve())
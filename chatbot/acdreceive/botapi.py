@@ -0,0 +1,132 @@
+import asyncio
+import json
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import httpx
+from loguru import logger
+
+Medium = Union[bytes, str]
+
+
+class BotAPIError(Exception):
+    """An error response of the Telegram Bot API."""
+
+    def __init__(self, description: str, error_code: Optional[int] = None):
+        super().__init__(description)
+        self.description = description
+        self.error_code = error_code
+
+
+def file_id_of(message: Dict[str, Any]) -> Optional[str]:
+    """Returns the `file_id` of the photo or video a message carries, if any."""
+    if message.get("photo"):
+        return message["photo"][-1]["file_id"]
+    if message.get("video"):
+        return message["video"]["file_id"]
+    return None
+
+
+class BotAPI:
+    """
+    Minimal asyncio client of the Telegram Bot API on a pooled `httpx.AsyncClient`.
+
+    Methods are called with their Bot API parameters and return the decoded
+    `result`. Media are given either as content (uploaded as multipart) or as a
+    `file_id`. When Telegram asks to slow down (HTTP 429), the call sleeps for
+    the requested time and is repeated.
+    """
+
+    def __init__(
+        self,
+        token: str,
+        client: Optional[httpx.AsyncClient] = None,
+        base_url: str = "https://api.telegram.org",
+        max_flood_retries: int = 3,
+    ):
+        """
+        Args:
+            token: The bot token.
+            client: The HTTP client to use, by default one with a pool of 100
+                connections and a read timeout that suits long polling.
+            base_url: URL of the Bot API server.
+            max_flood_retries: How often a call is repeated after HTTP 429.
+        """
+        self.url = f"{base_url}/bot{token}"
+        self.client = client or httpx.AsyncClient(
+            timeout=httpx.Timeout(60, connect=5),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=100),
+        )
+        self.max_flood_retries = max_flood_retries
+
+    async def call(
+        self,
+        method: str,
+        files: Optional[Dict[str, Tuple[str, bytes]]] = None,
+        **params: Any,
+    ) -> Any:
+        """Calls a Bot API method, uploading `files` as multipart if given."""
+        params = {key: value for key, value in params.items() if value is not None}
+        for attempt in range(self.max_flood_retries + 1):
+            if files:
+                # Multipart fields are strings, structured values are JSON
+                data = {
+                    key: value if isinstance(value, str) else json.dumps(value)
+                    for key, value in params.items()
+                }
+                response = await self.client.post(
+                    f"{self.url}/{method}", data=data, files=files
+                )
+            else:
+                response = await self.client.post(f"{self.url}/{method}", json=params)
+            payload = response.json()
+            if payload.get("ok"):
+                return payload["result"]
+            retry_after = payload.get("parameters", {}).get("retry_after")
+            if retry_after is None or attempt == self.max_flood_retries:
+                break
+            logger.warning(f"Flood control on {method}, retrying in {retry_after}s")
+            await asyncio.sleep(retry_after)
+        raise BotAPIError(payload.get("description", ""), payload.get("error_code"))
+
+    async def get_updates(self, offset: int, timeout: int = 30) -> List[Dict[str, Any]]:
+        return await self.call(
+            "getUpdates",
+            offset=offset,
+            timeout=timeout,
+            allowed_updates=["message", "callback_query"],
+        )
+
+    async def send_message(self, chat_id: int, text: str, **params: Any):
+        return await self.call("sendMessage", chat_id=chat_id, text=text, **params)
+
+    async def send_medium(
+        self, chat_id: int, kind: str, medium: Medium, caption: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Sends a single `photo` or `video`."""
+        method = "sendPhoto" if kind == "photo" else "sendVideo"
+        if isinstance(medium, str):
+            params = {kind: medium}
+            return await self.call(method, chat_id=chat_id, caption=caption, **params)
+        return await self.call(
+            method, files={kind: (kind, medium)}, chat_id=chat_id, caption=caption
+        )
+
+    async def send_media_group(
+        self, chat_id: int, items: List[Tuple[str, Medium, Optional[str]]]
+    ) -> List[Dict[str, Any]]:
+        """Sends `(kind, medium, caption)` items as one album."""
+        media, files = [], {}
+        for i, (kind, medium, caption) in enumerate(items):
+            if not isinstance(medium, str):
+                files[f"file{i}"] = (f"file{i}", medium)
+                medium = f"attach://file{i}"
+            item = {"type": kind, "media": medium}
+            if caption:
+                item["caption"] = caption
+            media.append(item)
+        return await self.call(
+            "sendMediaGroup", files=files or None, chat_id=chat_id, media=media
+        )
+
+    async def aclose(self):
+        await self.client.aclose()
@@ -0,0 +1,214 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+import numpy as np
+from loguru import logger
+
+
+class QueryCache:
+    """
+    Bounded LRU cache from a canonical query key to its sorted result row ids.
+
+    Entries are evicted in least-recently-used order once either the number of
+    entries or the total size of the cached row arrays exceeds its limit. The
+    cache is safe to use from threads.
+    """
+
+    def __init__(self, maxsize: int = 256, max_bytes: int = 64 * 1024**2):
+        """
+        Args:
+            maxsize: Maximum number of cached queries.
+            max_bytes: Maximum total size of the cached row id arrays.
+        """
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[Hashable, np.ndarray]" = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: Hashable) -> Optional[np.ndarray]:
+        """Returns the rows cached for `key`, or None."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key: Hashable, rows: np.ndarray):
+        """
+        Caches the result of a query.
+
+        The notes on the individual tags are not cached, since they depend on the
+        order of the tags, which the canonical key ignores.
+
+        Args:
+            key: The canonical key of the query, see `Query.key`.
+            rows: The sorted result row ids. They are made read-only, since the
+                array is shared by all later hits.
+        """
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key).nbytes
+            if rows.nbytes > self.max_bytes:
+                return
+            rows.flags.writeable = False
+            self.entries[key] = rows
+            self.nbytes += rows.nbytes
+            while len(self.entries) > self.maxsize or self.nbytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+
+    def clear(self):
+        """Drops all entries, e.g. because the database was reloaded."""
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.nbytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class MediaCache:
+    """
+    Persistent LRU cache of retrieved (and possibly downscaled) media on disk.
+
+    Every entry is a file named by the hash of the medium's path and a validator
+    of its version (e.g. size and mtime, or the ETag of the storage host), so a
+    changed medium is simply never hit again and ages out. Files are evicted in
+    least-recently-used order, which survives restarts via their mtime, once
+    their total size exceeds `max_bytes`. The cache is safe to use from threads.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 2 * 1024**3):
+        """
+        Args:
+            directory: Where to store the media, created if missing.
+            max_bytes: Maximum total size of the cached media.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, int]" = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+
+        os.makedirs(directory, exist_ok=True)
+        files = []
+        for root, _, names in os.walk(directory):
+            for name in names:
+                if name.endswith(".tmp"):
+                    os.remove(os.path.join(root, name))
+                    continue
+                stat = os.stat(os.path.join(root, name))
+                files.append((stat.st_mtime_ns, name, stat.st_size))
+        for _, name, size in sorted(files):
+            self.entries[name] = size
+            self.nbytes += size
+        with self.lock:
+            self._shrink()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @staticmethod
+    def key(path: str, validator: str) -> str:
+        return hashlib.sha256(f"{path}\0{validator}".encode()).hexdigest()
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def _shrink(self):
+        while self.nbytes > self.max_bytes:
+            key, size = self.entries.popitem(last=False)
+            self.nbytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._file(key))
+            except FileNotFoundError:
+                pass
+
+    def get(self, path: str, validator: str) -> Optional[bytes]:
+        """Returns the cached content of a medium in the given version, or None."""
+        key = self.key(path, validator)
+        file = self._file(key)
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+        # The file is read without the lock, so it may be evicted meanwhile
+        try:
+            with open(file, "rb") as f:
+                content = f.read()
+        except OSError as e:
+            if not isinstance(e, FileNotFoundError):
+                logger.warning(f"Dropping unreadable cache entry of {path}: {e}")
+            with self.lock:
+                if key in self.entries:
+                    self.nbytes -= self.entries.pop(key)
+                self.misses += 1
+            return None
+        try:
+            os.utime(file)
+        except FileNotFoundError:
+            pass
+        with self.lock:
+            self.hits += 1
+            self.bytes_saved += len(content)
+        return content
+
+    def put(self, path: str, validator: str, content: bytes):
+        """Caches the content of a medium in the given version."""
+        if len(content) > self.max_bytes:
+            return
+        key = self.key(path, validator)
+        file = self._file(key)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        # Written aside and renamed, so readers never see a partial file
+        fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(file), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp_file, file)
+        with self.lock:
+            self.nbytes -= self.entries.pop(key, 0)
+            self.entries[key] = len(content)
+            self.nbytes += len(content)
+            self._shrink()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "bytes_saved": self.bytes_saved,
+        }
@@ -1,14 +1,21 @@
 import os
-import time
+import tempfile
 from collections import defaultdict
-from datetime import datetime
+from concurrent.futures import Future, ThreadPoolExecutor
 from random import random
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional, Tuple
 
-import pandas as pd
+import numpy as np
 import telegram
 from loguru import logger
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Message, Update
+from telegram import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InputMediaPhoto,
+    InputMediaVideo,
+    Message,
+    Update,
+)
 from telegram.ext import (
     CallbackQueryHandler,
     CommandHandler,
@@ -17,15 +24,32 @@ from telegram.ext import (
     Updater,
 )
 
+from .cache import MediaCache
 from .dataclient import Client
+from .engine import QueryEngine, TableState
+from .fileids import FileIdStore, file_ids_path
+from .imaging import prepare_medium
 from .llm import INSTRUCTION_MESSAGE, LLM
-from .metadata import IMAGE_FORMATS, VIDEO_FORMATS
+from .metadata import IMAGE_EXTENSIONS, VIDEO_FORMATS
+from .metrics import Metrics
 from .utils import Query, parse_blocks
 
 
-class ACDReceive:
+class ACDReceive(QueryEngine):
 
     PAGESIZE = 10
+    # Handlers run concurrently on the dispatcher's workers. Pages are delivered
+    # by a separate pool, so slow storage never holds up the handling of queries
+    WORKERS = 8
+    DELIVERY_WORKERS = 4
+    # Media downloaded concurrently, shared by all users
+    FETCH_WORKERS = 4
+    MEDIA_CACHE_BYTES = 2 * 1024**3
+    # Pages are sent as albums of at most 10 media, Telegram's limit
+    ALBUMS = True
+    ALBUM_SIZE = 10
+    # Seconds between the metrics summaries in the log
+    METRICS_INTERVAL = 15 * 60
 
     def __init__(self, db_path: str, storage_path: str, secrets: Dict[str, Any]):
         """
@@ -41,11 +65,30 @@ class ACDReceive:
         self.telegram_token = secrets["telegram"]
         self.llm_token = secrets["together"]
 
+        # Timings of the hot paths, unless disabled with "metrics": false
+        # A smaller table (see `QueryEngine.compact_table`) with "compact": true
+        QueryEngine.__init__(
+            self,
+            Metrics(enabled=secrets.get("metrics", True)),
+            compact=secrets.get("compact", False),
+        )
         # Initialize language preferences dictionary
         self.user_prefs = defaultdict(dict)
+        self.fetcher = ThreadPoolExecutor(
+            max_workers=self.FETCH_WORKERS, thread_name_prefix="fetch"
+        )
+        self.delivery = ThreadPoolExecutor(
+            max_workers=self.DELIVERY_WORKERS, thread_name_prefix="deliver"
+        )
 
-        # Initialize the bot and dispatcher
-        self.updater = Updater(self.telegram_token, use_context=True)
+        # Initialize the bot and dispatcher, with a connection per thread that
+        # talks to Telegram (and a few for the updater and job queue)
+        self.updater = Updater(
+            self.telegram_token,
+            use_context=True,
+            workers=self.WORKERS,
+            request_kwargs={"con_pool_size": self.WORKERS + self.DELIVERY_WORKERS + 4},
+        )
         self.dp = self.updater.dispatcher
 
         # Register handlers
@@ -55,9 +98,15 @@ class ACDReceive:
             )
         )
         self.dp.add_handler(
-            MessageHandler(Filters.text & (~Filters.command), self.handle_text_message)
+            MessageHandler(
+                Filters.text & (~Filters.command),
+                self.handle_text_message,
+                run_async=True,
+            )
+        )
+        self.dp.add_handler(
+            CallbackQueryHandler(self.callback_query_handler, run_async=True)
         )
-        self.dp.add_handler(CallbackQueryHandler(self.callback_query_handler))
 
         self.db_setup(db_path)
         if (
@@ -78,6 +127,17 @@ class ACDReceive:
             self.get_medium = self.get_medium_local
 
         self.data_path = storage_path
+        # Retrieved and downscaled media, reused across requests and restarts
+        self.media_cache = MediaCache(
+            secrets.get(
+                "media-cache", os.path.join(tempfile.gettempdir(), "acdreceive-media")
+            ),
+            max_bytes=self.MEDIA_CACHE_BYTES,
+        )
+        # Telegram ids of uploaded media, so that they are never uploaded twice
+        self.file_ids = FileIdStore(
+            secrets.get("file-ids", file_ids_path(db_path))
+        )
         self.joke_llm = LLM(
             model="meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo",
             token=self.llm_token,
@@ -85,25 +145,18 @@ class ACDReceive:
             temperature=0.6,
         )
 
-    def db_setup(self, db_path: str):
-        db = pd.read_csv(db_path)
-        db["FileType"] = db["FileType"].replace("Portable Network Graphics", "png")
-        db["FileType"] = db["FileType"].str.lower()
-        self.tags = sorted(list(db.columns)[list(db.columns).index("Tags") + 1 :])
-        db.columns = db.columns.str.lower()
-        db = db.rename(columns={"name": "Name"})  # to avoid conflict with build-in
-        db = db[~db.filetype.isin(["ordner", "xmp files"])]
-        db["caption"] = db["caption"].fillna("")
-        db["year"] = pd.to_datetime(db["dbdate"]).dt.year
-        db["month"] = pd.to_datetime(db["dbdate"]).dt.month
-        db["day"] = pd.to_datetime(db["dbdate"]).dt.day
-        db['date_object'] = pd.to_datetime(db['dbdate'])
-
-        if any(
-            [x not in IMAGE_FORMATS and x not in VIDEO_FORMATS for x in db["filetype"]]
-        ):
-            logger.error(f"Unknown format in data: {db['filetype'].value_counts()}")
-        self.db = db
+        self.get_medium = self.metrics.timed("get_medium")(self.get_medium)
+        self.register_gauges()
+        if "metrics-port" in secrets:
+            self.metrics.serve(secrets["metrics-port"])
+
+    def register_gauges(self):
+        self.metrics.gauge("sessions", self.sessions.stats)
+        self.metrics.gauge("query_cache", self.query_cache.stats)
+        self.metrics.gauge("media_cache", self.media_cache.stats)
+        self.metrics.gauge("file_ids", self.file_ids.stats)
+        if self.storage == "cloud":
+            self.metrics.gauge("storage", self.data_client.stats)
 
     def setup(self, update, context, force: bool=False) -> bool:
         """
@@ -117,25 +170,32 @@ class ACDReceive:
                 chat_id=update.message.chat_id, action=telegram.ChatAction.TYPING
             )
             update.message.reply_text("Willkommen!\nDas is Michaels ACDReceiver!📷")
-            time.sleep(0.7)
-            update.message.reply_text("Hier ist die Anleitung!")
-            time.sleep(1)
-            response_message = update.message.reply_text(
-                INSTRUCTION_MESSAGE, parse_mode="Markdown"
+            # Scheduled instead of slept, so the worker is free in the meantime
+            context.job_queue.run_once(
+                lambda _: update.message.reply_text("Hier ist die Anleitung!"), 0.7
             )
-            try:
-                context.bot.unpin_all_chat_messages(chat_id=update.message.chat_id)
-            except Exception:
-                logger.warning("Failed to unpin messages")
-            context.bot.pin_chat_message(
-                chat_id=update.message.chat_id,
-                message_id=response_message.message_id,
-                disable_notification=False,
+            context.job_queue.run_once(
+                lambda _: self.send_instructions(update, context), 1.7
             )
             self.user_prefs[user_id]["setup_complete"] = True
             return True
         return False
 
+    def send_instructions(self, update, context):
+        """Sends the instructions and pins them to the chat."""
+        response_message = update.message.reply_text(
+            INSTRUCTION_MESSAGE, parse_mode="Markdown"
+        )
+        try:
+            context.bot.unpin_all_chat_messages(chat_id=update.message.chat_id)
+        except Exception:
+            logger.warning("Failed to unpin messages")
+        context.bot.pin_chat_message(
+            chat_id=update.message.chat_id,
+            message_id=response_message.message_id,
+            disable_notification=False,
+        )
+
     def return_message(self, update: Update, text: str) -> Message:
         return update.message.reply_text(text)
 
@@ -149,7 +209,8 @@ class ACDReceive:
             return
 
         if random() < 0.01:
-            output = self.joke_llm(update.message.text)
+            with self.metrics.timer("llm"):
+                output = self.joke_llm(update.message.text)
             self.return_message(update, output)
             return
         
@@ -157,66 +218,16 @@ class ACDReceive:
             update.message.reply_text(
                 f"Die aktuelle Datenbank hat {len(self.db)} Einträge und {len(self.tags)} tags"
             )
-            time.sleep(0.6)
-            self.send_tag_distribution(update)
+            context.job_queue.run_once(
+                lambda _: self.send_tag_distribution(update), 0.6
+            )
             return
 
         self.search_tags_in_db(update, context)
 
     def send_tag_distribution(self, update):
-        message_buffer = "Die verfügbaren Tags und ihre Verbreitung:\n\n"
-        for tag in sorted(self.tags):
-            tag_info = f"{tag}: {len(self.db[self.db[tag.lower().strip()]])}\n"
-
-            # Check if adding this tag info will exceed the limit
-            if len(message_buffer) + len(tag_info) > 1000:
-                update.message.reply_text(message_buffer)
-                message_buffer = ""  # Reset the buffer after sending
-
-            message_buffer += tag_info
-
-        # Send any remaining text in the buffer
-        if message_buffer:
-            update.message.reply_text(message_buffer)
-
-    def query_date(
-        self, df: pd.DataFrame, start_date: str, end_date: str
-    ) -> pd.DataFrame:
-        """
-        Queries a DataFrame for records within a specified date range.
-
-        The date range is provided as a string in the format 'YYYYMMDD-YYYYMMDD',
-        where both month and day are optional. If the month or day is omitted,
-        it defaults to the start of the period for the start date (i.e., January 1st)
-        and the end of the period for the end date (i.e., December 31st).
-
-        Parameters:
-            df (pd.DataFrame): A DataFrame with separate columns 'Year', 'Month', and 'Day'.
-            start_date (str): A string specifying the starting date, formatted as 'YYYYMMDD'
-            end_date (str): A string specifying the end date, formatted as 'YYYYMMDD'.
-
-        Returns:
-            pd.DataFrame: A DataFrame containing the rows that fall within the specified date range.
-        """
-        # Extract the start and end dates from the date_range string
-        start_year = int(start_date[:4])
-        start_month = int(start_date[4:6]) if len(start_date) > 4 else 1
-        start_day = int(start_date[6:]) if len(start_date) > 6 else 1
-        end_year = int(end_date[:4])
-        end_month = int(end_date[4:6]) if len(end_date) > 4 else 12
-        end_day = int(end_date[6:]) if len(end_date) > 6 else 31
-        # Create a boolean mask to filter DataFrame rows within the date range
-        mask = (
-            (df["year"] >= start_year)
-            & (df["month"] >= start_month)
-            & (df["day"] >= start_day)
-        ) & (
-            (df["year"] <= end_year)
-            & (df["month"] <= end_month)
-            & (df["day"] <= end_day)
-        )
-
-        return df[mask]
+        for message in self.tag_distribution():
+            update.message.reply_text(message)
 
     def search_tags_in_db(self, update, context):
         """Search for tags in the database when a message is received."""
@@ -225,7 +236,9 @@ class ACDReceive:
             user_id = update.message.from_user.id
             # Parse the message
             message = update.message.text.lower()
-            query = parse_blocks(message)
+            with self.metrics.timer("parse_blocks"):
+                query = parse_blocks(message)
+            self.metrics.count("queries")
             tags = query.tags
             caption = query.caption
             start = query.start_date
@@ -233,93 +246,250 @@ class ACDReceive:
             logger.info(
                 f"Searching for {tags} with caption {caption} and date {start} - {end}"
             )
-            userquery = (
-                " ".join([t.capitalize() + " AND " for t in tags[:-1]])
-                + (tags[-1].capitalize() if len(tags) > 0 else "")
-                + (f"; Caption: {caption}" if caption != "" else "")
-                + (f"; Date: {start} - {end}" if start is not None else "")
-            )
+            userquery = self.describe(query)
 
-            result_df = self.lookup(update, query)
-            result_df = result_df.sort_values(by='date_object', ascending=False)
-            if len(result_df) == 0:
+            # The rows refer to this state's table, also if a reload swaps it
+            state = self.state
+            # Sorted by descending date, like the database itself
+            rows = self.lookup(update, query, state)
+            if len(rows) == 0:
                 self.return_message(update, f"Null Ergebnisse für Anfrage: {userquery}")
                 return
-            elif len(result_df) == len(self.db):
+            elif len(rows) == len(state.db):
                 self.return_message(
                     update,
                     "Das hat nicht geklappt. Probier's nochmal mit einer anderen Anfrage!",
                 )
             else:
-                self.user_prefs[user_id]["current_result"] = result_df
-                l = len(result_df)
+                self.sessions.put(user_id, rows, state.db)
+                l = len(rows)
                 if l > self.PAGESIZE:
                     msg = f"{l} Ergebnisse, hier sind die ersten {self.PAGESIZE}"
                 else:
                     msg = f"Hier sind die {l} Ergebnisse"
                 self.return_message(update, msg)
-                self.keep_displaying_results(update, context, user_id)
+                self.display_results(update, context, user_id)
 
         except Exception as e:
+            self.metrics.count("errors")
             response = f"An error occurred: {e}"
             self.return_message(update, response)
 
     def get_medium_local(self, path: str):
         """Reads a file from local storage and returns its content."""
-        with open(os.path.join(self.data_path, path), "rb") as medium:
-            return medium
+        file = os.path.join(self.data_path, path)
+        stat = os.stat(file)
+        validator = f"{stat.st_size}-{stat.st_mtime_ns}"
+        content = self.media_cache.get(path, validator)
+        if content is None:
+            with open(file, "rb") as medium:
+                content = medium.read()
+            with self.metrics.timer("prepare_medium"):
+                content = prepare_medium(path, content)
+            if content is not None:
+                self.media_cache.put(path, validator, content)
+        return content
 
     def get_medium_cloud(self, path: str):
         """Retrieves file content from cloud storage and returns it."""
+        validator = self.data_client.get_validator(path)
+        if validator is not None:
+            content = self.media_cache.get(path, validator)
+            if content is not None:
+                return content
         content = self.data_client.get_file_content(path)
+        if content is None:
+            return None
+        with self.metrics.timer("prepare_medium"):
+            content = prepare_medium(path, content)
+        if content is not None and validator is not None:
+            self.media_cache.put(path, validator, content)
         return content
 
+    def fetch_medium(self, path: str, validator: str):
+        """
+        Retrieves a medium, logging instead of raising errors.
+
+        Returns:
+            The `file_id` of an earlier upload of the asset in the same version,
+            otherwise its content (or None if it could not be retrieved).
+        """
+        file_id = self.file_ids.get(path, validator)
+        if file_id is not None:
+            return file_id
+        try:
+            return self.get_medium(path)
+        except Exception as e:
+            logger.error(f"Failed to retrieve {path}: {e}")
+            return None
+
+    def fetch_page(self, session, start: int, stop: int) -> List[Future]:
+        """Starts retrieving the media of one page of a session concurrently."""
+        return [
+            self.fetcher.submit(
+                self.fetch_medium, self.medium_path(row), self.asset_validator(row)
+            )
+            for _, row in session.page(start, stop).iterrows()
+        ]
+
+    def send_medium(
+        self, context, chat_id: int, path: str, validator: str, medium, caption: str
+    ):
+        """
+        Sends a photo or video, given as content or as `file_id`, and records the
+        `file_id` of new uploads.
+        """
+        _, file_extension = os.path.splitext(path)
+        is_photo = file_extension[1:].lower() in IMAGE_EXTENSIONS
+
+        def send(medium):
+            with self.metrics.timer("send_medium"):
+                if is_photo:
+                    return context.bot.send_photo(
+                        chat_id=chat_id, photo=medium, caption=caption
+                    )
+                return context.bot.send_video(chat_id=chat_id, video=medium)
+
+        if isinstance(medium, str):
+            try:
+                return send(medium)
+            except telegram.error.BadRequest as e:
+                # E.g. the id belongs to another bot, so upload it again
+                logger.warning(f"Telegram rejected file_id of {path}: {e}")
+                self.file_ids.discard(path)
+                medium = self.get_medium(path)
+                if medium is None:
+                    raise telegram.error.TelegramError(f"Could not upload {path} again")
+        message = send(medium)
+        self.record_file_id(path, validator, message)
+        return message
+
+    def record_file_id(self, path: str, validator: str, message: Optional[Message]):
+        """Records the `file_id` of the photo or video a message carries."""
+        if message is None:
+            return
+        attachment = message.photo[-1] if message.photo else message.video
+        if attachment is not None:
+            self.file_ids.put(path, validator, attachment.file_id)
+
+    def send_or_report(
+        self, update, context, chat_id: int, item: Tuple[str, str, Any, str]
+    ):
+        """
+        Sends one item like `send_medium`. If Telegram rejects it, it is reported
+        like a failed retrieval, so that the rest of the page is still sent.
+        """
+        path = item[0]
+        try:
+            self.send_medium(context, chat_id, *item)
+        except telegram.error.TelegramError as e:
+            logger.error(f"Telegram rejected {path}: {e}")
+            self.return_message(update, f"Failed to retrieve {path}")
+
+    def send_album(
+        self, update, context, chat_id: int, items: List[Tuple[str, str, Any, str]]
+    ):
+        """
+        Sends photos and videos as one album with a caption per item, falling
+        back to single sends if Telegram rejects the album.
+
+        Args:
+            items: The path, validator, medium (content or `file_id`) and caption
+                of every item, at most `ALBUM_SIZE`.
+        """
+        album = []
+        for path, _, medium, caption in items:
+            _, file_extension = os.path.splitext(path)
+            if file_extension[1:].lower() in IMAGE_EXTENSIONS:
+                album.append(InputMediaPhoto(medium, caption=caption))
+            else:
+                album.append(InputMediaVideo(medium, caption=caption))
+        try:
+            with self.metrics.timer("send_album"):
+                messages = context.bot.send_media_group(chat_id=chat_id, media=album)
+        except telegram.error.BadRequest as e:
+            logger.warning(f"Telegram rejected album, sending items one by one: {e}")
+            for item in items:
+                self.send_or_report(update, context, chat_id, item)
+            return
+        for (path, validator, _, _), message in zip(items, messages):
+            self.record_file_id(path, validator, message)
+
+    def display_results(
+        self, update, context, user_id: int, start_index: int = 0
+    ) -> Future:
+        """
+        Displays a page of results on the delivery pool, so that the handler is
+        done as soon as the query is resolved.
+        """
+
+        def deliver():
+            try:
+                self.keep_displaying_results(update, context, user_id, start_index)
+            except Exception as e:
+                self.metrics.count("errors")
+                logger.exception(f"Failed to display results to user {user_id}")
+                self.return_message(update, f"An error occurred: {e}")
+
+        return self.delivery.submit(deliver)
+
     def keep_displaying_results(
         self, update, context, user_id: int, start_index: int = 0
     ):
 
-        result_df = self.user_prefs[user_id]["current_result"]
+        session = self.sessions.get(user_id)
+        if session is None:
+            self.return_message(
+                update, "Die Ergebnisse sind abgelaufen, bitte such nochmal!"
+            )
+            return
         end_index = start_index + self.PAGESIZE
-        current_page = result_df.iloc[start_index:end_index]
+        current_page = session.page(start_index, end_index)
+        session.cursor = end_index
+        media = session.take_prefetched(start_index)
+        if media is None:
+            media = self.fetch_page(session, start_index, end_index)
+        # Fetch the next page while the user looks at this one
+        if len(session) > end_index:
+            next_page = self.fetch_page(session, end_index, end_index + self.PAGESIZE)
+            session.prefetch(end_index, next_page)
 
         # Send each image to the chat
-        for i, row in current_page.iterrows():
-            # logger.debug(f"FOlder {row.folder} and {type(row.folder)}")
-            path = row.folder.split("Public\Fotos\\")[-1] + row.Name
+        items = []
+        for (i, row), pending in zip(current_page.iterrows(), media):
+            path = self.medium_path(row)
             _, file_extension = os.path.splitext(path)
             file_extension = file_extension[1:].lower()
-            text = ""
-            if not row.empty:
-                text += str(row["caption"])
-                text += (
-                    f" (von {row['author'].split(' ')[0]} "
-                    if isinstance(row.author, str)
-                    else " ("
-                )
+            text = self.caption(row)
 
-                db_date_str = row["dbdate"]
-                db_date = datetime.strptime(db_date_str, "%Y%m%d %H:%M:%S.%f")
-                nice_date = db_date.strftime("%d.%m.%Y %H:%M")
-                text += f"am {nice_date})"
-
-            medium = self.get_medium(path)
+            medium = pending.result()
             if medium is None:
                 self.return_message(update, f"Failed to retrieve {path}")
                 continue
-            if file_extension in IMAGE_FORMATS:
-                context.bot.send_photo(
-                    chat_id=update.message.chat_id, photo=medium, caption=text
-                )
-            elif file_extension in VIDEO_FORMATS:
-                self.return_message(update, f"Video {file_extension}")
-                context.bot.send_video(chat_id=update.message.chat_id, video=medium)
+            if file_extension in IMAGE_EXTENSIONS or file_extension in VIDEO_FORMATS:
+                items.append((path, self.asset_validator(row), medium, text))
             else:
                 self.return_message(
                     update, f"Unsupported file format: {file_extension}"
                 )
 
+        chat_id = update.message.chat_id
+        for j in range(0, len(items), self.ALBUM_SIZE):
+            chunk = items[j : j + self.ALBUM_SIZE]
+            if self.ALBUMS and len(chunk) > 1:
+                self.send_album(update, context, chat_id, chunk)
+                continue
+            for item in chunk:
+                _, file_extension = os.path.splitext(item[0])
+                if file_extension[1:].lower() in VIDEO_FORMATS:
+                    self.return_message(update, f"Video {file_extension[1:].lower()}")
+                self.send_or_report(update, context, chat_id, item)
+
+        logger.debug(f"Media cache: {self.media_cache.stats()}")
+        logger.debug(f"File ids: {self.file_ids.stats()}")
+
         # Add a button for pagination if there are more results to show
-        if len(result_df) > end_index:
+        if len(session) > end_index:
             keyboard = [
                 [
                     InlineKeyboardButton(
@@ -334,28 +504,20 @@ class ACDReceive:
         else:
             update.message.reply_text("Das war alles 🙂")
 
-    def lookup(self, update, query: Query) -> pd.DataFrame:
-        df = self.db
-
-        for tag in query.tags:
-            if tag not in df.columns:
-                self.return_message(
-                    update,
-                    f"Tag {tag.capitalize()} nicht in der Datenbank vorhanden! Wird ignoriert.",
-                )
-                continue
-            df = df[df[tag.lower()]]
-            self.return_message(
-                update,
-                f"Tag {tag.capitalize()} gefunden, jetzt noch {len(df)} Einträge.",
-            )
-        # Now check for caption and date
-        if query.caption != "":
-            df = df[df.caption.str.lower().str.contains(query.caption.lower())]
-        if query.start_date is not None and query.end_date is not None:
-            df = self.query_date(df, query.start_date, query.end_date)
+    def lookup(
+        self, update, query: Query, state: Optional[TableState] = None
+    ) -> np.ndarray:
+        """
+        Looks up the rows matching a query and reports the notes on its tags.
 
-        return df
+        Returns:
+            The ids of the matching rows of the state's table (by default the
+            current one), sorted by descending date.
+        """
+        rows, notes = self.query(query, state)
+        for note in notes:
+            self.return_message(update, note)
+        return rows
 
     def callback_query_handler(self, update, context):
         """
@@ -371,9 +533,15 @@ class ACDReceive:
             logger.debug(
                 f"Continue displaying from entry {start_index} for user {user_id}"
             )
-            self.keep_displaying_results(query, context, user_id, start_index)
+            self.display_results(query, context, user_id, start_index)
 
     def run(self):
         logger.info("Starting bot")
+        if self.metrics.enabled:
+            self.updater.job_queue.run_repeating(
+                lambda _: self.metrics.log_summary(), self.METRICS_INTERVAL
+            )
+        # Picks up changes of the database without restarting the bot
+        self.watch()
         self.updater.start_polling()
         self.updater.idle()
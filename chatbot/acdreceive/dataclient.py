@@ -1,65 +1,270 @@
-import io
+import asyncio
 import os
+import time
+import warnings
+from typing import Any, Dict, Mapping, Optional, Tuple, Union
 
+import httpx
 import requests
 from loguru import logger
-from PIL import Image
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from urllib3.util.retry import Retry
+
+from .imaging import fit_image
+
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+
+def validator_from_headers(headers: Mapping[str, str]) -> Optional[str]:
+    """Returns the ETag of a response, or else its modification time and size."""
+    if "ETag" in headers:
+        return headers["ETag"]
+    if "Last-Modified" in headers:
+        return f"{headers['Last-Modified']}-{headers.get('Content-Length')}"
+    return None
 
 
 class Client:
-    def __init__(self, host: str, root: str, username: str, password: str):
+    def __init__(
+        self,
+        host: str,
+        root: str,
+        username: str,
+        password: str,
+        pool_size: int = 10,
+        timeout: Union[float, Tuple[float, float]] = (5, 60),
+        retries: int = 3,
+        backoff_factor: float = 0.5,
+    ):
+        """
+        Client for the storage host, sharing one pool of keep-alive connections.
+
+        Args:
+            host: URL of the storage host.
+            root: Directory on the host under which the media are stored.
+            username: User for the basic authentication.
+            password: Password for the basic authentication.
+            pool_size: Maximum number of connections kept open to the host.
+            timeout: Connect and read timeout of a request in seconds.
+            retries: How often a failed request (connection errors and 429/5xx
+                responses) is retried, with exponential backoff.
+            backoff_factor: Base of the backoff between retries in seconds.
+        """
         self.host = host
         self.root = root
         self.username = username
         self.password = password
+        self.timeout = timeout
 
         self.data_root = os.path.join(self.host, self.root)
 
+        self.session = requests.Session()
+        self.session.auth = HTTPBasicAuth(self.username, self.password)
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=["GET", "HEAD"],
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, max_retries=retry
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.requests = 0
+        self.failures = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns request and connection reuse metrics.
+
+        `connections` counts the connections that were opened, so every request
+        beyond that reused a pooled connection.
+        """
+        connections = 0
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            connections += sum(pools[key].num_connections for key in pools.keys())
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "connections": connections,
+            "reused": max(self.requests - connections, 0),
+            "bytes": self.bytes,
+            "mean_latency": self.seconds / self.requests if self.requests else 0.0,
+        }
+
+    def url(self, remote_path: str) -> str:
+        return os.path.join(self.data_root, remote_path.replace("\\", "/"))
+
+    def get_validator(self, remote_path: str) -> Optional[str]:
+        """
+        Returns a string that changes with the content of a file, without
+        downloading it: the ETag, or else the modification time and size.
+        """
+        start = time.perf_counter()
+        try:
+            response = self.session.head(self.url(remote_path), timeout=self.timeout)
+        except requests.RequestException as e:
+            logger.warning(f"Failed to validate file {remote_path}: {e}")
+            return None
+        finally:
+            self.requests += 1
+            self.seconds += time.perf_counter() - start
+        if response.status_code != 200:
+            return None
+        return validator_from_headers(response.headers)
+
     def get_file_content(self, remote_path: str):
         """Downloads file content directly into memory."""
         remote_path = remote_path.replace("\\", "/")
-        url = os.path.join(self.data_root, remote_path)
-        response = requests.get(url, auth=HTTPBasicAuth(self.username, self.password))
+        url = self.url(remote_path)
+        start = time.perf_counter()
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+        except requests.RequestException as e:
+            self.failures += 1
+            logger.error(f"Failed to retrieve file {remote_path}: {e}")
+            return None
+        finally:
+            self.requests += 1
+            self.seconds += time.perf_counter() - start
 
         if response.status_code == 200:
             content = response.content
+            self.bytes += len(content)
             size = len(content) / (1024**2)
             logger.debug(f"Retrieved file {remote_path} of size {size:.3f} MB")
-            if size > 5:
-                logger.info(
-                    f"Image {remote_path} is larger than 5MB ({size:.3f}), downscaling..."
-                )
-                content = self.downscale_image(response.content)
-                size_bytes = len(content)
-                size_mb = size_bytes / (1024 * 1024)
-                logger.info(f"Downscaled image size: {size_mb:.2f} MB")
-
             return content
         else:
+            self.failures += 1
             logger.error(
                 f"Failed to retrieve file {remote_path}: {response.status_code}"
             )
             return None
 
-    def downscale_image(self, image_content):
-        """Downscale the image to approximately 4MB."""
-        image = Image.open(io.BytesIO(image_content))
+    def downscale_image(self, image_content: bytes) -> bytes:
+        """
+        Re-encodes an image as JPEG of at most 4 MB.
 
-        # Convert image to RGB if it is not already in that mode
-        if image.mode != "RGB":
-            image = image.convert("RGB")
+        Deprecated: downloads are no longer downscaled here. The bots prepare
+        all media with `imaging.prepare_medium`, and this delegates to its
+        `imaging.fit_image`.
+        """
+        warnings.warn(
+            "Client.downscale_image is deprecated, use imaging.fit_image",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        return fit_image(image_content)
 
-        quality = 85
-        while True:
-            buffer = io.BytesIO()
-            image.save(buffer, format="JPEG", quality=quality)
-            size_bytes = buffer.tell()
-            size_mb = size_bytes / (1024 * 1024)
 
-            if size_mb <= 4 or quality <= 20:
-                break
+class AsyncClient:
+    def __init__(
+        self,
+        host: str,
+        root: str,
+        username: str,
+        password: str,
+        pool_size: int = 100,
+        timeout: Tuple[float, float] = (5, 60),
+        retries: int = 3,
+        backoff_factor: float = 0.5,
+    ):
+        """
+        asyncio counterpart of `Client`, for many concurrent downloads in one process.
 
-            quality -= 5
+        All requests share the keep-alive connections of one `httpx.AsyncClient`.
+        Connection errors and 429/5xx responses are retried with exponential
+        backoff, sleeping cooperatively.
+
+        Args:
+            host: URL of the storage host.
+            root: Directory on the host under which the media are stored.
+            username: User for the basic authentication.
+            password: Password for the basic authentication.
+            pool_size: Maximum number of connections to the host.
+            timeout: Connect and read timeout of a request in seconds.
+            retries: How often a failed request is retried.
+            backoff_factor: Base of the backoff between retries in seconds.
+        """
+        self.data_root = os.path.join(host, root)
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.client = httpx.AsyncClient(
+            auth=(username, password),
+            timeout=httpx.Timeout(timeout[1], connect=timeout[0]),
+            limits=httpx.Limits(
+                max_connections=pool_size, max_keepalive_connections=pool_size
+            ),
+        )
+
+        self.requests = 0
+        self.failures = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "bytes": self.bytes,
+            "mean_latency": self.seconds / self.requests if self.requests else 0.0,
+        }
+
+    def url(self, remote_path: str) -> str:
+        return os.path.join(self.data_root, remote_path.replace("\\", "/"))
+
+    async def request(self, method: str, remote_path: str) -> httpx.Response:
+        """Sends a request, retrying connection errors and 429/5xx responses."""
+        for attempt in range(self.retries + 1):
+            start = time.perf_counter()
+            try:
+                response = await self.client.request(method, self.url(remote_path))
+            except httpx.TransportError:
+                if attempt == self.retries:
+                    raise
+            else:
+                retry = response.status_code in RETRY_STATUSES
+                if not retry or attempt == self.retries:
+                    return response
+            finally:
+                self.requests += 1
+                self.seconds += time.perf_counter() - start
+            await asyncio.sleep(self.backoff_factor * 2**attempt)
+
+    async def get_validator(self, remote_path: str) -> Optional[str]:
+        """See `Client.get_validator`."""
+        try:
+            response = await self.request("HEAD", remote_path)
+        except httpx.HTTPError as e:
+            logger.warning(f"Failed to validate file {remote_path}: {e}")
+            return None
+        if response.status_code != 200:
+            return None
+        return validator_from_headers(response.headers)
+
+    async def get_file_content(self, remote_path: str) -> Optional[bytes]:
+        """Downloads file content directly into memory."""
+        try:
+            response = await self.request("GET", remote_path)
+        except httpx.HTTPError as e:
+            self.failures += 1
+            logger.error(f"Failed to retrieve file {remote_path}: {e}")
+            return None
+        if response.status_code != 200:
+            self.failures += 1
+            logger.error(
+                f"Failed to retrieve file {remote_path}: {response.status_code}"
+            )
+            return None
+        self.bytes += len(response.content)
+        return response.content
 
-        return buffer.getvalue()
+    async def aclose(self):
+        await self.client.aclose()
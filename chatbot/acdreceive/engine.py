@@ -0,0 +1,637 @@
+import ast
+import os
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+from pyacddb.hierarchy import SEPARATOR, CategoryTree
+from pyacddb.incremental import Delta, read_delta
+from pyacddb.snapshot import (
+    DATE_FORMAT,
+    read_meta,
+    read_snapshot,
+    resolve_snapshot,
+    snapshot_path,
+)
+from pyacddb.tags import TagMatrix
+
+from .cache import QueryCache
+from .index import CaptionIndex, DateIndex, TagIndex, date_key, intersect
+from .metadata import IMAGE_FORMATS, VIDEO_FORMATS
+from .metrics import Metrics
+from .sessions import SessionStore
+from .utils import Query
+
+# Low-cardinality string columns, stored as categoricals by compact tables
+CATEGORICAL_COLUMNS = ["folder", "filetype", "imagetype", "author"]
+# Columns dropped by compact tables: the raw date string, parsed into
+# `date_object`, and the tag lists, which the tag matrix holds
+REDUNDANT_COLUMNS = ["dbdate", "tags", "assetkeywords"]
+
+
+def category_lists(db: pd.DataFrame) -> List[List[str]]:
+    """The category paths of every row, which CSVs store as the repr of lists."""
+    if "assetcategories" not in db:
+        return [[] for _ in range(len(db))]
+    column = db["assetcategories"].fillna("[]")
+    # Assets share few distinct lists, so each repr is only parsed once
+    reprs = {paths for paths in column if isinstance(paths, str)}
+    parsed = {paths: ast.literal_eval(paths) for paths in reprs}
+    return [parsed[paths] if isinstance(paths, str) else paths for paths in column]
+
+
+def descending_keys(dates: pd.Series) -> np.ndarray:
+    """Sort keys that order dates descending, with missing dates last."""
+    keys = np.full(len(dates), np.iinfo(np.int64).max, dtype=np.int64)
+    present = dates.notna().to_numpy()
+    keys[present] = -dates.to_numpy(dtype="datetime64[ns]")[present].view(np.int64)
+    return keys
+
+
+def check_formats(db: pd.DataFrame):
+    """Logs an error if the table holds media of unknown formats."""
+    if any([x not in IMAGE_FORMATS and x not in VIDEO_FORMATS for x in db["filetype"]]):
+        logger.error(f"Unknown format in data: {db['filetype'].value_counts()}")
+
+
+class TableState:
+    """
+    One version of the asset table with the indexes and messages derived from it.
+
+    A state is not modified once built. Reloads build a new state and swap it
+    in with a single assignment to `QueryEngine.state`, so queries that already
+    hold the previous state finish on it.
+    """
+
+    def __init__(
+        self,
+        db: pd.DataFrame,
+        tag_matrix: TagMatrix,
+        generation: Optional[int] = None,
+        version: int = 0,
+        tag_columns: bool = True,
+    ):
+        """
+        Builds the state of a prepared table (see `QueryEngine.prepare_table`).
+
+        The rows are sorted by descending date, so that row ids in ascending order
+        list the newest assets first.
+
+        Args:
+            db: The prepared table.
+            tag_matrix: The tags of its rows.
+            generation: The generation of the snapshot it was read from, if any.
+            version: Counter of the states of an engine, e.g. for cache keys.
+            tag_columns: Whether to append one boolean column per tag to the
+                table. Queries only need the tag index built from `tag_matrix`.
+        """
+        order = (
+            db["date_object"]
+            .sort_values(ascending=False, kind="stable", na_position="last")
+            .index.to_numpy()
+        )
+        db = db.iloc[order].reset_index(drop=True)
+        tag_matrix = tag_matrix.take(order)
+        check_formats(db)
+        self.tag_index = TagIndex(tag_matrix)
+        self.categories = CategoryTree.from_category_lists(category_lists(db))
+        self.caption_index = CaptionIndex(db["caption"])
+        self.attach(db, tag_matrix, generation, version, tag_columns)
+
+    @classmethod
+    def merged(
+        cls,
+        previous: "TableState",
+        kept: np.ndarray,
+        db: pd.DataFrame,
+        fresh_tags: TagMatrix,
+        generation: Optional[int] = None,
+        version: int = 0,
+        tag_columns: bool = True,
+    ) -> "TableState":
+        """
+        Builds the state of a table that changed incrementally from the previous one.
+
+        The added rows are merged into the date order of the remaining ones, and
+        the indexes of the previous state are renumbered, with only the tags,
+        categories and captions of the added rows being indexed. The result is
+        the same as building the state of the new table from scratch.
+
+        Args:
+            previous: The state of the previous table.
+            kept: The rows of the previous table that remain, in ascending order.
+            db: The prepared new table, the remaining rows in their order followed
+                by the added ones.
+            fresh_tags: The tags of the added rows.
+            generation: The generation of the snapshot it was read from, if any.
+            version: Counter of the states of an engine, e.g. for cache keys.
+            tag_columns: Whether to append one boolean column per tag to the
+                table, see `__init__`.
+        """
+        n_kept = len(kept)
+        fresh_db = db.iloc[n_kept:]
+        check_formats(fresh_db)
+        # Each added row goes behind the remaining rows of the same date, like
+        # a stable sort of the whole table would put it
+        keys = descending_keys(db["date_object"])
+        fresh_order = np.argsort(keys[n_kept:], kind="stable")
+        slots = np.searchsorted(keys[:n_kept], keys[n_kept:][fresh_order], "right")
+        positions = np.empty(len(db), dtype=np.int32)
+        positions[:n_kept] = np.arange(n_kept) + np.searchsorted(
+            slots, np.arange(n_kept), side="right"
+        )
+        positions[n_kept + fresh_order] = slots + np.arange(len(slots))
+        order = np.empty_like(positions)
+        order[positions] = np.arange(len(db), dtype=np.int32)
+        renumber = np.full(len(previous.db), -1, dtype=np.int32)
+        renumber[kept] = positions[:n_kept]
+        fresh_positions = positions[n_kept:]
+
+        state = cls.__new__(cls)
+        state.tag_index = TagIndex.merged(
+            previous.tag_index, renumber, fresh_tags, fresh_positions
+        )
+        state.categories = previous.categories.merged(
+            renumber, category_lists(fresh_db), fresh_positions
+        )
+        state.caption_index = CaptionIndex.merged(
+            previous.caption_index, renumber, fresh_db["caption"], fresh_positions
+        )
+        tag_matrix = previous.tag_matrix.take(kept).append(fresh_tags).take(order)
+        db = db.iloc[order].reset_index(drop=True)
+        state.attach(db, tag_matrix, generation, version, tag_columns)
+        return state
+
+    def attach(
+        self,
+        db: pd.DataFrame,
+        tag_matrix: TagMatrix,
+        generation: Optional[int],
+        version: int,
+        tag_columns: bool,
+    ):
+        """Sets the sorted table and what is derived from it besides the indexes."""
+        self.generation = generation
+        self.version = version
+        self.tags = tag_matrix.tags
+        self.tag_matrix = tag_matrix
+        self.date_index = DateIndex(db["date_object"])
+        self.tag_messages = self.build_tag_messages()
+        self.tag_columns = len(self.tags) if tag_columns else 0
+        if tag_columns:
+            columns = tag_matrix.to_frame(sparse=True)
+            columns.columns = columns.columns.str.lower()
+            db = pd.concat([db, columns], axis=1)
+        self.db = db
+
+    def build_tag_messages(self) -> List[str]:
+        """Lists the number of assets per tag, in messages of at most 1000 chars."""
+        messages = []
+        message_buffer = "Die verfügbaren Tags und ihre Verbreitung:\n\n"
+        for tag in sorted(self.tags):
+            tag_info = f"{tag}: {len(self.tag_index[tag.strip()])}\n"
+
+            # Check if adding this tag info will exceed the limit
+            if len(message_buffer) + len(tag_info) > 1000:
+                messages.append(message_buffer)
+                message_buffer = ""  # Reset the buffer after sending
+
+            message_buffer += tag_info
+
+        if message_buffer:
+            messages.append(message_buffer)
+        return messages
+
+
+class QueryEngine:
+    """
+    The asset table with its indexes, answering queries independent of a front end.
+
+    Both the synchronous bot (`ACDReceive`) and the asyncio one
+    (`AsyncACDReceive`) build on it. All methods are synchronous and free of
+    Telegram and storage I/O, so async front ends can call them directly.
+
+    The table and its indexes form a `TableState`. `watch` rebuilds it in the
+    background when the database changes and swaps it in without interrupting
+    the bot. A query resolved against one state is displayed from that state's
+    table, also if a newer one was swapped in meanwhile.
+    """
+
+    # Seconds between the checks of the database for changes
+    RELOAD_INTERVAL = 60
+
+    def __init__(self, metrics: Optional[Metrics] = None, compact: bool = False):
+        """
+        Args:
+            metrics: Where to record timings and the sizes of results, by default
+                nowhere.
+            compact: Whether to keep the table small (see `compact_table`) instead
+                of keeping all columns of the export and one column per tag.
+        """
+        self.query_cache = QueryCache()
+        self.metrics = metrics or Metrics(enabled=False)
+        self.compact = compact
+        # Search results per user, referencing the rows of a state's table
+        self.sessions = SessionStore()
+        self.state: Optional[TableState] = None
+        self.db_path = None
+        # Version of the database files the state was built from, see `source`
+        self.loaded_source = None
+        self.reload_lock = threading.Lock()
+        self.stop_watching = threading.Event()
+
+    @property
+    def db(self) -> pd.DataFrame:
+        return self.state.db
+
+    @property
+    def tags(self) -> List[str]:
+        return self.state.tags
+
+    @property
+    def tag_matrix(self) -> TagMatrix:
+        return self.state.tag_matrix
+
+    @property
+    def tag_index(self) -> TagIndex:
+        return self.state.tag_index
+
+    @property
+    def generation(self) -> Optional[int]:
+        return self.state.generation if self.state is not None else None
+
+    def load_table(self, db_path: str) -> Tuple[pd.DataFrame, TagMatrix]:
+        """
+        Loads the raw metadata table and the tags of its assets.
+
+        A columnar snapshot (see `pyacddb.snapshot`) is preferred and memory-mapped
+        if there is one. Otherwise the CSV is read, either together with a
+        `<name>.tags.npz` sidecar holding the tag membership or with one boolean
+        column per tag.
+        """
+        path = snapshot_path(db_path)
+        if path is not None:
+            path = resolve_snapshot(path)
+            logger.info(f"Loading snapshot {path}")
+            return read_snapshot(path, categorical=self.snapshot_categoricals(path))
+
+        db = pd.read_csv(db_path)
+        # A narrow table may come with its tag membership in a sparse sidecar file
+        tags_path = os.path.splitext(db_path)[0] + ".tags.npz"
+        if os.path.exists(tags_path):
+            return db, TagMatrix.load(tags_path)
+        columns = list(db.columns)
+        tags = columns[columns.index("Tags") + 1 :]
+        return db.drop(columns=tags), TagMatrix.from_frame(db, tags)
+
+    def prepare_table(
+        self, db: pd.DataFrame, tag_matrix: TagMatrix
+    ) -> Tuple[pd.DataFrame, TagMatrix]:
+        """
+        Normalizes a raw metadata table for querying.
+
+        Folders and sidecar files are dropped (from the table and the tags alike,
+        including the tags left without assets), column names are lowercased and
+        the dates are parsed.
+        """
+        db["FileType"] = db["FileType"].replace("Portable Network Graphics", "png")
+        db["FileType"] = db["FileType"].str.lower()
+        db.columns = db.columns.str.lower()
+        db = db.rename(columns={"name": "Name"})  # to avoid conflict with build-in
+        keep = ~db.filetype.isin(["ordner", "xmp files"]).to_numpy()
+        db = db[keep].reset_index(drop=True)
+        # Tags that only folders carried are dropped, as merging a delta does
+        tag_matrix = tag_matrix.take(np.flatnonzero(keep)).prune()
+        db["caption"] = db["caption"].fillna("")
+        # Snapshots carry the parsed dates, otherwise parse them once here
+        date_object = db.pop("date") if "date" in db else pd.to_datetime(db["dbdate"])
+        if self.compact:
+            return self.compact_table(db.assign(date_object=date_object)), tag_matrix
+        db["year"] = date_object.dt.year
+        db["month"] = date_object.dt.month
+        db["day"] = date_object.dt.day
+        db["date_object"] = date_object
+        return db, tag_matrix
+
+    def snapshot_categoricals(self, path: str) -> List[str]:
+        """The columns of a snapshot that compact tables read as categoricals."""
+        if not self.compact:
+            return []
+        # The file types are normalized as strings by `prepare_table` first
+        names = [column["name"] for column in read_meta(path)["columns"]]
+        return [
+            name
+            for name in names
+            if name.lower() in CATEGORICAL_COLUMNS and name.lower() != "filetype"
+        ]
+
+    def compact_table(self, db: pd.DataFrame) -> pd.DataFrame:
+        """
+        Shrinks a prepared table for compact mode.
+
+        The low-cardinality string columns become categoricals and the columns
+        whose content is kept elsewhere are dropped. Unlike regular tables,
+        compact ones have no year, month and day columns.
+        """
+        db = db.drop(columns=REDUNDANT_COLUMNS, errors="ignore")
+        for column in CATEGORICAL_COLUMNS:
+            if column in db and not isinstance(db[column].dtype, pd.CategoricalDtype):
+                db[column] = db[column].astype("category")
+        return db
+
+    def install(
+        self, db: pd.DataFrame, tag_matrix: TagMatrix, generation: Optional[int] = None
+    ) -> TableState:
+        """Builds the state of a prepared table and makes it the one being queried."""
+        version = self.state.version + 1 if self.state is not None else 0
+        state = TableState(
+            db, tag_matrix, generation, version, tag_columns=not self.compact
+        )
+        self.swap(state)
+        return state
+
+    def swap(self, state: TableState):
+        """
+        Replaces the current state.
+
+        Queries that already hold the previous state finish on it. Sessions on
+        its table are moved to copies of their own rows, or dropped if these are
+        too large, so that the table can be freed once the running queries are
+        done.
+        """
+        previous, self.state = self.state, state
+        # Cached results refer to the rows of the previous table
+        self.query_cache.clear()
+        if previous is not None:
+            moved = self.sessions.release(previous.db)
+            logger.info(
+                f"Swapped in table version {state.version} with {len(state.db)} "
+                f"rows, moved {moved} sessions off the previous one"
+            )
+
+    def source(self, db_path: str) -> Tuple[int, int, int]:
+        """
+        Identifies the version of the database files: the inode, modification time
+        and size of the metadata of the snapshot's current version (every write
+        creates a new one), or else of the CSV.
+        """
+        path = snapshot_path(db_path)
+        if path is not None:
+            path = os.path.join(resolve_snapshot(path), "meta.json")
+        stat = os.stat(path or db_path)
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def db_setup(self, db_path: str):
+        self.db_path = db_path
+        path = snapshot_path(db_path)
+        if path is not None:
+            # Read a single version, also if the snapshot is rewritten meanwhile
+            path = resolve_snapshot(path)
+        # Read first, so that changes during the load are picked up later
+        source = self.source(path or db_path)
+        generation = read_meta(path).get("generation", 0) if path else None
+        self.install(*self.prepare_table(*self.load_table(path or db_path)), generation)
+        self.loaded_source = source
+
+    def apply_delta(self, db_path: str) -> Optional[Delta]:
+        """
+        Picks up a snapshot that was updated incrementally (see `pyacddb.incremental`).
+
+        If the snapshot directly follows the loaded generation, only its new rows
+        are read and merged into the current table, and only they are indexed
+        (see `TableState.merged`). Otherwise the whole database is reloaded.
+
+        Returns:
+            The applied delta, or None if the database was reloaded.
+        """
+        path = snapshot_path(db_path)
+        if path is not None:
+            path = resolve_snapshot(path)
+        delta = read_delta(path) if path is not None else None
+        state = self.state
+        if delta is None or delta.base != state.generation:
+            logger.info(f"No delta for generation {state.generation}, reloading")
+            self.db_setup(db_path)
+            return None
+
+        source = self.source(path)
+        fresh_db, fresh_tags = self.prepare_table(
+            *read_snapshot(
+                path, start=delta.start, categorical=self.snapshot_categoricals(path)
+            )
+        )
+        # The tag columns are appended after the regular ones by `TableState`
+        db = state.db.iloc[:, : state.db.shape[1] - state.tag_columns]
+        keys = db["folder"].astype(object).fillna("") + db["Name"].fillna("")
+        kept = np.flatnonzero(~keys.isin(delta.stale).to_numpy())
+        db = pd.concat([db.iloc[kept], fresh_db], ignore_index=True)
+        if self.compact:
+            # Categoricals with different categories are concatenated as strings
+            db = self.compact_table(db)
+        state = TableState.merged(
+            state,
+            kept,
+            db,
+            fresh_tags,
+            read_meta(path).get("generation", 0),
+            state.version + 1,
+            tag_columns=not self.compact,
+        )
+        self.swap(state)
+        self.loaded_source = source
+        logger.info(f"Applied {delta}, now at generation {state.generation}")
+        return delta
+
+    def reload(self, db_path: Optional[str] = None) -> Optional[Delta]:
+        """
+        Rebuilds the state from the database (see `apply_delta`) and swaps it in.
+
+        Only one reload runs at a time. If it fails, the current state is kept.
+        """
+        db_path = db_path or self.db_path
+        with self.reload_lock, self.metrics.timer("reload"):
+            return self.apply_delta(db_path)
+
+    def watch(self, interval: Optional[float] = None) -> threading.Thread:
+        """
+        Starts a thread that reloads the database when its files changed.
+
+        A change is only picked up once the files were left untouched for one
+        interval, so that a CSV is not read while it is still being written.
+        """
+        interval = interval or self.RELOAD_INTERVAL
+
+        def run():
+            seen = self.loaded_source
+            while not self.stop_watching.wait(interval):
+                try:
+                    source = self.source(self.db_path)
+                    if source != self.loaded_source and source == seen:
+                        self.reload()
+                    seen = source
+                except Exception:
+                    logger.exception(f"Failed to reload {self.db_path}")
+
+        thread = threading.Thread(target=run, name="reload", daemon=True)
+        thread.start()
+        return thread
+
+    def query_date(
+        self, start_date: str, end_date: str, state: Optional[TableState] = None
+    ) -> slice:
+        """
+        Queries the database for records within a specified date range.
+
+        The date range is provided as a string in the format 'YYYYMMDD-YYYYMMDD',
+        where both month and day are optional. If the month or day is omitted,
+        it defaults to the start of the period for the start date (i.e., January 1st)
+        and the end of the period for the end date (i.e., December 31st).
+        Since the database is sorted by descending date, the matching records form
+        a contiguous block of rows, which is found by binary search.
+
+        Parameters:
+            start_date (str): A string specifying the starting date, formatted as 'YYYYMMDD'
+            end_date (str): A string specifying the end date, formatted as 'YYYYMMDD'.
+
+        Returns:
+            slice: The positions of the rows that fall within the specified date range.
+        """
+        state = state or self.state
+        return state.date_index.span(date_key(start_date), date_key(end_date, end=True))
+
+    def match_tags(
+        self, tags: List[str], state: TableState
+    ) -> Tuple[Optional[np.ndarray], List[str]]:
+        """
+        Intersects the rows of the known tags and categories, in the given order.
+
+        Returns:
+            The sorted row ids, None if no tag is known, and one note per tag
+            with the number of rows left after it, to report to the user.
+        """
+        rows = None  # All rows until the first known tag
+        notes = []
+        for tag in tags:
+            # Category paths such as "orte\\münster" match their whole subtree
+            index, kind = state.tag_index, "Tag"
+            if SEPARATOR in tag:
+                index, kind = state.categories, "Kategorie"
+            if tag not in index:
+                notes.append(
+                    f"{kind} {tag.capitalize()} nicht in der Datenbank vorhanden! "
+                    "Wird ignoriert."
+                )
+                continue
+            postings = index[tag]
+            rows = postings if rows is None else intersect(rows, postings)
+            notes.append(
+                f"{kind} {tag.capitalize()} gefunden, jetzt noch {len(rows)} Einträge."
+            )
+        return rows, notes
+
+    def resolve(
+        self, query: Query, state: Optional[TableState] = None
+    ) -> Tuple[np.ndarray, List[str]]:
+        """
+        Resolves a query into the sorted ids of the matching rows.
+
+        Returns:
+            The row ids and the notes on the individual tags to report to the user.
+        """
+        state = state or self.state
+        rows, notes = self.match_tags(query.tags, state)
+        # Now check for date and caption
+        if query.start_date is not None and query.end_date is not None:
+            span = self.query_date(query.start_date, query.end_date, state)
+            if rows is None:
+                rows = np.arange(span.start, span.stop, dtype=np.int32)
+            else:
+                lo, hi = np.searchsorted(rows, [span.start, span.stop])
+                rows = rows[lo:hi]
+        if query.caption != "":
+            rows = state.caption_index.search(query.caption, rows)
+
+        if rows is None:
+            rows = np.arange(len(state.db), dtype=np.int32)
+        return rows, notes
+
+    def query(
+        self, query: Query, state: Optional[TableState] = None
+    ) -> Tuple[np.ndarray, List[str]]:
+        """
+        Resolves a query, answering repeated ones from the query cache.
+
+        Args:
+            query: The query.
+            state: The state to query, by default the current one. Callers that
+                go on to use the table pass the state they took it from.
+
+        Returns:
+            The ids of the matching rows of the state's table, sorted by
+            descending date, and the notes on the individual tags to report.
+        """
+        state = state or self.state
+        with self.metrics.timer("lookup"):
+            key = (state.version, query.key())
+            rows = self.query_cache.get(key)
+            if rows is None:
+                rows, notes = self.resolve(query, state)
+                self.query_cache.put(key, rows)
+            else:
+                # The notes follow the order of the tags, which the key ignores
+                notes = self.match_tags(query.tags, state)[1]
+        self.metrics.observe("result_rows", len(rows))
+        return rows, notes
+
+    def tag_distribution(self) -> List[str]:
+        """
+        Returns the messages listing the number of assets per tag.
+
+        They are built with the state from the lengths of the tag index, so they
+        follow every reload without being computed per request.
+        """
+        return self.state.tag_messages
+
+    def describe(self, query: Query) -> str:
+        """Formats a query for the user, e.g. 'Micha AND Haus; Caption: Dach'."""
+        tags = query.tags
+        return (
+            " ".join([t.capitalize() + " AND " for t in tags[:-1]])
+            + (tags[-1].capitalize() if len(tags) > 0 else "")
+            + (f"; Caption: {query.caption}" if query.caption != "" else "")
+            + (
+                f"; Date: {query.start_date} - {query.end_date}"
+                if query.start_date is not None
+                else ""
+            )
+        )
+
+    def caption(self, row: pd.Series) -> str:
+        """Formats the caption of a medium with its author and date."""
+        text = ""
+        if not row.empty:
+            text += str(row["caption"])
+            text += (
+                f" (von {row['author'].split(' ')[0]} "
+                if isinstance(row.author, str)
+                else " ("
+            )
+
+            nice_date = row["date_object"].strftime("%d.%m.%Y %H:%M")
+            text += f"am {nice_date})"
+        return text
+
+    def medium_path(self, row: pd.Series) -> str:
+        """Returns the path of a row's medium relative to the storage."""
+        return row.folder.split("Public\\Fotos\\")[-1] + row.Name
+
+    def asset_validator(self, row: pd.Series) -> str:
+        """Returns a string that changes whenever the asset of a row changes."""
+        if isinstance(row.get("assethash"), str):
+            return row["assethash"]
+        if "dbdate" in row:
+            return str(row["dbdate"])
+        # Compact tables only keep the parsed date, formatted like `DBDate` here
+        return row["date_object"].strftime(DATE_FORMAT)[:-3]
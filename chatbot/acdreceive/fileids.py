@@ -0,0 +1,93 @@
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Optional
+
+from pyacddb.snapshot import VERSION_NAME
+
+
+def file_ids_path(db_path: str) -> str:
+    """
+    Where the file ids of a database are kept unless configured otherwise.
+
+    The store lies next to the CSV or snapshot, e.g. `wholedb.file_ids.sqlite`,
+    and never inside a snapshot directory, whose versions `write_snapshot`
+    replaces.
+    """
+    path = os.path.normpath(db_path)
+    if VERSION_NAME.fullmatch(os.path.basename(path)):
+        # A version directory of a snapshot
+        path = os.path.dirname(path)
+    return os.path.splitext(path)[0] + ".file_ids.sqlite"
+
+
+class FileIdStore:
+    """
+    Persistent map from asset path to the Telegram `file_id` of its last upload.
+
+    Sending a `file_id` instead of the content skips both the download from the
+    storage and the upload to Telegram. Every id is stored with a validator of
+    the asset version (e.g. its `AssetHash` or `DBDate`), so a changed asset no
+    longer matches and is uploaded again. The store is safe to use from threads.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: The SQLite database file, created if missing.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS file_ids ("
+                "path TEXT PRIMARY KEY, validator TEXT NOT NULL, file_id TEXT NOT NULL)"
+            )
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        with self.lock:
+            (count,) = self.connection.execute(
+                "SELECT COUNT(*) FROM file_ids"
+            ).fetchone()
+        return count
+
+    def get(self, path: str, validator: str) -> Optional[str]:
+        """Returns the `file_id` of an asset if it was uploaded in this version."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT validator, file_id FROM file_ids WHERE path = ?", (path,)
+            ).fetchone()
+            if row is None or row[0] != validator:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[1]
+
+    def put(self, path: str, validator: str, file_id: str):
+        """Records the `file_id` of an asset, replacing that of older versions."""
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO file_ids VALUES (?, ?, ?)",
+                (path, validator, file_id),
+            )
+
+    def discard(self, path: str):
+        """Forgets the `file_id` of an asset, e.g. because Telegram rejected it."""
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM file_ids WHERE path = ?", (path,))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
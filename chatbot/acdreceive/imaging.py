@@ -0,0 +1,167 @@
+import io
+import os
+import re
+from typing import Optional
+
+from loguru import logger
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .metadata import IMAGE_EXTENSIONS
+
+# Telegram accepts photos up to 10MB, but shows them with at most 2560 pixels
+MAX_BYTES = 4 * 1024**2
+MAX_SIDE = 2560
+# Larger photos, and those Telegram cannot display, are re-encoded
+PHOTO_LIMIT = 5 * 1024**2
+PHOTO_FORMATS = ["JPEG", "PNG", "WEBP"]
+MIN_QUALITY = 20
+MAX_QUALITY = 85
+
+JPEG_START = re.compile(rb"\xff\xd8\xff")
+
+
+def embedded_jpeg(content: bytes) -> Optional[Image.Image]:
+    """
+    Finds the largest JPEG embedded in a file, e.g. the preview of a RAW image.
+    """
+    best = None
+    for match in JPEG_START.finditer(content):
+        try:
+            image = Image.open(io.BytesIO(content[match.start() :]))
+        except (UnidentifiedImageError, OSError):
+            continue
+        if best is None or image.width * image.height > best.width * best.height:
+            best = image
+    return best
+
+
+def open_image(content: bytes, max_side: int = MAX_SIDE) -> Image.Image:
+    """
+    Opens an image for re-encoding, decoding JPEGs at reduced scale right away.
+
+    Multi-frame images (GIF, TIFF) are reduced to their first frame and RAW
+    files that Pillow cannot decode to their embedded preview.
+    """
+    try:
+        image = Image.open(io.BytesIO(content))
+        image.seek(0)
+    except (UnidentifiedImageError, OSError):
+        image = embedded_jpeg(content)
+        if image is None:
+            raise
+    if image.format == "JPEG":
+        # Lets the decoder skip detail that is lost by the downsampling anyway
+        image.draft("RGB", (max_side, max_side))
+    return image
+
+
+def to_rgb(image: Image.Image) -> Image.Image:
+    """Converts an image to RGB, putting transparent areas on white."""
+    if image.mode == "RGB":
+        return image
+    if image.mode.startswith("I"):
+        # 16/32 bit grayscale (e.g. scanned TIFFs) scaled to 8 bit
+        image = image.convert("I").point(lambda v: v * (1 / 256)).convert("L")
+    if image.mode in ("P", "LA", "PA") or "transparency" in image.info:
+        image = image.convert("RGBA")
+    if image.mode == "RGBA":
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def encode(image: Image.Image, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def fit_image(
+    content: bytes, max_bytes: int = MAX_BYTES, max_side: int = MAX_SIDE
+) -> bytes:
+    """
+    Re-encodes an image as JPEG that fits into `max_bytes`.
+
+    The image is first downsampled to at most `max_side` pixels per side. Then
+    the highest quality (up to 85) that fits is found by binary search, which
+    takes a handful of encodes at display resolution instead of up to 14 at full
+    resolution. If even the lowest quality does not fit, the resolution is
+    reduced further.
+    """
+    return fit(open_image(content, max_side), max_bytes, max_side)
+
+
+def fit(
+    image: Image.Image, max_bytes: int = MAX_BYTES, max_side: int = MAX_SIDE
+) -> bytes:
+    """Re-encodes an opened image like `fit_image`."""
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((max_side, max_side), Image.LANCZOS, reducing_gap=3.0)
+    image = to_rgb(image)
+
+    while True:
+        best = encode(image, MAX_QUALITY)
+        if len(best) <= max_bytes:
+            return best
+        lo, hi = MIN_QUALITY, MAX_QUALITY - 1
+        best = None
+        while lo <= hi:
+            quality = (lo + hi) // 2
+            candidate = encode(image, quality)
+            if len(candidate) <= max_bytes:
+                best, lo = candidate, quality + 1
+            else:
+                hi = quality - 1
+        if best is not None:
+            return best
+        width, height = image.size
+        image = image.resize((width * 3 // 4, height * 3 // 4), Image.LANCZOS)
+
+
+def prepare_photo(content: bytes, limit: int = PHOTO_LIMIT) -> Optional[bytes]:
+    """
+    Returns a photo Telegram can display: small JPEGs, PNGs and WEBPs as they
+    are, everything else re-encoded with `fit_image`.
+
+    Files that open but cannot be decoded, such as RAW files with a TIFF
+    structure, are replaced by their embedded preview. Returns None if there is
+    none, as Telegram could not display the file either.
+    """
+    try:
+        image_format = Image.open(io.BytesIO(content)).format
+    except (UnidentifiedImageError, OSError):
+        image_format = None
+    if len(content) <= limit and image_format in PHOTO_FORMATS:
+        return content
+    try:
+        fitted = fit_image(content)
+    except (UnidentifiedImageError, OSError) as e:
+        preview = embedded_jpeg(content)
+        if preview is None:
+            logger.warning(f"Could not re-encode image of format {image_format}: {e}")
+            return None
+        logger.info(f"Using the preview of {image_format} image, as decoding failed")
+        preview.draft("RGB", (MAX_SIDE, MAX_SIDE))
+        try:
+            fitted = fit(preview)
+        except (UnidentifiedImageError, OSError) as e:
+            logger.warning(f"Could not re-encode preview of {image_format}: {e}")
+            return None
+    size_mb = len(content) / 1024**2
+    logger.info(
+        f"Re-encoded {image_format} image of {size_mb:.2f} MB "
+        f"to {len(fitted) / 1024**2:.2f} MB"
+    )
+    return fitted
+
+
+def prepare_medium(path: str, content: bytes) -> Optional[bytes]:
+    """
+    Converts images into photos that Telegram can display, or None if they
+    cannot be converted.
+    """
+    _, file_extension = os.path.splitext(path)
+    if file_extension[1:].lower() in IMAGE_EXTENSIONS:
+        return prepare_photo(content)
+    return content
@@ -0,0 +1,262 @@
+import re
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+from pyacddb.tags import TagMatrix
+
+from .utils import normalize_text
+
+TOKEN = re.compile(r"\w+")
+
+
+def intersect(rows: np.ndarray, other: np.ndarray) -> np.ndarray:
+    """Intersects two sorted, duplicate-free row id arrays."""
+    if len(other) < len(rows):
+        rows, other = other, rows
+    if len(rows) == 0:
+        return rows
+    # Probe the larger array with the elements of the smaller one
+    positions = np.searchsorted(other, rows)
+    positions[positions == len(other)] = len(other) - 1
+    return rows[other[positions] == rows]
+
+
+class TagIndex:
+    """
+    Inverted index from lowercased tag to the sorted row ids of its assets.
+
+    Row ids are positions in the table the index was built for, so a multi-tag
+    query is an intersection of small integer arrays instead of a chain of
+    filtered copies of the table.
+    """
+
+    def __init__(self, tag_matrix: TagMatrix):
+        self.postings: Dict[str, np.ndarray] = {}
+        for tag in tag_matrix.tags:
+            key = tag.lower()
+            rows = tag_matrix.rows(tag).astype(np.int32)
+            if key in self.postings:
+                # Tags that only differ in case share one entry
+                rows = np.union1d(self.postings[key], rows)
+            self.postings[key] = rows
+
+    @classmethod
+    def merged(
+        cls,
+        previous: "TagIndex",
+        renumber: np.ndarray,
+        fresh_tags: TagMatrix,
+        positions: np.ndarray,
+    ) -> "TagIndex":
+        """
+        Builds the index of a table that changed incrementally from the previous one.
+
+        The postings of the previous table are renumbered, which keeps them sorted
+        as long as the remaining rows keep their order. Only the postings of the
+        tags of the added rows are merged.
+
+        Args:
+            previous: The index of the previous table.
+            renumber: The new row id of every previous row, -1 if it was removed.
+            fresh_tags: The tags of the added rows.
+            positions: The row ids of the added rows in the new table.
+        """
+        index = cls.__new__(cls)
+        index.postings = {}
+        for key, rows in previous.postings.items():
+            rows = renumber[rows]
+            rows = rows[rows >= 0]
+            if len(rows) > 0:
+                index.postings[key] = rows
+        for tag in fresh_tags.tags:
+            rows = np.sort(positions[fresh_tags.rows(tag)]).astype(np.int32)
+            if len(rows) == 0:
+                continue
+            key = tag.lower()
+            if key in index.postings:
+                rows = np.union1d(index.postings[key], rows)
+            index.postings[key] = rows
+        return index
+
+    def __contains__(self, tag: str) -> bool:
+        return tag.lower() in self.postings
+
+    def __getitem__(self, tag: str) -> np.ndarray:
+        return self.postings[tag.lower()]
+
+
+def date_key(date: str, end: bool = False) -> int:
+    """
+    Converts a date formatted as 'YYYYMMDD' into an integer key YYYYMMDD.
+
+    Month and day are optional and default to the start of the period, or to its
+    end if `end` is set (e.g. '1998' becomes 19980101, or 19981231 with `end`).
+    """
+    year = int(date[:4])
+    month = int(date[4:6]) if len(date) > 4 else (12 if end else 1)
+    day = int(date[6:]) if len(date) > 6 else (31 if end else 1)
+    return year * 10000 + month * 100 + day
+
+
+class DateIndex:
+    """
+    Range index over the dates of a table that is sorted by descending date.
+
+    The dates are kept as integer keys YYYYMMDD, so a date range maps to a
+    contiguous slice of rows that is found by binary search. Rows without a date
+    (which sort last) never match.
+    """
+
+    def __init__(self, dates: pd.Series):
+        keys = dates.dt.year * 10000 + dates.dt.month * 100 + dates.dt.day
+        # Negated to be ascending for `searchsorted`, missing dates become 0
+        self.negated_keys = -keys.fillna(0).to_numpy(dtype=np.int32)
+        if np.any(np.diff(self.negated_keys) < 0):
+            raise ValueError("Dates have to be sorted in descending order")
+
+    def span(self, start: int, end: int) -> slice:
+        """Returns the rows whose date key lies within `[start, end]`."""
+        lo = np.searchsorted(self.negated_keys, -end, side="left")
+        hi = np.searchsorted(self.negated_keys, -start, side="right")
+        return slice(int(lo), int(max(lo, hi)))
+
+
+class CaptionIndex:
+    """
+    Substring index over the normalized (see `normalize_text`) captions of a table.
+
+    The captions are tokenized into an inverted index from token to rows. On top,
+    a trigram index maps every trigram to the tokens containing it, so that a
+    substring query only visits the tokens, and then the rows, that can match.
+    """
+
+    NGRAM = 3
+
+    def __init__(self, captions: Iterable[str]):
+        self.captions = [normalize_text(str(caption)) for caption in captions]
+        token_rows: Dict[str, List[int]] = defaultdict(list)
+        for row, caption in enumerate(self.captions):
+            for token in set(TOKEN.findall(caption)):
+                token_rows[token].append(row)
+        self.tokens = list(token_rows)
+        self.postings = [np.array(token_rows[t], dtype=np.int32) for t in self.tokens]
+
+        grams: Dict[str, List[int]] = defaultdict(list)
+        for i, token in enumerate(self.tokens):
+            for gram in self.token_grams(token):
+                grams[gram].append(i)
+        self.grams = {
+            gram: np.array(ids, dtype=np.int32) for gram, ids in grams.items()
+        }
+
+    @classmethod
+    def merged(
+        cls,
+        previous: "CaptionIndex",
+        renumber: np.ndarray,
+        fresh_captions: Iterable[str],
+        positions: np.ndarray,
+    ) -> "CaptionIndex":
+        """
+        Builds the index of a table that changed incrementally from the previous one.
+
+        Only the captions of the added rows are tokenized. The postings of the
+        previous tokens are renumbered, tokens left without rows are dropped and
+        the trigrams of new tokens are added.
+
+        Args:
+            previous: The index of the previous table.
+            renumber: The new row id of every previous row, -1 if it was removed.
+            fresh_captions: The captions of the added rows.
+            positions: The row ids of the added rows in the new table.
+        """
+        index = cls.__new__(cls)
+        fresh = [normalize_text(str(caption)) for caption in fresh_captions]
+        kept = np.flatnonzero(renumber >= 0)
+        captions = np.empty(len(kept) + len(fresh), dtype=object)
+        captions[renumber[kept]] = np.array(previous.captions, dtype=object)[kept]
+        captions[positions] = fresh
+        index.captions = captions.tolist()
+
+        token_rows: Dict[str, List[int]] = defaultdict(list)
+        for row, caption in zip(positions, fresh):
+            for token in set(TOKEN.findall(caption)):
+                token_rows[token].append(row)
+        index.tokens, index.postings = [], []
+        # The new id of every previous token, -1 if it was dropped
+        ids = np.full(len(previous.tokens), -1, dtype=np.int32)
+        for i, (token, rows) in enumerate(zip(previous.tokens, previous.postings)):
+            rows = renumber[rows]
+            rows = rows[rows >= 0]
+            if token in token_rows:
+                rows = np.union1d(rows, token_rows.pop(token)).astype(np.int32)
+            if len(rows) > 0:
+                ids[i] = len(index.tokens)
+                index.tokens.append(token)
+                index.postings.append(rows)
+
+        # Renumbering keeps the token ids sorted, new tokens get larger ones
+        grams: Dict[str, List[np.ndarray]] = defaultdict(list)
+        for gram, token_ids in previous.grams.items():
+            token_ids = ids[token_ids]
+            grams[gram].append(token_ids[token_ids >= 0])
+        for token, rows in token_rows.items():
+            for gram in cls.token_grams(token):
+                grams[gram].append(np.array([len(index.tokens)], dtype=np.int32))
+            index.tokens.append(token)
+            index.postings.append(np.sort(np.array(rows, dtype=np.int32)))
+        index.grams = {}
+        for gram, parts in grams.items():
+            token_ids = np.concatenate(parts)
+            if len(token_ids) > 0:
+                index.grams[gram] = token_ids
+        return index
+
+    @classmethod
+    def token_grams(cls, token: str) -> set:
+        """Returns the distinct trigrams of a token."""
+        n_grams = len(token) - cls.NGRAM + 1
+        return {token[j : j + cls.NGRAM] for j in range(n_grams)}
+
+    def tokens_containing(self, part: str) -> List[int]:
+        """Returns the ids of all tokens that contain the (normalized) `part`."""
+        if len(part) < self.NGRAM:
+            candidates = range(len(self.tokens))
+        else:
+            empty = np.empty(0, dtype=np.int32)
+            candidates = self.grams.get(part[: self.NGRAM], empty)
+            for j in range(1, len(part) - self.NGRAM + 1):
+                candidates = intersect(
+                    candidates, self.grams.get(part[j : j + self.NGRAM], empty)
+                )
+        return [i for i in candidates if part in self.tokens[i]]
+
+    def search(self, text: str, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Returns the sorted rows whose caption contains `text`.
+
+        The text is matched literally (no regex), ignoring case and umlaut spelling.
+
+        Args:
+            text: The text to search for.
+            rows: Sorted row ids to restrict the search to, if any.
+        """
+        query = normalize_text(text)
+        # Every word of the query lies within a word of a matching caption
+        for part in sorted(TOKEN.findall(query), key=len, reverse=True):
+            postings = [self.postings[i] for i in self.tokens_containing(part)]
+            matches = (
+                np.unique(np.concatenate(postings))
+                if postings
+                else np.empty(0, dtype=np.int32)
+            )
+            rows = matches if rows is None else intersect(rows, matches)
+            if len(rows) == 0:
+                return rows
+        if rows is None:
+            rows = np.arange(len(self.captions), dtype=np.int32)
+        # The words narrowed the candidates, the full text decides
+        matches = (query in self.captions[row] for row in rows)
+        return rows[np.fromiter(matches, dtype=bool, count=len(rows))]
@@ -1,2 +1,4 @@
 IMAGE_FORMATS = ["jpeg", "png", "jpg", "canon raw tiff", "compuserve gif"]
 VIDEO_FORMATS = ["mp4", "mov"]
+# Extensions of the images that can be sent as photos, possibly after conversion
+IMAGE_EXTENSIONS = ["jpeg", "jpg", "png", "gif", "tif", "tiff", "cr2", "crw"]
@@ -0,0 +1,217 @@
+import contextlib
+import functools
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Deque, Dict, Iterator, Optional
+
+import numpy as np
+from loguru import logger
+
+QUANTILES = (0.5, 0.95, 0.99)
+# Reused by all timers of disabled metrics
+NULL_TIMER = contextlib.nullcontext()
+
+
+class Samples:
+    """Count and sum of all values of a series, and a window of the recent ones."""
+
+    def __init__(self, window: int):
+        self.count = 0
+        self.sum = 0.0
+        self.recent: Deque[float] = deque(maxlen=window)
+
+    def add(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def quantiles(self) -> Dict[float, float]:
+        if not self.recent:
+            return {q: 0.0 for q in QUANTILES}
+        values = np.quantile(np.fromiter(self.recent, dtype=float), QUANTILES)
+        return dict(zip(QUANTILES, values.tolist()))
+
+
+class Metrics:
+    """
+    Timers, counters and gauges of the bot's hot paths.
+
+    Timers and other observed values (e.g. the number of results of a query)
+    keep their count and sum plus a window of recent values for the p50, p95 and
+    p99. Gauges are functions that are only called when the metrics are read,
+    such as the `stats` of the caches. The metrics can be read as Prometheus text
+    (see `serve`) or logged periodically with `log_summary`.
+
+    Disabled metrics record nothing: `timer` returns a shared no-op context,
+    `timed` returns the function itself and `count` and `observe` return right
+    away.
+    """
+
+    def __init__(
+        self, enabled: bool = True, window: int = 1024, prefix: str = "acdreceive"
+    ):
+        """
+        Args:
+            enabled: Whether to record anything.
+            window: Number of recent values per series used for the quantiles.
+            prefix: Prefix of the metric names in the Prometheus text.
+        """
+        self.enabled = enabled
+        self.window = window
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.counters: Dict[str, float] = defaultdict(float)
+        self.samples: Dict[str, Samples] = {}
+        self.gauges: Dict[str, Callable[[], Any]] = {}
+
+    def count(self, name: str, value: float = 1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] += value
+
+    def observe(self, name: str, value: float):
+        """Records a value of a series, e.g. a duration in seconds."""
+        if not self.enabled:
+            return
+        with self.lock:
+            if name not in self.samples:
+                self.samples[name] = Samples(self.window)
+            self.samples[name].add(value)
+
+    @contextlib.contextmanager
+    def _timer(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(f"{name}_seconds", time.perf_counter() - start)
+
+    def timer(self, name: str):
+        """Context manager that records its duration as `<name>_seconds`."""
+        if not self.enabled:
+            return NULL_TIMER
+        return self._timer(name)
+
+    def timed(self, name: str) -> Callable[[Callable], Callable]:
+        """Decorator that records the duration of every call like `timer`."""
+
+        def decorate(function: Callable) -> Callable:
+            if not self.enabled:
+                return function
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self._timer(name):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorate
+
+    def gauge(self, name: str, function: Callable[[], Any]):
+        """
+        Registers a gauge, read by calling `function`.
+
+        It returns a number or a dict of numbers (e.g. `MediaCache.stats`), whose
+        entries become the gauges `<name>_<key>`.
+        """
+        if self.enabled:
+            self.gauges[name] = function
+
+    def read_gauges(self) -> Dict[str, float]:
+        values = {}
+        for name, function in self.gauges.items():
+            try:
+                value = function()
+            except Exception as e:
+                logger.warning(f"Failed to read gauge {name}: {e}")
+                continue
+            items = value.items() if isinstance(value, dict) else [(None, value)]
+            for key, item in items:
+                if isinstance(item, (int, float)) and not isinstance(item, bool):
+                    values[name if key is None else f"{name}_{key}"] = item
+        return values
+
+    def summary(self) -> Dict[str, Any]:
+        """Returns the current counters, series (with quantiles) and gauges."""
+        with self.lock:
+            counters = dict(self.counters)
+            series = {
+                name: {
+                    "count": samples.count,
+                    "sum": samples.sum,
+                    **{f"p{round(q * 100)}": v for q, v in samples.quantiles().items()},
+                }
+                for name, samples in self.samples.items()
+            }
+        return {"counters": counters, "series": series, "gauges": self.read_gauges()}
+
+    def metric_name(self, name: str) -> str:
+        return f"{self.prefix}_{re.sub(r'[^a-zA-Z0-9_]', '_', name)}"
+
+    def prometheus(self) -> str:
+        """Formats the metrics in the Prometheus text exposition format."""
+        summary = self.summary()
+        lines = []
+        for name, value in sorted(summary["counters"].items()):
+            metric = self.metric_name(name) + "_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        for name, series in sorted(summary["series"].items()):
+            metric = self.metric_name(name)
+            lines.append(f"# TYPE {metric} summary")
+            for q in QUANTILES:
+                value = series[f"p{round(q * 100)}"]
+                lines.append(f'{metric}{{quantile="{q}"}} {value}')
+            lines += [
+                f"{metric}_sum {series['sum']}",
+                f"{metric}_count {series['count']}",
+            ]
+        for name, value in sorted(summary["gauges"].items()):
+            metric = self.metric_name(name)
+            lines += [f"# TYPE {metric} gauge", f"{metric} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def log_summary(self):
+        """Logs the latency quantiles of all series, the counters and gauges."""
+        if not self.enabled:
+            return
+        summary = self.summary()
+        for name, s in sorted(summary["series"].items()):
+            logger.info(
+                f"{name}: n={s['count']} p50={s['p50']:.4g} p95={s['p95']:.4g} "
+                f"p99={s['p99']:.4g}"
+            )
+        logger.info(f"Counters: {summary['counters']}")
+        logger.info(f"Gauges: {summary['gauges']}")
+
+    def serve(
+        self, port: int, host: str = "127.0.0.1"
+    ) -> Optional[ThreadingHTTPServer]:
+        """Serves the Prometheus text on `http://host:port/metrics` from a thread."""
+        if not self.enabled:
+            return None
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logger.info(f"Serving metrics on http://{host}:{server.server_port}/metrics")
+        return server
@@ -0,0 +1,191 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+class Session:
+    """The current search result of a user and how far it was displayed."""
+
+    def __init__(self, rows: np.ndarray, table: pd.DataFrame, now: float):
+        """
+        Args:
+            rows: The result row ids, in display order.
+            table: The table the row ids refer to. Keeping it here lets a session
+                survive a reload of the database.
+            now: The time of creation.
+        """
+        # Replaced as one, as `detach` may run while a page is pulled
+        self.result = (table, rows.astype(np.int32, copy=False))
+        # Size of the copy of the table the session owns once detached
+        self.table_bytes = 0
+        self.cursor = 0
+        self.last_access = now
+        # Media of the page starting at `prefetched[0]`, fetched ahead of time
+        self.prefetched: Optional[Tuple[int, List[Future]]] = None
+
+    @property
+    def table(self) -> pd.DataFrame:
+        return self.result[0]
+
+    @property
+    def rows(self) -> np.ndarray:
+        return self.result[1]
+
+    @property
+    def nbytes(self) -> int:
+        """The memory held by the session alone, not shared with other ones."""
+        return self.rows.nbytes + self.table_bytes
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def page(self, start: int, stop: int) -> pd.DataFrame:
+        """Pulls the rows of one page from the table."""
+        table, rows = self.result
+        return table.iloc[rows[start:stop]]
+
+    def detach(self):
+        """Copies the rows of the result out of the table, so it can be freed."""
+        table, rows = self.result
+        table = table.iloc[rows].reset_index(drop=True)
+        self.table_bytes = int(table.memory_usage(deep=True).sum())
+        self.result = (table, np.arange(len(table), dtype=np.int32))
+
+    def prefetch(self, start: int, media: List[Future]):
+        """Keeps the pending media of the page at `start`, replacing older ones."""
+        self.drop_prefetched()
+        self.prefetched = (start, media)
+
+    def take_prefetched(self, start: int) -> Optional[List[Future]]:
+        """Hands out the prefetched media if they belong to the page at `start`."""
+        if self.prefetched is None or self.prefetched[0] != start:
+            self.drop_prefetched()
+            return None
+        media = self.prefetched[1]
+        self.prefetched = None
+        return media
+
+    def drop_prefetched(self):
+        """Releases the prefetched media, cancelling the downloads not yet started."""
+        if self.prefetched is not None:
+            for medium in self.prefetched[1]:
+                medium.cancel()
+            self.prefetched = None
+
+
+class SessionStore:
+    """
+    Per-user sessions that expire when idle and are bounded in number and size.
+
+    Sessions are kept in least-recently-used order. They are evicted after `ttl`
+    seconds without access, and the least recently used ones are evicted early
+    when there are more than `max_sessions` or their memory (row ids and the
+    tables of detached sessions) exceeds `max_bytes`. The store is safe to use
+    from threads.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 3600,
+        max_sessions: int = 1000,
+        max_bytes: int = 64 * 1024**2,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.sessions: "OrderedDict[Hashable, Session]" = OrderedDict()
+        self.nbytes = 0
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def __contains__(self, user_id: Hashable) -> bool:
+        return self.get(user_id) is not None
+
+    def put(self, user_id: Hashable, rows: np.ndarray, table: pd.DataFrame) -> Session:
+        """Starts a new session for a user, replacing a previous one."""
+        session = Session(rows, table, self.clock())
+        with self.lock:
+            if user_id in self.sessions:
+                self._evict(user_id)
+            self.sessions[user_id] = session
+            self.nbytes += session.nbytes
+            self._expire()
+            self._shrink()
+        return session
+
+    def get(self, user_id: Hashable) -> Optional[Session]:
+        """Returns the session of a user, if it did not expire yet."""
+        with self.lock:
+            self._expire()
+            session = self.sessions.get(user_id)
+            if session is not None:
+                session.last_access = self.clock()
+                self.sessions.move_to_end(user_id)
+            return session
+
+    def discard(self, user_id: Hashable):
+        with self.lock:
+            if user_id in self.sessions:
+                self._evict(user_id)
+
+    def expire(self):
+        """Evicts all sessions that were idle for longer than the TTL."""
+        with self.lock:
+            self._expire()
+
+    def _evict(self, user_id: Hashable):
+        session = self.sessions.pop(user_id)
+        session.drop_prefetched()
+        self.nbytes -= session.nbytes
+
+    def _expire(self):
+        deadline = self.clock() - self.ttl
+        while self.sessions:
+            user_id, session = next(iter(self.sessions.items()))
+            if session.last_access > deadline:
+                break
+            self._evict(user_id)
+
+    def _shrink(self):
+        while len(self.sessions) > self.max_sessions or self.nbytes > self.max_bytes:
+            self._evict(next(iter(self.sessions)))
+
+    def release(self, table: pd.DataFrame) -> int:
+        """
+        Detaches the sessions from a table that was replaced by a reload.
+
+        Every session on the table gets its own copy of its rows, so that the
+        table can be freed. The copies count towards `max_bytes`, and the least
+        recently used sessions are evicted if they exceed it. Sessions whose copy
+        alone would exceed it are evicted without copying.
+
+        Returns:
+            The number of detached sessions that were kept.
+        """
+        with self.lock:
+            users = [u for u, s in self.sessions.items() if s.table is table]
+            # Estimated from the shallow size, which is cheap to take
+            row_bytes = table.memory_usage().sum() / max(len(table), 1)
+            for user_id in users:
+                session = self.sessions[user_id]
+                if session.rows.nbytes + len(session) * row_bytes > self.max_bytes:
+                    self._evict(user_id)
+                    continue
+                self.nbytes -= session.nbytes
+                session.detach()
+                self.nbytes += session.nbytes
+            self._shrink()
+            return sum(user_id in self.sessions for user_id in users)
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {"sessions": len(self.sessions), "bytes": self.nbytes}
@@ -0,0 +1,225 @@
+import asyncio
+import json
+import os
+from collections import defaultdict
+
+import httpx
+import pandas as pd
+import pytest
+from pyacddb.tags import TagMatrix
+
+from .. import asyncbot
+from ..asyncbot import AsyncACDReceive
+from ..botapi import BotAPI, BotAPIError
+from ..cache import MediaCache
+from ..engine import QueryEngine
+from ..fileids import FileIdStore
+from ..metrics import Metrics
+from .test_core import ASSETS
+
+
+class FakeTelegram:
+    """Answers Bot API requests like Telegram, recording the calls."""
+
+    def __init__(self, flood: int = 0, reject: tuple = ()):
+        self.calls = []
+        self.flood = flood
+        self.reject = reject
+        self.uploads = 0
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        method = request.url.path.split("/")[-1]
+        if request.headers["Content-Type"].startswith("multipart"):
+            # Fields as strings, uploaded files as "upload"
+            boundary = request.headers["Content-Type"].split("boundary=")[1]
+            params = {"multipart": True}
+            for part in request.content.split(b"--" + boundary.encode())[1:-1]:
+                head, value = part.strip(b"\r\n").split(b"\r\n\r\n", 1)
+                name = head.split(b'name="')[1].split(b'"')[0].decode()
+                is_file = b"filename=" in head
+                params[name] = "upload" if is_file else value.decode()
+        else:
+            params = json.loads(request.content)
+        self.calls.append((method, params))
+        if self.flood:
+            self.flood -= 1
+            return self.error(429, "Too Many Requests", retry_after=0)
+        if method in self.reject:
+            return self.error(400, "Bad Request: IMAGE_PROCESS_FAILED")
+        if method == "sendMediaGroup":
+            media = json.loads(params["media"]) if "multipart" in params else None
+            media = media or params["media"]
+            return self.ok(
+                [self.message(item["type"], item["media"]) for item in media]
+            )
+        if method in ("sendPhoto", "sendVideo"):
+            kind = method[4:].lower()
+            return self.ok(self.message(kind, params.get(kind, "")))
+        return self.ok(
+            {"message_id": len(self.calls)} if method == "sendMessage" else True
+        )
+
+    def message(self, kind: str, medium: str) -> dict:
+        if medium.startswith("attach://") or not medium.startswith("id-"):
+            self.uploads += 1
+            medium = f"id-{self.uploads}"
+        if kind == "photo":
+            return {"photo": [{"file_id": "thumb"}, {"file_id": medium}]}
+        return {"video": {"file_id": medium}}
+
+    def ok(self, result) -> httpx.Response:
+        return httpx.Response(200, json={"ok": True, "result": result})
+
+    def error(self, status: int, description: str, **parameters) -> httpx.Response:
+        payload = {"ok": False, "error_code": status, "description": description}
+        return httpx.Response(status, json={**payload, "parameters": parameters})
+
+    def texts(self) -> list:
+        return [
+            params["text"] for method, params in self.calls if method == "sendMessage"
+        ]
+
+
+def make_api(telegram: FakeTelegram) -> BotAPI:
+    client = httpx.AsyncClient(transport=httpx.MockTransport(telegram))
+    return BotAPI("token", client=client)
+
+
+def make_bot(db_path: str, telegram: FakeTelegram) -> AsyncACDReceive:
+    """Creates a bot with a loaded database and a fake Bot API."""
+    bot = AsyncACDReceive.__new__(AsyncACDReceive)
+    QueryEngine.__init__(bot, Metrics())
+    bot.user_prefs = defaultdict(dict)
+    bot.api = make_api(telegram)
+    bot.media_cache = MediaCache(os.path.join(os.path.dirname(db_path), "media"))
+    bot.file_ids = FileIdStore(os.path.join(os.path.dirname(db_path), "ids.sqlite"))
+    bot.downloads = asyncio.Semaphore(AsyncACDReceive.MAX_DOWNLOADS)
+    bot.tasks = set()
+    bot.fetched = []
+
+    async def get_medium(path):
+        bot.fetched.append(path)
+        return path.encode()
+
+    bot.get_medium = get_medium
+    bot.db_setup(db_path)
+    return bot
+
+
+@pytest.fixture(autouse=True)
+def no_jokes(monkeypatch):
+    # Otherwise one in a hundred messages is answered with a joke
+    monkeypatch.setattr(asyncbot, "random", lambda: 1.0)
+
+
+@pytest.fixture
+def wide_csv(tmp_path):
+    path = tmp_path / "wholedb.csv"
+    tag_matrix = TagMatrix.from_tag_lists(ASSETS["Tags"])
+    pd.concat([ASSETS, tag_matrix.to_frame()], axis=1).to_csv(path)
+    return str(path)
+
+
+def message(text: str) -> dict:
+    return {"message": {"chat": {"id": 1}, "from": {"id": 7}, "text": text}}
+
+
+def test_send_media_group_uploads():
+    telegram = FakeTelegram()
+
+    async def run():
+        api = make_api(telegram)
+        items = [("photo", b"jpeg", "A"), ("video", "id-9", None)]
+        return await api.send_media_group(1, items)
+
+    messages = asyncio.run(run())
+    method, params = telegram.calls[0]
+    assert method == "sendMediaGroup" and params["multipart"]
+    media = json.loads(params["media"])
+    assert media[0] == {"type": "photo", "media": "attach://file0", "caption": "A"}
+    assert media[1] == {"type": "video", "media": "id-9"}
+    assert messages[1]["video"]["file_id"] == "id-9"
+
+
+def test_flood_control_retried():
+    telegram = FakeTelegram(flood=2)
+    assert asyncio.run(make_api(telegram).send_message(1, "hi")) == {"message_id": 3}
+
+    telegram = FakeTelegram(flood=5)
+    with pytest.raises(BotAPIError, match="Too Many Requests"):
+        asyncio.run(make_api(telegram).send_message(1, "hi"))
+    assert len(telegram.calls) == 4
+
+
+def test_search_sent_as_album(wide_csv):
+    telegram = FakeTelegram()
+    bot = make_bot(wide_csv, telegram)
+    bot.user_prefs[7]["setup_complete"] = True
+
+    async def run():
+        await bot.handle_update(message("haus"))
+        await bot.handle_update(message("haus"))
+
+    asyncio.run(run())
+    assert "Hier sind die 2 Ergebnisse" in telegram.texts()
+    albums = [params for method, params in telegram.calls if method == "sendMediaGroup"]
+    assert len(albums) == 2
+    # The first search uploads the media, the second one reuses their ids
+    assert albums[0]["multipart"]
+    assert [item["media"] for item in albums[1]["media"]] == ["id-1", "id-2"]
+    assert bot.fetched == ["1995\\c.mp4", "1995\\a.jpg"]
+
+
+def test_rejected_items_reported(wide_csv):
+    telegram = FakeTelegram(reject=("sendMediaGroup", "sendVideo"))
+    bot = make_bot(wide_csv, telegram)
+    bot.user_prefs[7]["setup_complete"] = True
+    asyncio.run(bot.handle_update(message("haus")))
+    assert "Failed to retrieve 1995\\c.mp4" in telegram.texts()
+    assert [method for method, _ in telegram.calls].count("sendPhoto") == 1
+
+
+def test_spawned_tasks_kept(wide_csv):
+    bot = make_bot(wide_csv, FakeTelegram())
+
+    async def run():
+        done = asyncio.Event()
+        task = bot.spawn(done.wait())
+        assert bot.tasks == {task}
+        done.set()
+        await task
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert not bot.tasks
+
+
+def test_pagination(wide_csv):
+    telegram = FakeTelegram()
+    bot = make_bot(wide_csv, telegram)
+    bot.user_prefs[7]["setup_complete"] = True
+    bot.PAGESIZE = 1
+    callback = {
+        "callback_query": {
+            "id": "q",
+            "data": "see_more_1",
+            "from": {"id": 7},
+            "message": {"chat": {"id": 1}},
+        }
+    }
+
+    async def run():
+        await bot.handle_update(message("haus"))
+        await bot.handle_update(callback)
+
+    asyncio.run(run())
+    markup = [params for _, params in telegram.calls if "reply_markup" in params]
+    assert markup[0]["reply_markup"]["inline_keyboard"][0][0]["callback_data"] == (
+        "see_more_1"
+    )
+    assert ("answerCallbackQuery", {"callback_query_id": "q"}) in telegram.calls
+    # A single medium per page is sent on its own, the second one was prefetched
+    sent = [params for method, params in telegram.calls if method == "sendVideo"]
+    assert len(sent) == 1
+    assert telegram.texts()[-1] == "Das war alles 🙂"
+    assert bot.fetched == ["1995\\c.mp4", "1995\\a.jpg"]
@@ -0,0 +1,119 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from .. import cache as cache_module
+from ..cache import MediaCache, QueryCache
+from ..utils import parse_blocks
+
+
+def rows(n: int) -> np.ndarray:
+    return np.arange(n, dtype=np.int32)
+
+
+def test_query_key():
+    key = parse_blocks('micha "Münster Kemperweg" cap: Dach date: 1995-1998').key()
+    assert key == (("micha", "münster kemperweg"), "dach", "1995", "1998")
+    assert parse_blocks("Micha Jannis").key() == parse_blocks("jannis micha").key()
+
+
+def test_lru_eviction():
+    cache = QueryCache(maxsize=2)
+    cache.put("a", rows(1))
+    cache.put("b", rows(2))
+    assert cache.get("a").tolist() == [0]
+    cache.put("c", rows(3))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["hits"] == 3 and cache.stats()["misses"] == 1
+
+
+def test_size_eviction():
+    cache = QueryCache(max_bytes=60)
+    cache.put("a", rows(10))
+    cache.put("b", rows(10))
+    assert cache.get("a") is None
+    assert cache.nbytes == 40
+    cache.put("c", rows(100))
+    assert cache.get("c") is None
+
+
+def test_cached_rows_are_read_only():
+    cache = QueryCache()
+    cache.put("a", rows(3))
+    cached = cache.get("a")
+    with pytest.raises(ValueError):
+        cached[0] = 5
+
+
+def test_query_cache_concurrent_access():
+    cache = QueryCache(maxsize=8)
+
+    def work(worker: int):
+        for i in range(500):
+            cache.put((worker + i) % 20, rows(3))
+            cache.get((worker + i + 1) % 20)
+            if i % 100 == 0:
+                cache.clear()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(work, range(8)))
+    assert cache.nbytes == sum(rows.nbytes for rows in cache.entries.values())
+    assert len(cache) <= 8
+
+
+def test_media_cache_versions(tmp_path):
+    cache = MediaCache(str(tmp_path))
+    assert cache.get("1995/a.jpg", "1") is None
+    cache.put("1995/a.jpg", "1", b"abc")
+    assert cache.get("1995/a.jpg", "1") == b"abc"
+    # A changed medium has a new validator and misses
+    assert cache.get("1995/a.jpg", "2") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["bytes_saved"]) == (1, 2, 3)
+
+
+def test_media_cache_lru_persists(tmp_path):
+    cache = MediaCache(str(tmp_path), max_bytes=10)
+    for name in "abc":
+        cache.put(name, "1", b"1234")
+    # "a" was evicted to stay within 10 bytes
+    assert cache.get("a", "1") is None
+    assert cache.stats()["bytes"] == 8
+    assert len([file for file in tmp_path.rglob("*") if file.is_file()]) == 2
+
+    cache.get("b", "1")
+    reopened = MediaCache(str(tmp_path), max_bytes=10)
+    assert len(reopened) == 2
+    assert reopened.get("c", "1") == b"1234"
+    reopened.put("d", "1", b"1234")
+    # "b" was used before "c", so it goes first
+    assert reopened.get("b", "1") is None
+    assert reopened.get("c", "1") == b"1234"
+
+
+def test_media_cache_reads_without_lock(tmp_path, monkeypatch):
+    cache = MediaCache(str(tmp_path))
+    cache.put("a", "1", b"abc")
+    locked = []
+
+    def checked_open(*args, **kwargs):
+        locked.append(cache.lock.locked())
+        return open(*args, **kwargs)
+
+    monkeypatch.setattr(cache_module, "open", checked_open, raising=False)
+    assert cache.get("a", "1") == b"abc"
+    assert locked == [False]
+
+
+def test_media_cache_file_gone(tmp_path):
+    cache = MediaCache(str(tmp_path))
+    cache.put("a", "1", b"abc")
+    os.remove(cache._file(cache.key("a", "1")))
+    # E.g. evicted by another thread between the lookup and the read
+    assert cache.get("a", "1") is None
+    assert len(cache) == 0
+    assert (cache.stats()["bytes"], cache.stats()["misses"]) == (0, 1)
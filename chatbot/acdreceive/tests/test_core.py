@@ -0,0 +1,636 @@
+import os
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+import telegram
+from pyacddb.snapshot import write_snapshot
+from pyacddb.tags import TagMatrix
+
+from ..cache import MediaCache
+from .. import core
+from ..core import ACDReceive
+from ..engine import QueryEngine
+from ..fileids import FileIdStore
+from ..metrics import Metrics
+from ..utils import parse_blocks
+
+ASSETS = pd.DataFrame(
+    {
+        "Name": ["a.jpg", "b.jpg", "c.mp4", "d"],
+        "Folder": ["\\\\S\\Public\\Fotos\\1995\\"] * 4,
+        "FileType": ["JPEG", "Portable Network Graphics", "MP4", "Ordner"],
+        "DBDate": [
+            "19950601 12:00:00.000",
+            "19970315 08:30:00.000",
+            "19980212 18:00:00.000",
+            "19980212 18:00:00.000",
+        ],
+        "Caption": ["Im Garten", None, "Dach (neu)", None],
+        "Author": ["Michael B", None, "Jannis B", None],
+        "AssetCategories": [
+            ["Personen\\Micha", "Orte\\Münster\\Haus"],
+            ["Personen\\Jannis"],
+            ["Orte\\Münster\\Haus"],
+            [],
+        ],
+        "Tags": [["Micha", "Haus"], ["Jannis"], ["Haus"], []],
+    }
+)
+
+
+class FakeUser:
+    id = 7
+
+
+class FakeMessage:
+    """Records the replies the bot sends to a message."""
+
+    chat_id = 1
+    from_user = FakeUser()
+
+    def __init__(self, text: str = ""):
+        self.text = text
+        self.replies = []
+
+    def reply_text(self, text: str, **kwargs):
+        self.replies.append(text)
+        return SimpleNamespace(message_id=len(self.replies))
+
+
+class FakeBot:
+    """Records the media the bot sends and answers with made-up file ids."""
+
+    def __init__(self):
+        self.sent = []
+        self.albums = []
+
+    def message(self, kind: str, medium, caption=None) -> SimpleNamespace:
+        self.sent.append((kind, medium, caption))
+        file = SimpleNamespace(file_id=f"id-{len(self.sent)}")
+        if isinstance(medium, str) and not medium.startswith("id-"):
+            raise telegram.error.BadRequest("Wrong file identifier")
+        if kind == "photo":
+            return SimpleNamespace(photo=[file], video=None)
+        return SimpleNamespace(photo=[], video=file)
+
+    def send_photo(self, chat_id, photo, caption=None, **kwargs):
+        return self.message("photo", photo, caption)
+
+    def send_video(self, chat_id, video, **kwargs):
+        return self.message("video", video)
+
+    def send_chat_action(self, chat_id, action, **kwargs):
+        pass
+
+    def unpin_all_chat_messages(self, chat_id, **kwargs):
+        pass
+
+    def pin_chat_message(self, chat_id, message_id, **kwargs):
+        self.pinned = message_id
+
+    def send_media_group(self, chat_id, media, **kwargs):
+        items = [
+            (
+                item.type,
+                getattr(item.media, "input_file_content", item.media),
+                item.caption,
+            )
+            for item in media
+        ]
+        if any(isinstance(m, str) and not m.startswith("id-") for _, m, _ in items):
+            raise telegram.error.BadRequest("Wrong file identifier")
+        self.albums.append(len(items))
+        return [self.message(*item) for item in items]
+
+
+class FakeJobQueue:
+    """Runs jobs right away, recording their delays."""
+
+    def __init__(self):
+        self.delays = []
+
+    def run_once(self, callback, when, **kwargs):
+        self.delays.append(when)
+        callback(None)
+
+
+class FakeContext:
+    def __init__(self):
+        self.bot = FakeBot()
+        self.job_queue = FakeJobQueue()
+
+
+class FakeUpdate:
+    def __init__(self, text: str = ""):
+        self.message = FakeMessage(text)
+
+
+def make_bot(db_path: str, compact: bool = False) -> ACDReceive:
+    """Creates a bot with a loaded database but without a Telegram connection."""
+    bot = ACDReceive.__new__(ACDReceive)
+    QueryEngine.__init__(bot, Metrics(), compact=compact)
+    bot.user_prefs = defaultdict(dict)
+    bot.fetcher = ThreadPoolExecutor(max_workers=2)
+    bot.delivery = ThreadPoolExecutor(max_workers=1)
+    bot.media_cache = MediaCache(os.path.join(os.path.dirname(db_path), "media"))
+    bot.file_ids = FileIdStore(os.path.join(os.path.dirname(db_path), "ids.sqlite"))
+    bot.get_medium = lambda path: path.encode()
+    bot.storage = "local"
+    bot.db_setup(db_path)
+    return bot
+
+
+def search(bot: ACDReceive, update: FakeUpdate, context: FakeContext):
+    """Handles a search and waits until its results were delivered."""
+    bot.search_tags_in_db(update, context)
+    # The single delivery worker runs tasks in order
+    bot.delivery.submit(lambda: None).result()
+
+
+def names(bot: ACDReceive, rows) -> list:
+    return bot.db.iloc[rows]["Name"].tolist()
+
+
+@pytest.fixture
+def tag_matrix():
+    return TagMatrix.from_tag_lists(ASSETS["Tags"])
+
+
+@pytest.fixture
+def wide_csv(tmp_path, tag_matrix):
+    path = tmp_path / "wholedb.csv"
+    pd.concat([ASSETS, tag_matrix.to_frame()], axis=1).to_csv(path)
+    return str(path)
+
+
+@pytest.fixture
+def sparse_csv(tmp_path, tag_matrix):
+    path = tmp_path / "narrowdb.csv"
+    ASSETS.to_csv(path)
+    tag_matrix.save(tmp_path / "narrowdb.tags.npz")
+    return str(path)
+
+
+def test_db_setup_wide_csv(wide_csv):
+    bot = make_bot(wide_csv)
+    # Newest assets first
+    assert bot.tags == ["Haus", "Jannis", "Micha"]
+    assert bot.db["filetype"].tolist() == ["mp4", "png", "jpeg"]
+    assert bot.db["haus"].tolist() == [True, False, True]
+
+
+def test_db_setup_sparse_sidecar(sparse_csv):
+    bot = make_bot(sparse_csv)
+    assert bot.tags == ["Haus", "Jannis", "Micha"]
+    assert isinstance(bot.db["haus"].dtype, pd.SparseDtype)
+    assert bot.db[bot.db["haus"]]["Name"].tolist() == ["c.mp4", "a.jpg"]
+
+
+def test_db_setup_snapshot(tmp_path, tag_matrix, wide_csv):
+    write_snapshot(str(tmp_path / "wholedb.snapshot"), ASSETS, tag_matrix)
+    bot = make_bot(wide_csv)
+    assert bot.tags == ["Haus", "Jannis", "Micha"]
+    assert "date" not in bot.db.columns
+    assert bot.db["year"].tolist() == [1998, 1997, 1995]
+    assert bot.db[bot.db["micha"]]["Name"].tolist() == ["a.jpg"]
+
+
+@pytest.mark.parametrize("snapshot", [False, True])
+def test_db_setup_compact(tmp_path, tag_matrix, wide_csv, snapshot):
+    if snapshot:
+        write_snapshot(str(tmp_path / "wholedb.snapshot"), ASSETS, tag_matrix)
+    bot = make_bot(wide_csv, compact=True)
+    assert bot.tags == ["Haus", "Jannis", "Micha"]
+    for column in ["folder", "filetype", "author"]:
+        assert isinstance(bot.db[column].dtype, pd.CategoricalDtype)
+    assert bot.db["filetype"].tolist() == ["mp4", "png", "jpeg"]
+    assert not {"year", "dbdate", "tags", "haus"} & set(bot.db.columns)
+    assert names(bot, bot.query(parse_blocks("haus"))[0]) == ["c.mp4", "a.jpg"]
+    row = bot.db.iloc[2]
+    assert bot.caption(row) == "Im Garten (von Michael am 01.06.1995 12:00)"
+    assert bot.asset_validator(row) == "19950601 12:00:00.000"
+
+
+def write_delta(path: str, tag_matrix: TagMatrix) -> dict:
+    """Writes generation 1 of the snapshot of `ASSETS`, returning its delta."""
+    # b.jpg got a new caption and tag, c.mp4 was deleted and e.jpg added
+    fresh = pd.concat([ASSETS.iloc[[1]], ASSETS.iloc[[0]]], ignore_index=True)
+    fresh.loc[0, "Caption"] = "Neu"
+    fresh.loc[1, "Name"] = "e.jpg"
+    fresh.at[1, "AssetCategories"] = ["Orte\\Köln"]
+    fresh["Tags"] = [["Jannis", "Dach"], ["Micha"]]
+    delta = {
+        "added": [ASSETS.Folder[0] + "e.jpg"],
+        "changed": [ASSETS.Folder[1] + "b.jpg"],
+        "removed": [ASSETS.Folder[2] + "c.mp4"],
+        "base": 0,
+        "start": 2,
+    }
+    write_snapshot(
+        path,
+        pd.concat([ASSETS.iloc[[0, 3]], fresh], ignore_index=True),
+        tag_matrix.take([0, 3]).append(TagMatrix.from_tag_lists(fresh["Tags"])),
+        generation=1,
+        delta=delta,
+    )
+    return delta
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_apply_delta(tmp_path, tag_matrix, wide_csv, compact):
+    path = str(tmp_path / "wholedb.snapshot")
+    write_snapshot(path, ASSETS, tag_matrix)
+    bot = make_bot(wide_csv, compact=compact)
+    assert bot.generation == 0
+
+    delta = write_delta(path, tag_matrix)
+    assert bot.apply_delta(wide_csv).removed == delta["removed"]
+    assert bot.generation == 1
+    assert bot.db["Name"].tolist() == ["b.jpg", "a.jpg", "e.jpg"]
+    assert bot.db["caption"].tolist() == ["Neu", "Im Garten", "Im Garten"]
+    assert bot.tags == ["Dach", "Haus", "Jannis", "Micha"]
+    assert names(bot, bot.query(parse_blocks("micha"))[0]) == ["a.jpg", "e.jpg"]
+    if compact:
+        assert isinstance(bot.db["folder"].dtype, pd.CategoricalDtype)
+    else:
+        assert bot.db["micha"].tolist() == [False, True, True]
+        assert bot.db["dach"].tolist() == [True, False, False]
+    assert bot.tag_distribution()[0].endswith("Dach: 1\nHaus: 1\nJannis: 1\nMicha: 2\n")
+
+    # A delta that does not follow the loaded generation triggers a reload
+    bot.state.generation = 5
+    assert bot.apply_delta(wide_csv) is None
+    assert bot.generation == 1
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_apply_delta_matches_reload(tmp_path, wide_csv, compact):
+    path = str(tmp_path / "wholedb.snapshot")
+    # The folder "d" carries a tag that no medium has
+    tag_matrix = TagMatrix.from_tag_lists(list(ASSETS["Tags"][:3]) + [["Paris"]])
+    write_snapshot(path, ASSETS, tag_matrix)
+    bot = make_bot(wide_csv, compact=compact)
+    write_delta(path, tag_matrix)
+    bot.apply_delta(wide_csv)
+    merged, built = bot.state, make_bot(wide_csv, compact=compact).state
+
+    pd.testing.assert_frame_equal(merged.db, built.db, check_categorical=False)
+    assert merged.tags == built.tags == ["Dach", "Haus", "Jannis", "Micha"]
+    assert merged.tag_messages == built.tag_messages
+    assert merged.tag_index.postings.keys() == built.tag_index.postings.keys()
+    for key, rows in built.tag_index.postings.items():
+        assert merged.tag_index[key].tolist() == rows.tolist()
+    assert sorted(merged.categories.paths) == sorted(built.categories.paths)
+    for path in built.categories.paths:
+        assert merged.categories[path].tolist() == built.categories[path].tolist()
+        assert merged.categories.subcategories(path) == (
+            built.categories.subcategories(path)
+        )
+    assert "Orte\\Köln" in merged.categories
+    assert merged.caption_index.captions == built.caption_index.captions
+    assert sorted(merged.caption_index.tokens) == sorted(built.caption_index.tokens)
+    for text in ["garten", "neu", "im", "dach"]:
+        assert merged.caption_index.search(text).tolist() == (
+            built.caption_index.search(text).tolist()
+        )
+    assert merged.date_index.negated_keys.tolist() == (
+        built.date_index.negated_keys.tolist()
+    )
+
+
+def test_tag_distribution(wide_csv):
+    bot = make_bot(wide_csv)
+    assert bot.tag_distribution() == [
+        "Die verfügbaren Tags und ihre Verbreitung:\n\nHaus: 2\nJannis: 1\nMicha: 1\n"
+    ]
+    bot.state.tags = [f"Tag{i:03}" for i in range(100)]
+    bot.tag_index.postings.update({tag.lower(): [0] for tag in bot.tags})
+    messages = bot.state.build_tag_messages()
+    assert len(messages) == 2
+    assert all(len(message) <= 1000 for message in messages)
+
+
+def test_lookup_tags(wide_csv):
+    bot = make_bot(wide_csv)
+    update = FakeUpdate()
+    result = bot.lookup(update, parse_blocks("haus micha dach"))
+    assert names(bot, result) == ["a.jpg"]
+    assert update.message.replies == [
+        "Tag Haus gefunden, jetzt noch 2 Einträge.",
+        "Tag Micha gefunden, jetzt noch 1 Einträge.",
+        "Tag Dach nicht in der Datenbank vorhanden! Wird ignoriert.",
+    ]
+    assert len(bot.lookup(FakeUpdate(), parse_blocks("jannis micha"))) == 0
+    # Regular columns are no tags
+    assert len(bot.lookup(FakeUpdate(), parse_blocks("caption"))) == len(bot.db)
+
+
+@pytest.mark.parametrize(
+    "message, expected",
+    [
+        ("date: 1995-1998", ["c.mp4", "b.jpg", "a.jpg"]),
+        ("date: 19950601-19980130", ["b.jpg", "a.jpg"]),
+        ("date: 199506-199703", ["b.jpg", "a.jpg"]),
+        ("date: 19950602-19970314", []),
+        ("haus date: 1996-1999", ["c.mp4"]),
+    ],
+)
+def test_lookup_date(wide_csv, message, expected):
+    bot = make_bot(wide_csv)
+    assert names(bot, bot.lookup(FakeUpdate(), parse_blocks(message))) == expected
+
+
+@pytest.mark.parametrize("snapshot", [False, True])
+def test_lookup_categories(tmp_path, tag_matrix, wide_csv, snapshot):
+    if snapshot:
+        write_snapshot(str(tmp_path / "wholedb.snapshot"), ASSETS, tag_matrix)
+    bot = make_bot(wide_csv)
+    update = FakeUpdate()
+    result = bot.lookup(update, parse_blocks("orte\\münster micha"))
+    assert names(bot, result) == ["a.jpg"]
+    assert update.message.replies[0] == (
+        "Kategorie Orte\\münster gefunden, jetzt noch 2 Einträge."
+    )
+    result = bot.lookup(FakeUpdate(), parse_blocks("personen\\"))
+    assert names(bot, result) == ["b.jpg", "a.jpg"]
+    update = FakeUpdate()
+    assert len(bot.lookup(update, parse_blocks("orte\\köln"))) == 3
+    assert "nicht in der Datenbank" in update.message.replies[0]
+
+
+def test_lookup_caption(wide_csv):
+    bot = make_bot(wide_csv)
+    result = bot.lookup(FakeUpdate(), parse_blocks("cap: (neu)"))
+    assert names(bot, result) == ["c.mp4"]
+    result = bot.lookup(FakeUpdate(), parse_blocks("haus cap: garten"))
+    assert names(bot, result) == ["a.jpg"]
+
+
+def test_lookup_cache(wide_csv):
+    bot = make_bot(wide_csv)
+    bot.lookup(FakeUpdate(), parse_blocks("haus micha"))
+    update = FakeUpdate()
+    result = bot.lookup(update, parse_blocks("Micha HAUS"))
+    assert names(bot, result) == ["a.jpg"]
+    assert len(update.message.replies) == 2
+    assert bot.query_cache.stats()["hits"] == 1
+
+    bot.db_setup(wide_csv)
+    assert len(bot.query_cache) == 0
+
+
+def test_query_notes_follow_tag_order(wide_csv):
+    bot = make_bot(wide_csv)
+    _, notes = bot.query(parse_blocks("micha haus"))
+    rows, cached_notes = bot.query(parse_blocks("haus micha"))
+    assert bot.query_cache.stats()["hits"] == 1
+    assert names(bot, rows) == ["a.jpg"]
+    assert notes == [
+        "Tag Micha gefunden, jetzt noch 1 Einträge.",
+        "Tag Haus gefunden, jetzt noch 1 Einträge.",
+    ]
+    assert cached_notes == [
+        "Tag Haus gefunden, jetzt noch 2 Einträge.",
+        "Tag Micha gefunden, jetzt noch 1 Einträge.",
+    ]
+
+
+def write_wide_csv(path: str, assets: pd.DataFrame):
+    tag_matrix = TagMatrix.from_tag_lists(assets["Tags"])
+    pd.concat([assets, tag_matrix.to_frame()], axis=1).to_csv(path)
+
+
+def test_reload_keeps_sessions(wide_csv):
+    bot = make_bot(wide_csv)
+    bot.PAGESIZE = 1
+    update, context = FakeUpdate("haus"), FakeContext()
+    search(bot, update, context)
+    previous = bot.state
+
+    fresh = ASSETS.copy()
+    fresh["Tags"] = [["Micha"], ["Haus"], ["Jannis"], []]
+    write_wide_csv(wide_csv, fresh)
+    assert bot.reload() is None
+    assert bot.state.version == previous.version + 1
+    assert names(bot, bot.query(parse_blocks("haus"))[0]) == ["b.jpg"]
+    # The results of the earlier search are shown from a copy of its rows, so
+    # that the earlier table can be freed
+    session = bot.sessions.get(FakeUser.id)
+    assert session.table is not previous.db
+    assert session.page(0, 2)["Name"].tolist() == ["c.mp4", "a.jpg"]
+    bot.keep_displaying_results(update, context, FakeUser.id, start_index=1)
+    assert context.bot.sent[-1][1] == b"1995\\a.jpg"
+
+
+def test_watch_reloads_changed_db(wide_csv):
+    bot = make_bot(wide_csv)
+    write_wide_csv(wide_csv, ASSETS.iloc[:2])
+    bot.watch(interval=0.01)
+    try:
+        # The duration is recorded right after the new state is swapped in
+        for _ in range(500):
+            if "reload_seconds" in bot.metrics.summary()["series"]:
+                break
+            threading.Event().wait(0.01)
+    finally:
+        bot.stop_watching.set()
+    assert bot.db["Name"].tolist() == ["b.jpg", "a.jpg"]
+    assert bot.metrics.summary()["series"]["reload_seconds"]["count"] == 1
+
+
+def test_search_and_paginate(wide_csv):
+    bot = make_bot(wide_csv)
+    bot.PAGESIZE = 1
+    update, context = FakeUpdate("haus"), FakeContext()
+    search(bot, update, context)
+    assert update.message.replies[-3:] == [
+        "2 Ergebnisse, hier sind die ersten 1",
+        "Video mp4",
+        "Willst du mehr sehen?",
+    ]
+    assert context.bot.sent == [("video", b"1995\\c.mp4", None)]
+    assert bot.sessions.get(FakeUser.id).cursor == 1
+
+    bot.keep_displaying_results(update, context, FakeUser.id, start_index=1)
+    assert context.bot.sent[-1] == (
+        "photo",
+        b"1995\\a.jpg",
+        "Im Garten (von Michael am 01.06.1995 12:00)",
+    )
+    assert update.message.replies[-1] == "Das war alles 🙂"
+
+    bot.sessions.discard(FakeUser.id)
+    bot.keep_displaying_results(update, context, FakeUser.id, start_index=1)
+    expired = "Die Ergebnisse sind abgelaufen, bitte such nochmal!"
+    assert update.message.replies[-1] == expired
+
+
+def test_prefetch_next_page(wide_csv):
+    bot = make_bot(wide_csv)
+    bot.PAGESIZE = 1
+    fetched = []
+    bot.get_medium = lambda path: fetched.append(path) or path.encode()
+    update, context = FakeUpdate("haus"), FakeContext()
+    search(bot, update, context)
+    session = bot.sessions.get(FakeUser.id)
+    start, media = session.prefetched
+    assert start == 1
+    assert [medium.result() for medium in media] == [b"1995\\a.jpg"]
+
+    # The second page is sent from the prefetched media
+    bot.keep_displaying_results(update, context, FakeUser.id, start_index=1)
+    assert context.bot.sent[-1][1] == b"1995\\a.jpg"
+    assert sorted(fetched) == ["1995\\a.jpg", "1995\\c.mp4"]
+    assert session.prefetched is None
+
+    # Failing downloads are reported per medium
+    bot.get_medium = lambda path: 1 / 0
+    bot.file_ids.discard("1995\\c.mp4")
+    bot.keep_displaying_results(update, context, FakeUser.id)
+    assert update.message.replies[-2] == "Failed to retrieve 1995\\c.mp4"
+
+
+def test_get_medium_local(wide_csv, tmp_path):
+    bot = make_bot(wide_csv)
+    bot.data_path = str(tmp_path / "storage")
+    medium = tmp_path / "storage" / "1995" / "c.mp4"
+    medium.parent.mkdir(parents=True)
+    medium.write_bytes(b"v1")
+    assert bot.get_medium_local("1995/c.mp4") == b"v1"
+    assert bot.get_medium_local("1995/c.mp4") == b"v1"
+    assert bot.media_cache.stats()["hits"] == 1
+
+    # A modified file is read again
+    medium.write_bytes(b"v2 ")
+    assert bot.get_medium_local("1995/c.mp4") == b"v2 "
+    assert bot.media_cache.stats()["misses"] == 2
+
+    # Photos that cannot be decoded are not retrievable, nor cached
+    (medium.parent / "a.jpg").write_bytes(b"not a jpeg")
+    assert bot.get_medium_local("1995/a.jpg") is None
+    assert len(bot.media_cache) == 2
+
+
+def test_file_ids_reused(wide_csv):
+    bot = make_bot(wide_csv)
+    fetched = []
+    bot.get_medium = lambda path: fetched.append(path) or path.encode()
+    update, context = FakeUpdate("haus"), FakeContext()
+    search(bot, update, context)
+    assert [medium for _, medium, _ in context.bot.sent] == [
+        b"1995\\c.mp4",
+        b"1995\\a.jpg",
+    ]
+    assert len(bot.file_ids) == 2
+
+    # Shown again from the recorded ids, without retrieving the media
+    search(bot, update, context)
+    assert [medium for _, medium, _ in context.bot.sent[2:]] == ["id-1", "id-2"]
+    assert len(fetched) == 2
+
+    # A changed asset is uploaded again
+    bot.db.loc[bot.db["Name"] == "a.jpg", "dbdate"] = "19950601 13:00:00.000"
+    search(bot, update, context)
+    assert context.bot.sent[-1][1] == b"1995\\a.jpg"
+    assert bot.file_ids.get("1995\\a.jpg", "19950601 13:00:00.000") == "id-6"
+
+    # Ids that Telegram rejects are dropped and the medium is uploaded again
+    bot.file_ids.put("1995\\c.mp4", "19980212 18:00:00.000", "stale")
+    search(bot, update, context)
+    assert [medium for _, medium, _ in context.bot.sent[-3:-1]] == [
+        "stale",
+        b"1995\\c.mp4",
+    ]
+    assert bot.file_ids.get("1995\\c.mp4", "19980212 18:00:00.000") == "id-8"
+
+
+def test_pages_sent_as_albums(wide_csv):
+    bot = make_bot(wide_csv)
+    update, context = FakeUpdate("haus"), FakeContext()
+    search(bot, update, context)
+    assert context.bot.albums == [2]
+    assert context.bot.sent == [
+        ("video", b"1995\\c.mp4", "Dach (neu) (von Jannis am 12.02.1998 18:00)"),
+        ("photo", b"1995\\a.jpg", "Im Garten (von Michael am 01.06.1995 12:00)"),
+    ]
+    assert "Video mp4" not in update.message.replies
+
+    # Items beyond the album size are sent in further albums or one by one
+    bot.ALBUM_SIZE = 1
+    search(bot, update, context)
+    assert context.bot.albums == [2]
+    assert [medium for _, medium, _ in context.bot.sent[2:]] == ["id-1", "id-2"]
+
+
+def test_rejected_items_reported(wide_csv):
+    bot = make_bot(wide_csv)
+    update, context = FakeUpdate("haus"), FakeContext()
+
+    def reject(*args, **kwargs):
+        raise telegram.error.BadRequest("Image_process_failed")
+
+    context.bot.send_media_group = reject
+    context.bot.send_video = reject
+    search(bot, update, context)
+    assert "Failed to retrieve 1995\\c.mp4" in update.message.replies
+    assert context.bot.sent == [
+        ("photo", b"1995\\a.jpg", "Im Garten (von Michael am 01.06.1995 12:00)")
+    ]
+
+    # Also when a single medium is sent
+    bot.ALBUMS = False
+    search(bot, update, context)
+    assert update.message.replies.count("Failed to retrieve 1995\\c.mp4") == 2
+    assert update.message.replies[-1] == "Das war alles 🙂"
+    assert len(context.bot.sent) == 2
+
+
+def test_metrics_recorded(wide_csv):
+    bot = make_bot(wide_csv)
+    bot.register_gauges()
+    search(bot, FakeUpdate("haus"), FakeContext())
+    summary = bot.metrics.summary()
+    assert summary["counters"] == {"queries": 1}
+    series = summary["series"]
+    for name in ("parse_blocks", "lookup", "send_album"):
+        assert series[f"{name}_seconds"]["count"] == 1
+    assert series["result_rows"]["p50"] == 2
+    assert summary["gauges"]["sessions_sessions"] == 1
+    assert summary["gauges"]["file_ids_entries"] == 2
+
+
+def test_delivery_does_not_block_handler(wide_csv):
+    bot = make_bot(wide_csv)
+    available = threading.Event()
+    bot.get_medium = lambda path: available.wait() and path.encode()
+    update, context = FakeUpdate("haus"), FakeContext()
+    # The handler returns while the storage is still stuck
+    bot.search_tags_in_db(update, context)
+    assert update.message.replies[-1] == "Hier sind die 2 Ergebnisse"
+    assert context.bot.sent == []
+
+    available.set()
+    bot.delivery.submit(lambda: None).result()
+    assert len(context.bot.sent) == 2
+    assert update.message.replies[-1] == "Das war alles 🙂"
+
+
+def test_delayed_messages_are_scheduled(wide_csv, monkeypatch):
+    monkeypatch.setattr(core, "random", lambda: 1.0)
+    bot = make_bot(wide_csv)
+    update, context = FakeUpdate("Tags"), FakeContext()
+    bot.handle_text_message(update, context)
+    assert update.message.replies[:2] == [
+        "Willkommen!\nDas is Michaels ACDReceiver!📷",
+        "Hier ist die Anleitung!",
+    ]
+    assert context.bot.pinned == 3
+    assert context.job_queue.delays == [0.7, 1.7]
+
+    bot.handle_text_message(update, context)
+    assert update.message.replies[-1].startswith("Die verfügbaren Tags")
+    assert context.job_queue.delays == [0.7, 1.7, 0.6]
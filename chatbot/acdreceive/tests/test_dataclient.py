@@ -0,0 +1,136 @@
+import asyncio
+import base64
+import io
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from ..dataclient import AsyncClient, Client
+from ..imaging import fit_image
+
+AUTH = "Basic " + base64.b64encode(b"user:secret").decode()
+
+
+class StorageHandler(BaseHTTPRequestHandler):
+    # Keep-alive needs HTTP/1.1 with explicit content lengths
+    protocol_version = "HTTP/1.1"
+    failures = {}
+
+    def do_GET(self):
+        if self.headers.get("Authorization") != AUTH:
+            return self.reply(401, b"")
+        remaining = self.failures.get(self.path, 0)
+        if remaining:
+            self.failures[self.path] = remaining - 1
+            return self.reply(503, b"")
+        if self.path.endswith("missing.jpg"):
+            return self.reply(404, b"")
+        return self.reply(200, self.path.encode())
+
+    def do_HEAD(self):
+        if self.path.endswith("missing.jpg"):
+            return self.reply(404, b"", head=True)
+        return self.reply(200, self.path.encode(), head=True)
+
+    def reply(self, status: int, body: bytes, head: bool = False):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        if status == 200:
+            self.send_header("ETag", f'"{len(body)}"')
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StorageHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+    StorageHandler.failures.clear()
+
+
+def make_client(host: str, **kwargs) -> Client:
+    return Client(host, "root", "user", "secret", backoff_factor=0, **kwargs)
+
+
+def test_reuses_connections(server):
+    client = make_client(server)
+    for i in range(5):
+        assert (
+            client.get_file_content(f"1995\\{i}.jpg") == f"/root/1995/{i}.jpg".encode()
+        )
+    stats = client.stats()
+    assert stats["requests"] == 5
+    assert stats["connections"] == 1
+    assert stats["reused"] == 4
+    assert stats["failures"] == 0
+
+
+def test_retries_unavailable(server):
+    StorageHandler.failures["/root/a.jpg"] = 2
+    client = make_client(server, retries=3)
+    assert client.get_file_content("a.jpg") == b"/root/a.jpg"
+    assert client.stats()["failures"] == 0
+
+    StorageHandler.failures["/root/b.jpg"] = 5
+    assert client.get_file_content("b.jpg") is None
+    assert client.stats()["failures"] == 1
+
+
+def test_failures(server):
+    client = make_client(server)
+    assert client.get_file_content("missing.jpg") is None
+    assert Client(server, "root", "user", "wrong").get_file_content("a.jpg") is None
+
+    # Connection errors are logged instead of raised
+    unreachable = make_client("http://127.0.0.1:9", retries=0, timeout=1)
+    assert unreachable.get_file_content("a.jpg") is None
+    assert unreachable.stats()["failures"] == 1
+
+
+def test_validator(server):
+    client = make_client(server)
+    assert client.get_validator("1995\\a.jpg") == '"16"'
+    assert client.get_validator("missing.jpg") is None
+    assert client.stats()["requests"] == 2
+
+
+def test_downscale_image_delegates(server):
+    pixels = np.random.default_rng(0).integers(0, 256, (600, 800, 3), np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="PNG")
+    with pytest.deprecated_call():
+        content = make_client(server).downscale_image(buffer.getvalue())
+    assert content == fit_image(buffer.getvalue())
+
+
+def test_async_client(server):
+    async def run():
+        client = AsyncClient(server, "root", "user", "secret", backoff_factor=0)
+        StorageHandler.failures["/root/b.jpg"] = 1
+        contents = await asyncio.gather(
+            *(client.get_file_content(f"1995\\{i}.jpg") for i in range(20)),
+            client.get_file_content("b.jpg"),
+            client.get_file_content("missing.jpg"),
+        )
+        validator = await client.get_validator("1995\\a.jpg")
+        await client.aclose()
+        return contents, validator, client.stats()
+
+    contents, validator, stats = asyncio.run(run())
+    assert contents[:20] == [f"/root/1995/{i}.jpg".encode() for i in range(20)]
+    assert contents[20:] == [b"/root/b.jpg", None]
+    assert validator == '"16"'
+    # One retry of b.jpg
+    assert stats["requests"] == 24
+    assert stats["failures"] == 1
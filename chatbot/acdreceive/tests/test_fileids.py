@@ -0,0 +1,37 @@
+import os
+
+import pytest
+
+from ..fileids import FileIdStore, file_ids_path
+
+
+def test_file_ids(tmp_path):
+    path = str(tmp_path / "ids.sqlite")
+    store = FileIdStore(path)
+    assert store.get("1995/a.jpg", "v1") is None
+    store.put("1995/a.jpg", "v1", "AgAD1")
+    assert store.get("1995/a.jpg", "v1") == "AgAD1"
+    # Another version of the asset does not match and replaces the id
+    assert store.get("1995/a.jpg", "v2") is None
+    store.put("1995/a.jpg", "v2", "AgAD2")
+    assert len(store) == 1
+    assert store.stats()["hits"] == 1
+    store.close()
+
+    reopened = FileIdStore(path)
+    assert reopened.get("1995/a.jpg", "v2") == "AgAD2"
+    reopened.discard("1995/a.jpg")
+    assert reopened.get("1995/a.jpg", "v2") is None
+
+
+@pytest.mark.parametrize(
+    "db_path",
+    [
+        "data/wholedb.csv",
+        "data/wholedb.snapshot",
+        "data/wholedb.snapshot/",
+        "data/wholedb.snapshot/v3-0123abcd",
+    ],
+)
+def test_file_ids_path_outside_snapshot(db_path):
+    assert file_ids_path(db_path) == os.path.join("data", "wholedb.file_ids.sqlite")
@@ -0,0 +1,71 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from ..imaging import fit_image, prepare_photo
+
+
+def encode(image: Image.Image, **kwargs) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, **kwargs)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def noise() -> Image.Image:
+    # Noise barely compresses, so it is a worst case for the size target
+    pixels = np.random.default_rng(0).integers(0, 256, (1200, 1600, 3), np.uint8)
+    return Image.fromarray(pixels)
+
+
+def test_fit_image(noise):
+    content = encode(noise, format="JPEG", quality=95)
+    fitted = fit_image(content, max_bytes=300_000, max_side=800)
+    assert len(fitted) <= 300_000
+    image = Image.open(io.BytesIO(fitted))
+    assert image.format == "JPEG" and max(image.size) == 800
+
+    # Too small for the lowest quality at 800 pixels, so it is downsampled
+    fitted = fit_image(content, max_bytes=20_000, max_side=800)
+    assert len(fitted) <= 20_000
+    assert max(Image.open(io.BytesIO(fitted)).size) < 800
+
+
+def test_prepare_photo_keeps_small_photos(noise):
+    content = encode(noise.resize((100, 75)), format="PNG")
+    assert prepare_photo(content) is content
+    assert len(prepare_photo(content, limit=1000)) < len(content)
+
+
+@pytest.mark.parametrize(
+    "image, kwargs",
+    [
+        (Image.new("P", (40, 30)), {"format": "GIF", "transparency": 0}),
+        (Image.new("I;16", (40, 30), 40000), {"format": "TIFF"}),
+        (Image.new("RGBA", (40, 30), (255, 0, 0, 128)), {"format": "TIFF"}),
+    ],
+)
+def test_prepare_photo_converts(image, kwargs):
+    photo = Image.open(io.BytesIO(prepare_photo(encode(image, **kwargs))))
+    assert photo.format == "JPEG" and photo.mode == "RGB"
+    assert photo.size == (40, 30)
+
+
+def test_prepare_photo_raw_preview(noise):
+    preview = encode(noise.resize((160, 120)), format="JPEG")
+    thumbnail = encode(noise.resize((16, 12)), format="JPEG")
+    raw = b"not a decodable raw" + thumbnail + b"\x00" * 10 + preview
+    photo = Image.open(io.BytesIO(prepare_photo(raw)))
+    assert photo.size == (160, 120)
+
+
+def test_prepare_photo_undecodable_tiff(noise):
+    # Opens as TIFF, but its pixel data is cut off
+    tiff = encode(noise.resize((160, 120)), format="TIFF")[:1000]
+    assert prepare_photo(tiff) is None
+
+    preview = encode(noise.resize((80, 60)), format="JPEG")
+    photo = Image.open(io.BytesIO(prepare_photo(tiff + preview)))
+    assert photo.format == "JPEG" and photo.size == (80, 60)
@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pyacddb.tags import TagMatrix
+
+from ..index import CaptionIndex, DateIndex, TagIndex, date_key, intersect
+
+
+@pytest.mark.parametrize(
+    "rows, other, expected",
+    [
+        ([1, 3, 5, 7], [3, 4, 7, 9, 11], [3, 7]),
+        ([2, 4], [1, 3, 5], []),
+        ([], [1, 2], []),
+        ([8, 9], [9], [9]),
+    ],
+)
+def test_intersect(rows, other, expected):
+    result = intersect(np.array(rows, dtype=np.int32), np.array(other, dtype=np.int32))
+    assert result.tolist() == expected
+
+
+def test_tag_index():
+    index = TagIndex(
+        TagMatrix.from_tag_lists([["Haus", "Micha"], ["haus"], [], ["Micha"]])
+    )
+    assert "HAUS" in index and "jannis" not in index
+    assert index["haus"].tolist() == [0, 1]
+    assert index["Micha"].dtype == np.int32
+    assert intersect(index["haus"], index["micha"]).tolist() == [0]
+
+
+def test_tag_index_merged():
+    previous = TagIndex(TagMatrix.from_tag_lists([["Haus"], ["Micha"], ["haus"]]))
+    # Row 1 was removed, a new row with "Micha" went between rows 0 and 2
+    renumber = np.array([0, -1, 2], dtype=np.int32)
+    fresh = TagMatrix.from_tag_lists([["Micha", "Dach"]])
+    index = TagIndex.merged(previous, renumber, fresh, np.array([1], dtype=np.int32))
+    assert index.postings.keys() == {"haus", "micha", "dach"}
+    assert index["haus"].tolist() == [0, 2]
+    assert index["micha"].tolist() == [1]
+    assert index["dach"].dtype == np.int32
+
+
+def test_date_key():
+    assert date_key("1998") == 19980101
+    assert date_key("1998", end=True) == 19981231
+    assert date_key("199802", end=True) == 19980231
+    assert date_key("19980130", end=True) == 19980130
+
+
+def test_date_index_crosses_years():
+    dates = pd.to_datetime(
+        pd.Series(["1998-02-01", "1997-03-15", "1996-12-31", "1995-05-01", None])
+    )
+    index = DateIndex(dates)
+    # Months before June and after January must not be dropped across years
+    assert index.span(19950601, 19980130) == slice(1, 3)
+    assert index.span(19950101, 19991231) == slice(0, 4)
+    assert index.span(20000101, 20011231) == slice(0, 0)
+    with pytest.raises(ValueError):
+        DateIndex(dates[::-1].reset_index(drop=True))
+
+
+@pytest.fixture
+def caption_index():
+    return CaptionIndex(
+        ["Im Garten", "Dach (neu) in Münster", "", "Gartenhaus am Kemperweg", "a+b"]
+    )
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("garten", [0, 3]),
+        ("ARTEN", [0, 3]),
+        ("im gar", [0]),
+        ("muenster", [1]),
+        ("münster", [1]),
+        ("(neu)", [1]),
+        ("dach (neu", [1]),
+        ("a+b", [4]),
+        (".*", []),
+        ("m", [0, 1, 3]),
+        ("haus am kemp", [3]),
+        ("zoo", []),
+    ],
+)
+def test_caption_index(caption_index, text, expected):
+    assert caption_index.search(text).tolist() == expected
+
+
+def test_caption_index_restricted_rows(caption_index):
+    rows = np.array([1, 3], dtype=np.int32)
+    assert caption_index.search("garten", rows).tolist() == [3]
+
+
+def test_caption_index_merged(caption_index):
+    # Rows 1 and 4 were removed, two captions were added in front of row 3
+    renumber = np.array([0, -1, 1, 4, -1], dtype=np.int32)
+    fresh = ["Garten in Köln", "Neues Dach"]
+    positions = np.array([2, 3], dtype=np.int32)
+    index = CaptionIndex.merged(caption_index, renumber, fresh, positions)
+    built = CaptionIndex(
+        ["Im Garten", "", "Garten in Köln", "Neues Dach", "Gartenhaus am Kemperweg"]
+    )
+    assert index.captions == built.captions
+    assert sorted(index.tokens) == sorted(built.tokens)
+    for text in ["garten", "dach", "koeln", "münster", "a+b", "m", "in"]:
+        assert index.search(text).tolist() == built.search(text).tolist()
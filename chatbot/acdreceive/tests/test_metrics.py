@@ -0,0 +1,72 @@
+import urllib.request
+
+from ..metrics import NULL_TIMER, Metrics
+
+
+def test_series_quantiles():
+    metrics = Metrics(window=100)
+    for value in range(1, 201):
+        metrics.observe("result_rows", value)
+    series = metrics.summary()["series"]["result_rows"]
+    assert series["count"] == 200
+    assert series["sum"] == sum(range(1, 201))
+    # Quantiles over the 100 most recent values
+    assert series["p50"] == 150.5
+    assert 199 < series["p99"] <= 200
+
+
+def test_timers_and_counters():
+    metrics = Metrics()
+    with metrics.timer("lookup"):
+        pass
+    double = metrics.timed("double")(lambda x: 2 * x)
+    assert double(2) == 4
+    metrics.count("queries")
+    metrics.count("queries", 2)
+    summary = metrics.summary()
+    assert summary["counters"] == {"queries": 3}
+    assert summary["series"]["lookup_seconds"]["count"] == 1
+    assert summary["series"]["double_seconds"]["count"] == 1
+
+
+def test_disabled():
+    metrics = Metrics(enabled=False)
+
+    def function():
+        pass
+
+    assert metrics.timer("lookup") is NULL_TIMER
+    assert metrics.timed("function")(function) is function
+    metrics.count("queries")
+    metrics.observe("result_rows", 1)
+    metrics.gauge("sessions", lambda: 1)
+    assert metrics.summary() == {"counters": {}, "series": {}, "gauges": {}}
+    assert metrics.serve(0) is None
+
+
+def test_prometheus():
+    metrics = Metrics()
+    metrics.count("queries")
+    metrics.observe("lookup_seconds", 0.5)
+    metrics.gauge("media cache", lambda: {"hits": 3, "directory": "/tmp"})
+    metrics.gauge("broken", lambda: 1 / 0)
+    text = metrics.prometheus()
+    assert "# TYPE acdreceive_queries_total counter\nacdreceive_queries_total 1" in text
+    assert 'acdreceive_lookup_seconds{quantile="0.95"} 0.5' in text
+    assert "acdreceive_lookup_seconds_count 1" in text
+    # Only numbers are exported, and failing gauges are skipped
+    assert "acdreceive_media_cache_hits 3" in text
+    assert "directory" not in text and "broken" not in text
+
+
+def test_serve():
+    metrics = Metrics()
+    metrics.count("queries")
+    server = metrics.serve(0)
+    try:
+        url = f"http://127.0.0.1:{server.server_port}/metrics"
+        with urllib.request.urlopen(url) as response:
+            assert b"acdreceive_queries_total 1" in response.read()
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,133 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ..sessions import SessionStore
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def table():
+    return pd.DataFrame({"Name": [f"{i}.jpg" for i in range(30)]})
+
+
+def rows(n: int) -> np.ndarray:
+    return np.arange(n)[::-1]
+
+
+def test_session_pages(table):
+    store = SessionStore()
+    session = store.put(1, rows(25), table)
+    assert session.rows.dtype == np.int32
+    assert store.get(1).page(0, 2)["Name"].tolist() == ["24.jpg", "23.jpg"]
+    assert len(store.get(1).page(20, 30)) == 5
+
+
+def test_ttl_expiry(table):
+    clock = Clock()
+    store = SessionStore(ttl=10, clock=clock)
+    store.put(1, rows(5), table)
+    store.put(2, rows(5), table)
+    clock.now = 8
+    assert 1 in store
+    clock.now = 15
+    assert store.get(2) is None
+    assert 1 in store
+    clock.now = 30
+    store.expire()
+    assert len(store) == 0 and store.nbytes == 0
+
+
+def test_lru_and_memory_cap(table):
+    store = SessionStore(max_sessions=2, max_bytes=90)
+    store.put(1, rows(5), table)
+    store.put(2, rows(5), table)
+    store.get(1)
+    store.put(3, rows(5), table)
+    assert 2 not in store and 1 in store and 3 in store
+    store.put(4, rows(20), table)
+    assert store.stats() == {"sessions": 1, "bytes": 80}
+
+
+def test_prefetched_dropped(table):
+    clock = Clock()
+    store = SessionStore(ttl=10, clock=clock)
+    session = store.put(1, rows(5), table)
+    pending = Future()
+    session.prefetch(2, [pending])
+    assert session.take_prefetched(3) is None
+    assert pending.cancelled()
+
+    pending = Future()
+    session.prefetch(2, [pending])
+    assert session.take_prefetched(2) == [pending]
+    session.prefetch(4, [pending])
+    clock.now = 20
+    assert store.get(1) is None
+    assert pending.cancelled() and session.prefetched is None
+
+
+def test_release_detaches_sessions(table):
+    store = SessionStore()
+    store.put(1, rows(5), table)
+    store.put(2, rows(3), table)
+    assert store.release(table) == 2
+    session = store.get(1)
+    assert session.table is not table and len(session.table) == 5
+    assert session.page(0, 2)["Name"].tolist() == ["4.jpg", "3.jpg"]
+    # The copies of the table count towards the memory of the sessions
+    assert session.nbytes > session.rows.nbytes
+    assert store.nbytes == sum(s.nbytes for s in store.sessions.values())
+
+
+def test_release_evicts_large_copies(table):
+    # Room for the copy of 3 rows, but not of 25
+    store = SessionStore(max_bytes=400)
+    store.put(1, rows(25), table)
+    store.put(2, rows(3), table)
+    assert store.release(table) == 1
+    assert 1 not in store
+    assert store.get(2).table is not table
+    assert store.nbytes == store.get(2).nbytes <= 400
+
+
+def test_concurrent_access(table):
+    store = SessionStore(max_sessions=8, max_bytes=200)
+
+    def work(worker: int):
+        for i in range(500):
+            user_id = (worker * 7 + i) % 20
+            store.put(user_id, rows(5), table)
+            store.get((user_id + 3) % 20)
+            store.discard((user_id + 5) % 20)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(work, range(8)))
+    assert store.nbytes == sum(s.nbytes for s in store.sessions.values())
+    assert store.nbytes <= 200
+
+
+def test_pages_during_release(table):
+    store = SessionStore()
+    store.put(1, rows(5), table)
+    names = []
+
+    def pull():
+        for _ in range(2000):
+            names.append(store.get(1).page(0, 2)["Name"].tolist())
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        pulling = pool.submit(pull)
+        for _ in range(200):
+            store.release(store.get(1).table)
+        pulling.result()
+    assert all(page == ["4.jpg", "3.jpg"] for page in names)
@@ -1,6 +1,9 @@
 import re
+import unicodedata
 from typing import List, Tuple
 
+UMLAUTS = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"})
+
 
 def standardize_quotes(text: str) -> str:
     """
@@ -19,6 +22,19 @@ def standardize_quotes(text: str) -> str:
     return text
 
 
+def normalize_text(text: str) -> str:
+    """
+    Normalize text for case- and umlaut-insensitive matching.
+
+    Args:
+        text (str): The input text.
+
+    Returns:
+        str: The lowercased text with umlauts spelled out, e.g. "muenster" for "Münster".
+    """
+    return unicodedata.normalize("NFC", text).lower().translate(UMLAUTS)
+
+
 class Query:
 
     def __init__(self, tags, caption, start_date, end_date):
@@ -27,6 +43,20 @@ class Query:
         self.start_date = start_date
         self.end_date = end_date
 
+    def key(self) -> Tuple:
+        """
+        Canonical form of the query, e.g. to cache its results.
+
+        Queries that only differ in the order or case of their tags, or in the
+        case and umlaut spelling of their caption, share one key.
+        """
+        return (
+            tuple(sorted({tag.lower() for tag in self.tags})),
+            normalize_text(self.caption),
+            self.start_date,
+            self.end_date,
+        )
+
 
 def parse_blocks(message: str) -> Tuple[List[str], str]:
     """
@@ -4,9 +4,12 @@ import sys
 
 from loguru import logger
 
+from acdreceive.asyncbot import AsyncACDReceive
 from acdreceive.core import ACDReceive
 
 log_level = os.getenv("LOGLEVEL", "INFO")
+# "async" serves all chats from one event loop instead of worker threads
+runtime = os.getenv("RUNTIME", "threads")
 logger.configure(handlers=[{"sink": sys.stdout, "level": log_level}])
 
 
@@ -19,7 +22,8 @@ def main():
     storage_path = "imgs"
     storage_path = secrets["smartdrive-host"]
 
-    bot = ACDReceive(metadata_path, storage_path, secrets=secrets)
+    bot_class = AsyncACDReceive if runtime == "async" else ACDReceive
+    bot = bot_class(metadata_path, storage_path, secrets=secrets)
     bot.run()
 
 
@@ -0,0 +1,175 @@
+"""
+Load test of the bot's handlers against mocked Telegram and storage.
+
+N simulated users search at the same time, each for a tag of their own, and the
+time until every user received the full page of results is measured. Telegram
+and the storage are replaced by fakes that only sleep for a fixed latency.
+
+Usage (from the `chatbot` directory):
+    python -m benchmarks.load_test [--users 32] [--storage-latency 0.05]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+from pyacddb.snapshot import write_snapshot
+from pyacddb.tags import TagMatrix
+from telegram import Chat, Message, Update, User
+
+from acdreceive.core import ACDReceive
+
+DONE = "Das war alles 🙂"
+
+
+class FakeTelegram:
+    """Answers Bot API calls after a fixed latency and records when users are done."""
+
+    id = 0
+    defaults = None
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.finished = {}
+        self.all_done = threading.Event()
+        self.users = 0
+
+    def call(self):
+        time.sleep(self.latency)
+        with self.lock:
+            self.calls += 1
+            return f"file-{self.calls}"
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.call()
+        if text == DONE:
+            with self.lock:
+                self.finished[chat_id] = time.perf_counter()
+                if len(self.finished) == self.users:
+                    self.all_done.set()
+        return SimpleNamespace(message_id=self.calls)
+
+    def send_media_group(self, chat_id, media, **kwargs):
+        file_id = self.call()
+        attachment = SimpleNamespace(file_id=file_id)
+        return [SimpleNamespace(photo=[attachment], video=None) for _ in media]
+
+    def send_photo(self, chat_id, photo, **kwargs):
+        return self.send_media_group(chat_id, [photo])[0]
+
+
+def write_database(directory: str, users: int, pagesize: int) -> str:
+    n = users * pagesize
+    assets = pd.DataFrame(
+        {
+            "Name": [f"{i}.jpg" for i in range(n)],
+            "Folder": ["\\\\S\\Public\\Fotos\\load\\"] * n,
+            "FileType": ["JPEG"] * n,
+            "DBDate": ["20000101 12:00:00.000"] * n,
+            "Caption": [f"Foto {i}" for i in range(n)],
+            "Author": ["Load Test"] * n,
+        }
+    )
+    tags = [[f"user{i // pagesize}"] for i in range(n)]
+    path = os.path.join(directory, "wholedb.snapshot")
+    write_snapshot(path, assets, TagMatrix.from_tag_lists(tags))
+    return path
+
+
+def run(args, workers: int, delivery_workers: int, fetch_workers: int):
+    directory = tempfile.mkdtemp()
+    bot_class = type(
+        "LoadTestBot",
+        (ACDReceive,),
+        {
+            "WORKERS": workers,
+            "DELIVERY_WORKERS": delivery_workers,
+            "FETCH_WORKERS": fetch_workers,
+        },
+    )
+    secrets = {
+        "telegram": "123456:load-test",
+        "together": "load-test",
+        "media-cache": os.path.join(directory, "media"),
+        "file-ids": os.path.join(directory, "file_ids.sqlite"),
+    }
+    db_path = write_database(directory, args.users, ACDReceive.PAGESIZE)
+    bot = bot_class(db_path, directory, secrets=secrets)
+
+    def storage(path: str) -> bytes:
+        time.sleep(args.storage_latency)
+        return path.encode()
+
+    bot.get_medium = storage
+    telegram = FakeTelegram(args.telegram_latency)
+    telegram.users = args.users
+    bot.dp.bot = telegram
+
+    # Like `Updater.start_polling`, but fed with the simulated updates
+    threading.Thread(target=bot.dp.start, daemon=True).start()
+    started = {}
+    for user in range(args.users):
+        bot.user_prefs[user]["setup_complete"] = True
+        chat = Chat(id=user, type="private")
+        message = Message(
+            message_id=user,
+            date=datetime.now(),
+            chat=chat,
+            from_user=User(id=user, first_name=f"user{user}", is_bot=False),
+            text=f"user{user}",
+            bot=telegram,
+        )
+        started[user] = time.perf_counter()
+        bot.dp.update_queue.put(Update(update_id=user, message=message))
+    if not telegram.all_done.wait(timeout=300):
+        raise RuntimeError("Not all users received their results")
+    latencies = np.array([telegram.finished[u] - started[u] for u in started])
+    total = max(telegram.finished.values()) - min(started.values())
+
+    bot.dp.stop()
+    bot.fetcher.shutdown()
+    bot.delivery.shutdown()
+    return total, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=32)
+    parser.add_argument("--storage-latency", type=float, default=0.05)
+    parser.add_argument("--telegram-latency", type=float, default=0.03)
+    args = parser.parse_args()
+    logger.configure(handlers=[{"sink": sys.stderr, "level": "WARNING"}])
+
+    print(
+        f"{args.users} users, {ACDReceive.PAGESIZE} media per page, storage "
+        f"{args.storage_latency * 1000:.0f}ms, Telegram {args.telegram_latency * 1000:.0f}ms"
+    )
+    configurations = {
+        "one worker": (1, 1, 1),
+        "default": (
+            ACDReceive.WORKERS,
+            ACDReceive.DELIVERY_WORKERS,
+            ACDReceive.FETCH_WORKERS,
+        ),
+    }
+    for name, workers in configurations.items():
+        total, latencies = run(args, *workers)
+        p50, p95 = np.percentile(latencies, [50, 95])
+        print(
+            f"{name:>10} {workers}: {total:6.2f}s, {args.users / total:6.1f} users/s, "
+            f"latency p50 {p50:.2f}s p95 {p95:.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
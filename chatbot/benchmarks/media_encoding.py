@@ -0,0 +1,78 @@
+"""
+Compares the size-targeted JPEG encoder with the former quality loop.
+
+Usage (from the `chatbot` directory):
+    python -m benchmarks.media_encoding [--image scan.jpg] [--repeat 3]
+
+Without `--image`, a noisy 40 megapixel JPEG is generated as a worst case.
+"""
+
+import argparse
+import io
+import time
+from typing import Callable
+
+import numpy as np
+from PIL import Image
+
+from acdreceive.imaging import MAX_BYTES, fit_image
+
+
+def quality_loop(content: bytes) -> bytes:
+    """The former `Client.downscale_image`: lowers the quality in steps of 5."""
+    image = Image.open(io.BytesIO(content))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    quality = 85
+    while True:
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=quality)
+        if buffer.tell() <= MAX_BYTES or quality <= 20:
+            break
+        quality -= 5
+    return buffer.getvalue()
+
+
+def synthetic_scan(width: int, height: int) -> bytes:
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    noise = rng.normal(0, 40, (height, width, 3)).astype(np.float32)
+    pixels = np.clip(gradient + noise, 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG", quality=95)
+    return buffer.getvalue()
+
+
+def measure(name: str, encoder: Callable[[bytes], bytes], content: bytes, repeat: int):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = encoder(content)
+        times.append(time.perf_counter() - start)
+    size = Image.open(io.BytesIO(result)).size
+    print(
+        f"{name:>14}: {min(times):7.2f}s (best of {repeat}), "
+        f"{len(result) / 1024**2:5.2f} MB, {size[0]}x{size[1]}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--image", help="Image to encode instead of a synthetic one")
+    parser.add_argument("--width", type=int, default=7752)
+    parser.add_argument("--height", type=int, default=5160)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.image:
+        with open(args.image, "rb") as f:
+            content = f.read()
+    else:
+        content = synthetic_scan(args.width, args.height)
+    print(f"Input: {len(content) / 1024**2:.2f} MB")
+    measure("quality loop", quality_loop, content, args.repeat)
+    measure("fit_image", fit_image, content, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Benchmarks the extraction and query paths on synthetic ACDDB exports.
+
+For every size, a seeded export is generated with `pyacddb.synthetic`, then
+each benchmark reports its best time of `--repeat` runs and the peak memory
+traced (with `tracemalloc`) during one extra run. Loading benchmarks also
+report the size of the loaded table, in regular and compact mode. The results can be written
+as JSON and compared with those of an earlier run, failing on regressions.
+
+Usage (from the `chatbot` directory):
+    python -m benchmarks.suite [--sizes 1000 10000 100000] [--json results.json]
+    python -m benchmarks.suite --baseline results.json --tolerance 0.25
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+# Progress bars of the extraction would drown the results (read on import of tqdm)
+os.environ.setdefault("TQDM_DISABLE", "1")
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+from PIL import Image
+from pyacddb.core import extract_assets, extract_keywords
+from pyacddb.snapshot import write_snapshot
+from pyacddb.synthetic import write_acddb
+
+from acdreceive.engine import QueryEngine
+from acdreceive.imaging import fit_image
+from acdreceive.utils import parse_blocks
+
+QUERIES = [
+    "micha",
+    "micha jannis",
+    "haus garten",
+    "kemperweg date: 1995-2000",
+    "micha cap: grüße",
+    "cap: frühstück mit oma",
+    "date: 2010-2010",
+    "orte\\deutschland",
+    "personen\\familie\\micha orte\\deutschland\\münster",
+    "unbekannt",
+]
+DATE_RANGES = [("1995", "1995"), ("1990", "2024"), ("200106", "20020315")]
+# Faster benchmarks are too noisy to compare with a baseline
+MIN_SECONDS = 0.001
+
+
+def measure(function: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    """Returns the best time of `repeat` calls and the peak memory of one more."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": min(times), "peak_bytes": peak}
+
+
+def prepare(workdir: str, n_assets: int, seed: int) -> str:
+    """Generates the export of a size (once per work directory) and its tables."""
+    base = os.path.join(workdir, f"synthetic-{n_assets}-{seed}")
+    if not os.path.exists(base + ".xml"):
+        write_acddb(base + ".xml", n_assets, seed=seed)
+        assets_df, tag_matrix = extract_assets(base + ".xml", digest=True)
+        write_snapshot(base + ".snapshot", assets_df, tag_matrix)
+        assets_df.to_csv(base + ".csv")
+        tag_matrix.save(base + ".tags.npz")
+    return base
+
+
+def table_bytes(engine: QueryEngine) -> int:
+    """The memory held by the table, including its strings."""
+    return int(engine.db.memory_usage(deep=True).sum())
+
+
+def lookup(engine: QueryEngine, queries: List):
+    for query in queries:
+        engine.resolve(query)
+
+
+def query_date(engine: QueryEngine):
+    for start, end in DATE_RANGES:
+        engine.query_date(start, end)
+
+
+def synthetic_photo(width: int = 4000, height: int = 3000) -> bytes:
+    """A noisy 12 megapixel JPEG, which `fit_image` has to re-encode."""
+    rng = np.random.default_rng(0)
+    pixels = rng.normal(128, 40, (height, width, 3)).clip(0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG", quality=95)
+    return buffer.getvalue()
+
+
+def run_size(base: str, repeat: int) -> Dict[str, Dict[str, float]]:
+    """Runs the benchmarks that depend on the number of assets."""
+    results = {
+        "extract_keywords": measure(lambda: extract_keywords(base + ".xml"), repeat)
+    }
+    engine = QueryEngine()
+    # The snapshot is preferred when it exists next to the CSV
+    results["db_setup[snapshot]"] = measure(
+        lambda: engine.db_setup(base + ".csv"), repeat
+    )
+    results["db_setup[snapshot]"]["table_bytes"] = table_bytes(engine)
+    compact = QueryEngine(compact=True)
+    results["db_setup[compact]"] = measure(
+        lambda: compact.db_setup(base + ".csv"), repeat
+    )
+    results["db_setup[compact]"]["table_bytes"] = table_bytes(compact)
+    snapshot = base + ".snapshot"
+    os.rename(snapshot, snapshot + ".off")
+    try:
+        results["db_setup[csv]"] = measure(
+            lambda: QueryEngine().db_setup(base + ".csv"), repeat
+        )
+    finally:
+        os.rename(snapshot + ".off", snapshot)
+
+    # `parse_blocks` prints the blocks it parses
+    with contextlib.redirect_stdout(io.StringIO()):
+        queries = [parse_blocks(q) for q in QUERIES]
+    results["lookup"] = measure(lambda: lookup(engine, queries), repeat)
+    results["query_date"] = measure(lambda: query_date(engine), repeat)
+    results["tag_distribution"] = measure(engine.state.build_tag_messages, repeat)
+    return results
+
+
+def compare(
+    results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float
+) -> List[str]:
+    """Lists the benchmarks that got slower than the baseline by over `tolerance`."""
+    previous = {(r["name"], r["assets"]): r["seconds"] for r in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get((result["name"], result["assets"]))
+        if before is None or before < MIN_SECONDS:
+            continue
+        if result["seconds"] > before * (1 + tolerance):
+            regressions.append(
+                f"{result['name']} ({result['assets']} assets): "
+                f"{before:.4f}s -> {result['seconds']:.4f}s"
+            )
+    return regressions
+
+
+def main(args: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="Keeps the generated exports for later runs")
+    parser.add_argument("--json", help="Writes the results to this file")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Relative slowdown over the baseline that counts as regression",
+    )
+    args = parser.parse_args(args)
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = args.workdir or tmpdir
+        os.makedirs(workdir, exist_ok=True)
+        for n_assets in args.sizes:
+            base = prepare(workdir, n_assets, args.seed)
+            for name, result in run_size(base, args.repeat).items():
+                results.append({"name": name, "assets": n_assets, **result})
+    photo = synthetic_photo()
+    results.append(
+        {"name": "fit_image", "assets": None, **measure(lambda: fit_image(photo), 1)}
+    )
+
+    print(
+        f"{'benchmark':<20} {'assets':>8} {'seconds':>10} {'peak MB':>9} "
+        f"{'table MB':>9}"
+    )
+    for r in results:
+        assets = "-" if r["assets"] is None else r["assets"]
+        table = f"{r['table_bytes'] / 1024**2:.1f}" if "table_bytes" in r else "-"
+        print(
+            f"{r['name']:<20} {assets:>8} {r['seconds']:>10.4f} "
+            f"{r['peak_bytes'] / 1024**2:>9.1f} {table:>9}"
+        )
+
+    if args.json:
+        report = {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "results": results,
+        }
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,13 @@
+import hashlib
 import xml.etree.ElementTree as ET
-from typing import Dict, List, Optional
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
 
 import pandas as pd
 from loguru import logger
 from tqdm import tqdm
 
 from pyacddb.metadata import DEFAULT_FIELDS
+from pyacddb.tags import TagMatrix
 from pyacddb.utils import strip
 
 
@@ -30,44 +32,139 @@ def field_from_item(item: str, field: str):
     return strip(value.text)
 
 
-def extract_keywords(path: str, fields: List[str] = DEFAULT_FIELDS):
-
-    tree = ET.parse(path)
-    root = tree.getroot()
-    assets = []
-    unique_tags = set()
-
-    asset_items = field_items_from_root(root, "Asset", fields)
-    logger.info(f"Identified {len(asset_items)} items")
-    for asset_dict in tqdm(asset_items, total=len(asset_items)):
-        # Extract asset categories directly within this loop
-        asset_categories = [
-            strip(ac.text)
-            for ac in root.findall(
-                f".//Asset[Name='{asset_dict['Name']}']//AssetCategory"
-            )
-        ]
-        asset_keywords = [
-            strip(ak.text)
-            for ak in root.findall(
-                f".//Asset[Name='{asset_dict['Name']}']//AssetKeyword"
-            )
-        ]
-        tags = [a.split("\\")[-1] for a in asset_categories] + asset_keywords
-        unique_tags.update(tags)
-
-        # Update the asset dictionary with categories and tags
-        asset_dict.update(
-            {
-                "AssetCategories": asset_categories,
-                "AssetKeywords": asset_keywords,
-                "Tags": tags,
-            }
-        )
-        assets.append(asset_dict)
+def texts_from_item(item, tag: str) -> List[str]:
+    """Collects the stripped texts of all descendants of `item` with the given tag."""
+    return [strip(child.text) for child in item.iter(tag) if child.text is not None]
 
+
+def asset_record(
+    asset, fields: List[str] = DEFAULT_FIELDS, digest: bool = False
+) -> Dict[str, Any]:
+    """
+    Builds the record of a single `<Asset>` element.
+
+    Only the element itself is visited, so the cost is linear in the size of the
+    asset and assets sharing a `Name` (in different folders) are kept apart.
+
+    Args:
+        asset: The `<Asset>` element.
+        fields: The child fields to extract.
+        digest: Whether to add the key `AssetHash`, a hash of the serialized
+            element that changes whenever anything about the asset changes.
+
+    Returns:
+        A dict with the requested fields plus the keys `AssetCategories`,
+        `AssetKeywords` and `Tags` (category leaves followed by keywords).
+    """
+    record = {field: field_from_item(asset, field) for field in fields}
+    asset_categories = texts_from_item(asset, "AssetCategory")
+    asset_keywords = texts_from_item(asset, "AssetKeyword")
+    tags = [a.split("\\")[-1] for a in asset_categories] + asset_keywords
+    record.update(
+        {
+            "AssetCategories": asset_categories,
+            "AssetKeywords": asset_keywords,
+            "Tags": tags,
+        }
+    )
+    if digest:
+        # The tail (text after the closing tag) is not part of the asset
+        tail, asset.tail = asset.tail, None
+        record["AssetHash"] = hashlib.sha1(ET.tostring(asset)).hexdigest()
+        asset.tail = tail
+    return record
+
+
+def iter_assets(
+    path: Union[str, BinaryIO], fields: List[str] = DEFAULT_FIELDS, digest: bool = False
+) -> Iterator[Dict[str, Any]]:
+    """
+    Streams the asset records of an ACDDB export.
+
+    The file is read with `iterparse` and every `<Asset>` element is detached
+    from its parent once its record was built, so memory stays bounded by the
+    size of a single asset regardless of the size of the export.
+
+    Args:
+        path: Path to the ACDDB XML file or a binary file object.
+        fields: The child fields to extract for each asset.
+        digest: Whether to add a content hash `AssetHash` to every record.
+
+    Yields:
+        One record per asset, see `asset_record`.
+    """
+    parents = []
+    depth = 0  # Nesting level below the outermost open <Asset>
+    for event, element in ET.iterparse(path, events=("start", "end")):
+        if event == "start":
+            if element.tag == "Asset" or depth:
+                depth += 1
+            if depth <= 1:
+                parents.append(element)
+            continue
+
+        if depth > 1:
+            depth -= 1
+            continue
+        parents.pop()
+        if depth == 1:
+            depth = 0
+            yield asset_record(element, fields, digest)
+            element.clear()
+            if parents:
+                parents[-1].remove(element)
+
+
+def iter_asset_chunks(
+    path: str, fields: List[str] = DEFAULT_FIELDS, chunksize: int = 10000
+) -> Iterator[pd.DataFrame]:
+    """
+    Streams the assets of an ACDDB export as DataFrames of at most `chunksize` rows.
+
+    The chunks carry the narrow asset table (requested fields plus
+    `AssetCategories`, `AssetKeywords` and `Tags`) without per-tag columns,
+    since the set of tags is only known after the whole export was read.
+    """
+    chunk = []
+    for record in iter_assets(path, fields):
+        chunk.append(record)
+        if len(chunk) == chunksize:
+            yield pd.DataFrame(chunk)
+            chunk = []
+    if chunk:
+        yield pd.DataFrame(chunk)
+
+
+def extract_assets(
+    path: str, fields: List[str] = DEFAULT_FIELDS, digest: bool = False
+) -> Tuple[pd.DataFrame, TagMatrix]:
+    """
+    Extracts the narrow asset table and the sparse tag membership of an export.
+
+    Args:
+        path: Path to the ACDDB XML file.
+        fields: The child fields to extract for each asset.
+        digest: Whether to add a content hash `AssetHash` to every asset, which
+            enables change detection in `pyacddb.incremental`.
+
+    Returns:
+        The asset table (requested fields plus `AssetCategories`, `AssetKeywords`
+        and `Tags`) and a `TagMatrix` whose rows are aligned with the table.
+    """
+    assets = list(tqdm(iter_assets(path, fields, digest), desc="Assets"))
+    logger.info(f"Identified {len(assets)} items")
+    return build_assets(assets)
+
+
+def build_assets(assets: List[Dict[str, Any]]) -> Tuple[pd.DataFrame, TagMatrix]:
+    """Builds the asset table and its `TagMatrix` from the asset records."""
     assets_df = pd.DataFrame(assets)
+    tag_matrix = TagMatrix.from_tag_lists(record["Tags"] for record in assets)
+    return assets_df, tag_matrix
+
+
+def extract_keywords(path: str, fields: List[str] = DEFAULT_FIELDS) -> pd.DataFrame:
+
+    assets_df, tag_matrix = extract_assets(path, fields)
     # For each unique tag, create a new column in the DataFrame
-    for tag in unique_tags:
-        assets_df[tag] = assets_df["Tags"].apply(lambda x: tag in x)
-    return assets_df
+    return pd.concat([assets_df, tag_matrix.to_frame()], axis=1)
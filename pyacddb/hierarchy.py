@@ -0,0 +1,188 @@
+"""
+Index of the ACDSee category hierarchy.
+
+ACDSee categories are paths such as `Orte\\Deutschland\\Münster\\Kemperweg`.
+`extract_assets` keeps the full paths in `AssetCategories`, while the tags only
+hold their leaves. `CategoryTree` arranges the paths in a trie whose nodes carry
+the sorted rows of all assets in their subtree, so that everything under
+`Orte\\Deutschland` is found with a single lookup instead of a union of the
+rows of every place below it.
+"""
+
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from pyacddb.tags import TagMatrix
+
+SEPARATOR = "\\"
+
+
+def split_path(path: str) -> List[str]:
+    """Splits a category path into its stripped, non-empty components."""
+    return [part.strip() for part in path.split(SEPARATOR) if part.strip()]
+
+
+class CategoryTree:
+    """
+    Trie of category paths with the sorted row ids of each node's subtree.
+
+    Node `i` is the category `paths[i]` below `parents[i]` (-1 for the top
+    level categories). Its rows are the assets assigned to the category itself
+    or to any category below it, merged once when the tree is built.
+    """
+
+    def __init__(self, category_matrix: TagMatrix, fold_case: bool = True):
+        """
+        Args:
+            category_matrix: The full category paths of the assets, e.g.
+                `TagMatrix.from_tag_lists(assets_df["AssetCategories"])`.
+            fold_case: Whether paths that only differ in case are one node, as
+                tags are when the bot queries them.
+        """
+        self.fold_case = fold_case
+        self.paths: List[str] = []
+        self.parents: List[int] = []
+        self.children: List[List[int]] = []
+        self.nodes: Dict[str, int] = {}
+        categories = [self.add(category) for category in category_matrix.tags]
+        assigned: List[List[np.ndarray]] = [[] for _ in self.paths]
+        for category, node in zip(category_matrix.tags, categories):
+            if node is not None:
+                assigned[node].append(category_matrix.rows(category))
+
+        # Children are added after their parents, so they are merged first
+        self.rows: List[np.ndarray] = [None] * len(self.paths)
+        for node in reversed(range(len(self.paths))):
+            parts = assigned[node] + [self.rows[child] for child in self.children[node]]
+            rows = np.concatenate(parts) if parts else np.empty(0, dtype=np.int32)
+            self.rows[node] = np.unique(rows).astype(np.int32)
+        for children in self.children:
+            children.sort(key=lambda child: self.paths[child].lower())
+
+    @classmethod
+    def from_category_lists(
+        cls, category_lists: Iterable[List[str]], fold_case: bool = True
+    ) -> "CategoryTree":
+        """Builds the tree from the category paths of every asset."""
+        return cls(TagMatrix.from_tag_lists(category_lists), fold_case)
+
+    def merged(
+        self,
+        renumber: np.ndarray,
+        category_lists: Iterable[List[str]],
+        positions: np.ndarray,
+    ) -> "CategoryTree":
+        """
+        Returns the tree of a table that changed incrementally.
+
+        The rows of the existing nodes are renumbered and the rows added to the
+        table are merged into the nodes of their categories and their ancestors.
+        Nodes left without rows are dropped.
+
+        Args:
+            renumber: The new row id of every row of this tree's table, -1 for
+                removed rows. The remaining rows have to keep their order.
+            category_lists: The category paths of the added rows.
+            positions: The row ids of the added rows in the new table.
+        """
+        # Grow a copy of the trie by the new categories first
+        grown = CategoryTree.__new__(CategoryTree)
+        grown.fold_case = self.fold_case
+        grown.paths = list(self.paths)
+        grown.parents = list(self.parents)
+        grown.children = [[] for _ in self.paths]
+        grown.nodes = dict(self.nodes)
+        added: Dict[int, List[int]] = {}
+        for row, paths in zip(positions, category_lists):
+            # The categories of the row and their ancestors, each once
+            nodes = set()
+            for path in paths:
+                node = grown.add(path)
+                while node is not None and node >= 0 and node not in nodes:
+                    nodes.add(node)
+                    node = grown.parents[node]
+            for node in nodes:
+                added.setdefault(node, []).append(row)
+
+        tree = CategoryTree.__new__(CategoryTree)
+        tree.fold_case = self.fold_case
+        tree.paths, tree.parents, tree.children, tree.rows = [], [], [], []
+        tree.nodes = {}
+        ids: Dict[int, int] = {}
+        empty = np.empty(0, dtype=np.int32)
+        # Parents precede their children, and keep rows whenever a child does
+        for node, path in enumerate(grown.paths):
+            rows = renumber[self.rows[node]] if node < len(self.rows) else empty
+            rows = rows[rows >= 0]
+            if node in added:
+                rows = np.union1d(rows, added[node]).astype(np.int32)
+            if len(rows) == 0:
+                continue
+            ids[node] = len(tree.paths)
+            parent = grown.parents[node]
+            tree.paths.append(path)
+            tree.parents.append(-1 if parent < 0 else ids[parent])
+            tree.children.append([])
+            tree.rows.append(rows)
+            tree.nodes[tree.key(path)] = ids[node]
+            if parent >= 0:
+                tree.children[ids[parent]].append(ids[node])
+        for children in tree.children:
+            children.sort(key=lambda child: tree.paths[child].lower())
+        return tree
+
+    def key(self, path: str) -> str:
+        """The canonical form of a path, e.g. without a trailing separator."""
+        key = SEPARATOR.join(split_path(path))
+        return key.lower() if self.fold_case else key
+
+    def add(self, path: str) -> Optional[int]:
+        """Adds the node of a path and its ancestors, returning the node."""
+        node = None
+        parts = split_path(path)
+        for depth in range(1, len(parts) + 1):
+            prefix = SEPARATOR.join(parts[:depth])
+            key = prefix.lower() if self.fold_case else prefix
+            child = self.nodes.get(key)
+            if child is None:
+                child = len(self.paths)
+                self.nodes[key] = child
+                # Spelled like the first path that added the parent
+                parent = "" if node is None else self.paths[node] + SEPARATOR
+                self.paths.append(parent + parts[depth - 1])
+                self.parents.append(-1 if node is None else node)
+                self.children.append([])
+                if node is not None:
+                    self.children[node].append(child)
+            node = child
+        return node
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __contains__(self, path: str) -> bool:
+        return self.key(path) in self.nodes
+
+    def __getitem__(self, path: str) -> np.ndarray:
+        """Returns the sorted row ids of the assets in the subtree of `path`."""
+        return self.rows[self.nodes[self.key(path)]]
+
+    def roots(self) -> List[str]:
+        return [path for path, parent in zip(self.paths, self.parents) if parent < 0]
+
+    def subcategories(self, path: str) -> List[str]:
+        """Lists the paths directly below `path`, sorted."""
+        return [
+            self.paths[child] for child in self.children[self.nodes[self.key(path)]]
+        ]
+
+    def descendants(self, path: str) -> List[str]:
+        """Lists the paths below `path` in depth-first, sorted order."""
+        found = []
+        stack = list(reversed(self.children[self.nodes[self.key(path)]]))
+        while stack:
+            node = stack.pop()
+            found.append(self.paths[node])
+            stack.extend(reversed(self.children[node]))
+        return found
@@ -0,0 +1,137 @@
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+from loguru import logger
+from tqdm import tqdm
+
+from pyacddb.core import build_assets, iter_assets
+from pyacddb.metadata import DEFAULT_FIELDS
+from pyacddb.snapshot import read_meta, read_snapshot, resolve_snapshot, write_snapshot
+
+
+class Delta:
+    """
+    The changes between two generations of a snapshot.
+
+    Assets are identified by their key `Folder + Name`. The rows of added and
+    changed assets are appended to the new snapshot, starting at row `start`.
+    """
+
+    def __init__(
+        self,
+        added: List[str],
+        changed: List[str],
+        removed: List[str],
+        base: Optional[int] = None,
+        start: Optional[int] = None,
+    ):
+        self.added = added
+        self.changed = changed
+        self.removed = removed
+        self.base = base
+        self.start = start
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.changed or self.removed)
+
+    def __repr__(self) -> str:
+        return (
+            f"Delta({len(self.added)} added, {len(self.changed)} changed, "
+            f"{len(self.removed)} removed)"
+        )
+
+    @property
+    def stale(self) -> List[str]:
+        """Keys whose previous rows are no longer valid."""
+        return self.changed + self.removed
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "added": self.added,
+            "changed": self.changed,
+            "removed": self.removed,
+            "base": self.base,
+            "start": self.start,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Delta":
+        return cls(**data)
+
+
+def asset_keys(assets_df: pd.DataFrame) -> pd.Series:
+    """Returns the stable key (`Folder + Name`) of every asset."""
+    return assets_df["Folder"].fillna("") + assets_df["Name"].fillna("")
+
+
+def read_delta(path: str) -> Optional[Delta]:
+    """Reads the delta stored in a snapshot, if it was written incrementally."""
+    delta_path = os.path.join(resolve_snapshot(path), "delta.json")
+    if not os.path.exists(delta_path):
+        return None
+    with open(delta_path, "r", encoding="utf-8") as f:
+        return Delta.from_dict(json.load(f))
+
+
+def update_snapshot(
+    path: str, snapshot: str, fields: List[str] = DEFAULT_FIELDS
+) -> Delta:
+    """
+    Updates a snapshot with a new export, processing only the assets that changed.
+
+    Every asset of the export is compared with the snapshot by its key and a
+    content hash (`AssetHash`, or `DBDate` for snapshots written without hashes).
+    The rows of unchanged assets are kept as they are, those of removed and
+    changed assets are dropped and the new versions are appended. The new
+    snapshot is written with an incremented generation and the delta, so that
+    readers of the previous generation can apply just the delta.
+
+    Args:
+        path: Path to the new ACDDB XML export.
+        snapshot: The snapshot directory to update.
+        fields: The child fields to extract for new and changed assets.
+
+    Returns:
+        The delta between the previous and the new snapshot.
+    """
+    generation = read_meta(snapshot).get("generation", 0)
+    old_df, old_tags = read_snapshot(snapshot)
+    validator = "AssetHash" if "AssetHash" in old_df.columns else "DBDate"
+    old_validators = old_df[validator].tolist()
+    positions = {key: i for i, key in enumerate(asset_keys(old_df))}
+
+    kept, kept_hashes, fresh = [], [], []
+    added, changed = [], []
+    seen = set()
+    for record in tqdm(iter_assets(path, fields, digest=True), desc="Assets"):
+        key = (record.get("Folder") or "") + (record.get("Name") or "")
+        seen.add(key)
+        i = positions.get(key)
+        if i is not None and old_validators[i] == record[validator]:
+            kept.append(i)
+            kept_hashes.append(record["AssetHash"])
+            continue
+        (added if i is None else changed).append(key)
+        fresh.append(record)
+    removed = [key for key in positions if key not in seen]
+    delta = Delta(added, changed, removed, base=generation, start=len(kept))
+    logger.info(f"{delta} with respect to generation {generation}")
+    if not delta:
+        return delta
+
+    # Dates are re-derived from DBDate by `write_snapshot`
+    kept_df = old_df.iloc[kept].drop(columns="Date", errors="ignore")
+    kept_df = kept_df.assign(AssetHash=kept_hashes)
+    fresh_df, fresh_tags = build_assets(fresh)
+    assets_df = pd.concat([kept_df, fresh_df], ignore_index=True)
+    tag_matrix = old_tags.take(kept).append(fresh_tags)
+    write_snapshot(
+        snapshot,
+        assets_df,
+        tag_matrix,
+        generation=generation + 1,
+        delta=delta.to_dict(),
+    )
+    return delta
@@ -0,0 +1,132 @@
+import io
+import mmap
+import os
+import re
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+from loguru import logger
+
+from pyacddb.core import build_assets, extract_assets, iter_assets
+from pyacddb.metadata import DEFAULT_FIELDS
+from pyacddb.tags import TagMatrix
+
+ASSET_START = re.compile(rb"<Asset[\s>]")
+ASSET_END = b"</Asset>"
+ENCODING = re.compile(rb"""encoding=["']([A-Za-z0-9._-]+)["']""")
+# Encodings in which the ASCII markup can be searched for byte-wise
+ASCII_COMPATIBLE = {"utf-8", "utf8", "us-ascii", "ascii", "iso-8859-1", "latin-1"}
+
+
+def split_assets(path: str, n_chunks: int) -> Tuple[bytes, List[Tuple[int, int]]]:
+    """
+    Splits an ACDDB export into byte ranges that each hold whole `<Asset>` elements.
+
+    Args:
+        path: Path to the ACDDB XML file.
+        n_chunks: The desired number of ranges. Fewer are returned for small files.
+
+    Returns:
+        The XML declaration of the file (to be prepended to every range) and the
+        `(start, end)` byte offsets of the ranges, in file order.
+    """
+    if os.path.getsize(path) == 0:
+        return b"", []
+    with open(path, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        first = ASSET_START.search(data)
+        if first is None:
+            return b"", []
+        begin = first.start()
+        end = data.rfind(ASSET_END) + len(ASSET_END)
+        prolog = data[:begin]
+        declaration = (
+            prolog[: prolog.find(b"?>") + 2]
+            if prolog.lstrip(b"\xef\xbb\xbf").startswith(b"<?xml")
+            else b""
+        )
+
+        boundaries = [begin]
+        step = (end - begin) / max(n_chunks, 1)
+        for i in range(1, n_chunks):
+            match = ASSET_START.search(
+                data, max(int(begin + i * step), boundaries[-1] + 1), end
+            )
+            if match is None:
+                break
+            if match.start() > boundaries[-1]:
+                boundaries.append(match.start())
+        boundaries.append(end)
+    return declaration, list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def parse_range(
+    path: str, start: int, end: int, declaration: bytes, fields: List[str]
+) -> List[Dict[str, Any]]:
+    """Parses the assets in the byte range `[start, end)` of an ACDDB export."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        body = f.read(end - start)
+    document = declaration + b"<ACDDB>" + body + b"</ACDDB>"
+    return list(iter_assets(io.BytesIO(document), fields))
+
+
+def extract_assets_parallel(
+    path: str,
+    fields: List[str] = DEFAULT_FIELDS,
+    workers: Optional[int] = None,
+    chunks_per_worker: int = 4,
+) -> Tuple[pd.DataFrame, TagMatrix]:
+    """
+    Extracts the asset table and tags of an export using a pool of processes.
+
+    The export is split at `<Asset>` boundaries into byte ranges, which are
+    parsed in parallel. The per-range records are merged in file order, so the
+    result is identical to `extract_assets` regardless of the number of workers.
+
+    Args:
+        path: Path to the ACDDB XML file.
+        fields: The child fields to extract for each asset.
+        workers: Number of worker processes. Defaults to the number of CPUs.
+        chunks_per_worker: Number of byte ranges per worker, to balance the load.
+
+    Returns:
+        The asset table and a `TagMatrix` aligned with it.
+    """
+    workers = workers or os.cpu_count() or 1
+    with open(path, "rb") as f:
+        head = f.read(1024)
+    match = ENCODING.search(head)
+    encoding = match.group(1).decode().lower() if match else "utf-8"
+    if (
+        workers == 1
+        or encoding not in ASCII_COMPATIBLE
+        or head.startswith((b"\xff\xfe", b"\xfe\xff"))
+    ):
+        return extract_assets(path, fields)
+
+    declaration, ranges = split_assets(path, workers * chunks_per_worker)
+    logger.info(f"Parsing {len(ranges)} chunks with {workers} workers")
+    parse = partial(parse_range, path, declaration=declaration, fields=fields)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # `map` returns the results in submission, i.e. file, order
+            chunks = list(executor.map(parse, *zip(*ranges))) if ranges else []
+    except ET.ParseError as e:
+        # E.g. markup between two asset lists that ended up in one range
+        logger.warning(f"Parallel parsing failed ({e}), parsing sequentially")
+        return extract_assets(path, fields)
+
+    return build_assets([record for chunk in chunks for record in chunk])
+
+
+def extract_keywords_parallel(
+    path: str, fields: List[str] = DEFAULT_FIELDS, workers: Optional[int] = None
+) -> pd.DataFrame:
+    """Parallel counterpart of `extract_keywords`, see `extract_assets_parallel`."""
+    assets_df, tag_matrix = extract_assets_parallel(path, fields, workers)
+    return pd.concat([assets_df, tag_matrix.to_frame()], axis=1)
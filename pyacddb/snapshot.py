@@ -0,0 +1,248 @@
+import json
+import os
+import re
+import shutil
+import uuid
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from pyacddb.tags import TagMatrix
+
+SNAPSHOT_VERSION = 1
+DATE_FORMAT = "%Y%m%d %H:%M:%S.%f"
+# File in a snapshot directory naming the subdirectory of the current version
+POINTER = "current"
+# Names of the version directories, `v<generation>-<random suffix>`
+VERSION_NAME = re.compile(r"v\d+-[0-9a-f]{8}")
+
+
+def snapshot_path(db_path: str) -> Optional[str]:
+    """
+    Returns the snapshot belonging to a database path, if there is one.
+
+    `db_path` may either point to a snapshot directory itself or to a CSV
+    (e.g. `wholedb.csv`) next to which a `wholedb.snapshot` directory lives.
+    """
+    if os.path.isdir(db_path):
+        return db_path
+    candidate = os.path.splitext(db_path)[0] + ".snapshot"
+    if os.path.isdir(candidate):
+        return candidate
+    return None
+
+
+def resolve_snapshot(path: str) -> str:
+    """
+    Returns the directory holding the files of a snapshot's current version.
+
+    Readers that open several files should resolve the snapshot once, so that
+    they see a single version even if the snapshot is rewritten meanwhile.
+    Snapshots written before versions were introduced, and version directories
+    themselves, are returned as they are.
+    """
+    try:
+        with open(os.path.join(path, POINTER), "r", encoding="utf-8") as f:
+            return os.path.join(path, f.read().strip())
+    except FileNotFoundError:
+        return path
+
+
+def _encode_strings(values: List[Optional[str]]) -> Tuple[np.ndarray, List[str]]:
+    """Factorizes strings into int32 codes (-1 for missing) and their unique values."""
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+    return codes.astype(np.int32), [str(u) for u in uniques]
+
+
+def _decode_strings(codes: np.ndarray, uniques: List[str]) -> np.ndarray:
+    values = np.array(uniques + [None], dtype=object)
+    # Missing values are stored as -1, which picks the trailing None
+    return values[codes]
+
+
+def _save_json(path: str, obj: Any):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+
+
+def _load_json(path: str) -> Any:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_snapshot(
+    path: str,
+    assets_df: pd.DataFrame,
+    tag_matrix: TagMatrix,
+    generation: int = 0,
+    delta: Optional[Dict[str, Any]] = None,
+):
+    """
+    Writes the asset table and its tags as a typed, columnar snapshot directory.
+
+    Every column is stored as plain `.npy` arrays so that the snapshot can be
+    memory-mapped on load: numeric and datetime columns as-is, strings as int32
+    codes into a JSON list of unique values and list columns (e.g.
+    `AssetCategories`) additionally with CSR offsets. `DBDate` is parsed once
+    into a datetime column `Date`. The tags are stored as the CSR arrays of the
+    `TagMatrix`.
+
+    The files are written to a new version directory inside `path`, and the
+    snapshot is switched to it by atomically replacing the `current` pointer
+    file, so that readers always find a complete version. The version it
+    replaces is kept for readers that resolved the pointer just before, older
+    versions are removed. Other files in `path` are left alone.
+
+    Args:
+        path: Target directory, e.g. `wholedb.snapshot`.
+        assets_df: The narrow asset table as returned by `extract_assets`.
+        tag_matrix: The tags of the assets, aligned with `assets_df`.
+        generation: Version counter of the snapshot, see `pyacddb.incremental`.
+        delta: The changes with respect to the previous generation, if known.
+    """
+    if len(assets_df) != len(tag_matrix):
+        raise ValueError(
+            f"Table has {len(assets_df)} rows but tag matrix {len(tag_matrix)}"
+        )
+    assets_df = assets_df.reset_index(drop=True)
+    if "DBDate" in assets_df.columns and "Date" not in assets_df.columns:
+        assets_df = assets_df.assign(
+            Date=pd.to_datetime(
+                assets_df["DBDate"], format=DATE_FORMAT, errors="coerce"
+            )
+        )
+
+    path = path.rstrip(os.sep)
+    version = f"v{generation}-{uuid.uuid4().hex[:8]}"
+    version_path = os.path.join(path, version)
+    os.makedirs(version_path)
+
+    columns = []
+    for name in assets_df.columns:
+        column = assets_df[name]
+        file = os.path.join(version_path, str(name))
+        if pd.api.types.is_datetime64_any_dtype(column):
+            kind = "datetime"
+            np.save(f"{file}.npy", column.to_numpy(dtype="datetime64[ns]"))
+        elif pd.api.types.is_bool_dtype(column) or pd.api.types.is_numeric_dtype(
+            column
+        ):
+            kind = "numeric"
+            np.save(f"{file}.npy", column.to_numpy())
+        elif column.map(lambda x: isinstance(x, list)).any():
+            kind = "list"
+            lists = [x if isinstance(x, list) else [] for x in column]
+            indptr = np.zeros(len(lists) + 1, dtype=np.int64)
+            np.cumsum([len(x) for x in lists], out=indptr[1:])
+            codes, uniques = _encode_strings([v for x in lists for v in x])
+            np.save(f"{file}.indptr.npy", indptr)
+            np.save(f"{file}.codes.npy", codes)
+            _save_json(f"{file}.values.json", uniques)
+        else:
+            kind = "string"
+            codes, uniques = _encode_strings(column.tolist())
+            np.save(f"{file}.codes.npy", codes)
+            _save_json(f"{file}.values.json", uniques)
+        columns.append({"name": str(name), "kind": kind})
+
+    np.save(os.path.join(version_path, "tags.indptr.npy"), tag_matrix.indptr)
+    np.save(os.path.join(version_path, "tags.indices.npy"), tag_matrix.indices)
+    _save_json(os.path.join(version_path, "tags.json"), tag_matrix.tags)
+    if delta is not None:
+        _save_json(os.path.join(version_path, "delta.json"), delta)
+    _save_json(
+        os.path.join(version_path, "meta.json"),
+        {
+            "version": SNAPSHOT_VERSION,
+            "generation": generation,
+            "length": len(assets_df),
+            "columns": columns,
+        },
+    )
+
+    previous = os.path.basename(resolve_snapshot(path))
+    pointer = os.path.join(path, POINTER)
+    with open(pointer + ".tmp", "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(pointer + ".tmp", pointer)
+    # Files of removed versions that are still mapped stay readable on POSIX.
+    # Where they cannot be removed yet, the next write retries.
+    for entry in os.listdir(path):
+        if VERSION_NAME.fullmatch(entry) and entry not in (version, previous):
+            shutil.rmtree(os.path.join(path, entry), ignore_errors=True)
+
+
+def read_meta(path: str) -> Dict[str, Any]:
+    """Reads the metadata (version, generation, length, columns) of a snapshot."""
+    meta = _load_json(os.path.join(resolve_snapshot(path), "meta.json"))
+    if meta["version"] != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {meta['version']} in {path}")
+    return meta
+
+
+def read_snapshot(
+    path: str, mmap: bool = True, start: int = 0, categorical: Sequence[str] = ()
+) -> Tuple[pd.DataFrame, TagMatrix]:
+    """
+    Reads a snapshot written by `write_snapshot`.
+
+    Args:
+        path: The snapshot directory.
+        mmap: Whether to memory-map the numeric arrays instead of reading them.
+            The numeric and datetime columns of the table are then read-only
+            views of the mapped files.
+        start: The first row to read, e.g. to only read the rows appended by an
+            incremental update.
+        categorical: String columns to read as categoricals, straight from their
+            stored codes instead of decoding a Python string per row.
+
+    Returns:
+        The asset table (indexed from 0) and its `TagMatrix`.
+    """
+    try:
+        return _read_version(resolve_snapshot(path), mmap, start, categorical)
+    except FileNotFoundError:
+        # The version may have been removed by writes since it was resolved
+        return _read_version(resolve_snapshot(path), mmap, start, categorical)
+
+
+def _read_version(
+    path: str, mmap: bool, start: int, categorical: Sequence[str]
+) -> Tuple[pd.DataFrame, TagMatrix]:
+    meta = read_meta(path)
+    mmap_mode = "r" if mmap else None
+    length = meta["length"]
+
+    def load(name: str) -> np.ndarray:
+        return np.load(os.path.join(path, name), mmap_mode=mmap_mode)
+
+    data: Dict[str, Any] = {}
+    for column in meta["columns"]:
+        name, kind = column["name"], column["kind"]
+        if kind in ("numeric", "datetime"):
+            data[name] = load(f"{name}.npy")[start:]
+            continue
+        uniques = _load_json(os.path.join(path, f"{name}.values.json"))
+        if kind == "string" and name in categorical:
+            codes = np.asarray(load(f"{name}.codes.npy")[start:])
+            data[name] = pd.Categorical.from_codes(codes, uniques)
+            continue
+        if kind == "string":
+            data[name] = _decode_strings(load(f"{name}.codes.npy")[start:], uniques)
+            continue
+        indptr = load(f"{name}.indptr.npy")[start:]
+        values = _decode_strings(load(f"{name}.codes.npy")[indptr[0] :], uniques)
+        offsets = indptr - indptr[0]
+        data[name] = [values[i:j].tolist() for i, j in zip(offsets[:-1], offsets[1:])]
+    # Without copying, the numeric and datetime columns stay memory-mapped
+    assets_df = pd.DataFrame(data, index=pd.RangeIndex(length - start), copy=False)
+
+    tag_matrix = TagMatrix(
+        load("tags.indptr.npy"),
+        load("tags.indices.npy"),
+        _load_json(os.path.join(path, "tags.json")),
+    )
+    if start:
+        tag_matrix = tag_matrix.take(np.arange(start, length)).prune()
+    return assets_df, tag_matrix
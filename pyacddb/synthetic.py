@@ -0,0 +1,172 @@
+"""
+Seeded generator of synthetic ACDDB exports, e.g. for tests and benchmarks.
+
+The exports follow the structure of real ones: assets in yearly folders with
+mostly JPEGs (and some videos, RAW files, folders and sidecars), hierarchical
+categories such as `Orte\\Deutschland\\Münster\\Kemperweg`, keywords, captions
+and authors, with umlauts throughout. The tag frequencies are skewed, so that
+few tags are common and most are rare, as in a family photo collection.
+"""
+
+from typing import BinaryIO, Iterator, List, Union
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+# (FileType, extension, weight)
+FILE_TYPES = [
+    ("JPEG", "JPG", 0.80),
+    ("Portable Network Graphics", "png", 0.04),
+    ("Canon RAW TIFF", "CR2", 0.04),
+    ("CompuServe GIF", "gif", 0.01),
+    ("MP4", "MP4", 0.04),
+    ("MOV", "MOV", 0.02),
+    ("Ordner", "", 0.03),
+    ("XMP Files", "xmp", 0.02),
+]
+PEOPLE = ["Micha", "Jannis", "Jürgen", "Käthe", "Sören", "Ulla", "Björn", "Grete"]
+PLACES = [
+    "Deutschland\\Münster\\Kemperweg",
+    "Deutschland\\Münster\\Aasee",
+    "Deutschland\\Köln\\Dom",
+    "Deutschland\\Düsseldorf",
+    "Österreich\\Wien",
+    "Schweiz\\Zürich",
+    "Frankreich\\Paris",
+]
+EVENTS = ["Weihnachten", "Ostern", "Geburtstag", "Hochzeit", "Urlaub", "Einschulung"]
+KEYWORDS = ["Haus", "Garten", "Straße", "Schnee", "Strand", "Hund", "Katze", "Fähre"]
+CAPTION_WORDS = [
+    "Im",
+    "Garten",
+    "Dach",
+    "(neu)",
+    "Frühstück",
+    "mit",
+    "Oma",
+    "Grüße",
+    "aus",
+    "Münster",
+    "am",
+    "Strand",
+    "Übergabe",
+    "der",
+    "Schlüssel",
+]
+AUTHORS = ["Michael B", "Jannis B", "Käthe M"]
+
+
+def categories(n_people: int, n_places: int, n_events: int) -> List[str]:
+    """Builds the category vocabulary, extending the base lists with numbered ones."""
+    people = PEOPLE + [f"Person {i:04}" for i in range(max(n_people - len(PEOPLE), 0))]
+    places = PLACES + [
+        f"Deutschland\\Ort {i:04}" for i in range(max(n_places - len(PLACES), 0))
+    ]
+    events = EVENTS + [f"Feier {i:04}" for i in range(max(n_events - len(EVENTS), 0))]
+    return (
+        [f"Personen\\Familie\\{p}" for p in people[:n_people]]
+        + [f"Orte\\{p}" for p in places[:n_places]]
+        + [f"Ereignisse\\{e}" for e in events[:n_events]]
+    )
+
+
+def zipf_choice(rng: np.random.Generator, n: int, size: int) -> np.ndarray:
+    """Draws `size` positions in `range(n)` with probability proportional to 1/rank."""
+    weights = 1 / np.arange(1, n + 1)
+    return rng.choice(n, size=size, p=weights / weights.sum())
+
+
+def iter_asset_xml(
+    n_assets: int,
+    seed: int = 0,
+    n_people: int = 200,
+    n_places: int = 100,
+    n_events: int = 50,
+    first_year: int = 1990,
+    last_year: int = 2024,
+) -> Iterator[str]:
+    """
+    Yields the `<Asset>` elements of a synthetic export one by one.
+
+    Args:
+        n_assets: Number of assets.
+        seed: Seed of the random generator; equal seeds give equal exports.
+        n_people: Number of person categories.
+        n_places: Number of place categories.
+        n_events: Number of event categories.
+        first_year: First year of the asset dates.
+        last_year: Last year of the asset dates.
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = [escape(c) for c in categories(n_people, n_places, n_events)]
+    keywords = [escape(k) for k in KEYWORDS]
+    weights = np.array([weight for _, _, weight in FILE_TYPES])
+    file_types = rng.choice(len(FILE_TYPES), size=n_assets, p=weights / weights.sum())
+    first = np.datetime64(f"{first_year}-01-01")
+    days = (np.datetime64(f"{last_year + 1}-01-01") - first).astype(int)
+    dates = first + rng.integers(0, days, size=n_assets).astype("timedelta64[D]")
+    seconds = rng.integers(0, 86400, size=n_assets)
+    n_categories = rng.poisson(1.5, size=n_assets)
+    category_draws = iter(zipf_choice(rng, len(vocabulary), int(n_categories.sum())))
+
+    for i in range(n_assets):
+        file_type, extension, _ = FILE_TYPES[file_types[i]]
+        date = str(dates[i])
+        year, day = date[:4], date.replace("-", "")
+        hour, rest = divmod(int(seconds[i]), 3600)
+        name = f"IMG_{i:07}.{extension}" if extension else f"Album {i:07}"
+        lines = [
+            "<Asset>",
+            f"<Name>{name}</Name>",
+            f"<Folder>\\\\Server\\Public\\Fotos\\{year}\\</Folder>",
+            f"<FileType>{escape(file_type)}</FileType>",
+            f"<DBDate>{day} {hour:02}:{rest // 60:02}:{rest % 60:02}.000</DBDate>",
+        ]
+        if rng.random() < 0.3:
+            words = rng.choice(CAPTION_WORDS, size=rng.integers(2, 6))
+            lines.append(f"<Caption>{escape(' '.join(words))}</Caption>")
+        if rng.random() < 0.5:
+            lines.append(f"<Author>{AUTHORS[rng.integers(len(AUTHORS))]}</Author>")
+        drawn = sorted({next(category_draws) for _ in range(n_categories[i])})
+        if drawn:
+            lines.append("<AssetCategoryList>")
+            lines.extend(
+                f"<AssetCategory>{vocabulary[j]}</AssetCategory>" for j in drawn
+            )
+            lines.append("</AssetCategoryList>")
+        if rng.random() < 0.4:
+            keyword = keywords[rng.integers(len(keywords))]
+            lines.append(
+                f"<AssetKeywordList><AssetKeyword>{keyword}</AssetKeyword>"
+                "</AssetKeywordList>"
+            )
+        lines.append("</Asset>")
+        yield "\n".join(lines) + "\n"
+
+
+def write_acddb(path: Union[str, BinaryIO], n_assets: int, **kwargs) -> int:
+    """
+    Writes a synthetic `<ACDDB Version="1.20.0">` export.
+
+    The assets are written as they are generated, so exports of millions of
+    assets do not have to fit into memory.
+
+    Args:
+        path: Target path or binary file object.
+        n_assets: Number of assets.
+        kwargs: Passed to `iter_asset_xml`, e.g. `seed`.
+
+    Returns:
+        The number of bytes written.
+    """
+    if isinstance(path, str):
+        with open(path, "wb") as f:
+            return write_acddb(f, n_assets, **kwargs)
+    written = path.write(
+        b'<?xml version="1.0" encoding="UTF-8"?>\n'
+        b'<ACDDB Version="1.20.0">\n<AssetList>\n'
+    )
+    for asset in iter_asset_xml(n_assets, **kwargs):
+        written += path.write(asset.encode("utf-8"))
+    written += path.write(b"</AssetList>\n</ACDDB>\n")
+    return written
@@ -0,0 +1,193 @@
+from typing import Dict, Iterable, List, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+class TagMatrix:
+    """
+    Sparse asset x tag membership matrix in CSR layout.
+
+    The tags of asset `i` are `tags[j]` for every `j` in
+    `indices[indptr[i]:indptr[i + 1]]`. Only the (asset, tag) pairs that are
+    present are stored, so the memory is linear in the number of assignments
+    rather than assets x tags.
+    """
+
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray, tags: Sequence[str]):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.tags = list(tags)
+        self._positions = {tag: j for j, tag in enumerate(self.tags)}
+        self._columns = None
+
+    @classmethod
+    def from_tag_lists(cls, tag_lists: Iterable[List[str]]) -> "TagMatrix":
+        """Builds the matrix in one pass over the per-asset tag lists."""
+        vocabulary: Dict[str, int] = {}
+        indptr = [0]
+        indices = []
+        for tags in tag_lists:
+            indices.extend(
+                {vocabulary.setdefault(tag, len(vocabulary)) for tag in tags}
+            )
+            indptr.append(len(indices))
+
+        # Renumber the tags so that their positions follow the sorted tag names
+        tags = sorted(vocabulary)
+        order = np.empty(len(tags), dtype=np.int32)
+        order[[vocabulary[tag] for tag in tags]] = np.arange(len(tags), dtype=np.int32)
+        indices = order[np.asarray(indices, dtype=np.int32)]
+        return cls(indptr, indices, tags)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, tags: Sequence[str]) -> "TagMatrix":
+        """Builds the matrix from one boolean column per tag, e.g. in a wide CSV."""
+        rows, indices = np.nonzero(df[list(tags)].to_numpy(dtype=bool))
+        indptr = np.zeros(len(df) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(df)), out=indptr[1:])
+        return cls(indptr, indices, tags)
+
+    @classmethod
+    def load(cls, path: str) -> "TagMatrix":
+        """Loads a matrix stored with `save`."""
+        with np.load(path, allow_pickle=False) as arrays:
+            return cls(arrays["indptr"], arrays["indices"], arrays["tags"].tolist())
+
+    def save(self, path: str):
+        """Stores the matrix as a `.npz` archive."""
+        np.savez_compressed(
+            path,
+            indptr=self.indptr,
+            indices=self.indices,
+            tags=np.array(self.tags, dtype=str),
+        )
+
+    @property
+    def shape(self):
+        return len(self.indptr) - 1, len(self.tags)
+
+    def __len__(self) -> int:
+        return len(self.indptr) - 1
+
+    def __contains__(self, tag: str) -> bool:
+        return tag in self._positions
+
+    def row_ids(self) -> np.ndarray:
+        """Returns the asset (row) of every stored entry."""
+        return np.repeat(np.arange(len(self), dtype=np.int32), np.diff(self.indptr))
+
+    def counts(self) -> np.ndarray:
+        """Returns the number of assets per tag, aligned with `tags`."""
+        return np.bincount(self.indices, minlength=len(self.tags))
+
+    def rows(self, tag: str) -> np.ndarray:
+        """Returns the sorted row ids of all assets carrying `tag`."""
+        if self._columns is None:
+            # Transpose once to CSC; a stable sort keeps the rows ascending
+            order = np.argsort(self.indices, kind="stable")
+            colptr = np.zeros(len(self.tags) + 1, dtype=np.int64)
+            np.cumsum(self.counts(), out=colptr[1:])
+            self._columns = (colptr, self.row_ids()[order])
+        colptr, rows = self._columns
+        j = self._positions[tag]
+        return rows[colptr[j] : colptr[j + 1]]
+
+    def take(self, positions: Sequence[int]) -> "TagMatrix":
+        """Returns the matrix restricted to (and ordered by) the given rows."""
+        positions = np.asarray(positions, dtype=np.int64)
+        starts = self.indptr[positions]
+        lengths = self.indptr[positions + 1] - starts
+        indptr = np.zeros(len(positions) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        # Position of every kept entry in the original `indices`
+        offsets = np.arange(indptr[-1]) - np.repeat(indptr[:-1], lengths)
+        return TagMatrix(
+            indptr, self.indices[np.repeat(starts, lengths) + offsets], self.tags
+        )
+
+    def append(self, other: "TagMatrix") -> "TagMatrix":
+        """
+        Stacks the rows of `other` below the rows of this matrix.
+
+        The tag vocabularies are merged and tags without any asset are dropped.
+        """
+        tags = sorted(set(self.tags) | set(other.tags))
+        positions = {tag: j for j, tag in enumerate(tags)}
+        indices = np.concatenate(
+            [
+                np.array([positions[t] for t in m.tags], dtype=np.int32)[m.indices]
+                for m in (self, other)
+            ]
+        )
+        indptr = np.concatenate([self.indptr, other.indptr[1:] + self.indptr[-1]])
+        return TagMatrix(indptr, indices, tags).prune()
+
+    def prune(self) -> "TagMatrix":
+        """Returns the matrix without the tags that no asset carries."""
+        used = self.counts() > 0
+        if used.all():
+            return self
+        positions = (np.cumsum(used) - 1).astype(np.int32)
+        tags = [tag for tag, keep in zip(self.tags, used) if keep]
+        return TagMatrix(self.indptr, positions[self.indices], tags)
+
+    def to_frame(self, sparse: bool = False) -> pd.DataFrame:
+        """
+        Expands the matrix into one boolean column per tag.
+
+        Args:
+            sparse: Whether to use `pd.SparseDtype(bool, False)` columns, which
+                only store the True entries. Otherwise the columns are dense.
+        """
+        n_rows = len(self)
+        if not sparse:
+            dense = np.zeros(self.shape, dtype=bool)
+            dense[self.row_ids(), self.indices] = True
+            return pd.DataFrame(dense, columns=self.tags)
+
+        columns = {}
+        buffer = np.zeros(n_rows, dtype=bool)
+        for tag in self.tags:
+            rows = self.rows(tag)
+            buffer[rows] = True
+            columns[tag] = pd.arrays.SparseArray(buffer, fill_value=False)
+            buffer[rows] = False
+        return pd.DataFrame(columns, index=pd.RangeIndex(n_rows))
+
+
+def tag_statistics(tag_matrix: TagMatrix, fold_case: bool = True) -> pd.DataFrame:
+    """
+    Counts the assets per tag, e.g. for reports on a snapshot's tags.
+
+    Args:
+        tag_matrix: The tags of the assets.
+        fold_case: Whether tags that only differ in case are counted as one, as
+            the bot does when querying. They are listed under the first of their
+            spellings in sorted order, and an asset carrying several spellings
+            counts once.
+
+    Returns:
+        A frame indexed by tag (sorted) with the number of `assets` carrying the
+        tag and their `share` of all assets.
+    """
+    tags = sorted(tag_matrix.tags)
+    keys = [tag.lower() if fold_case else tag for tag in tags]
+    names = {}
+    for key, tag in zip(keys, tags):
+        names.setdefault(key, tag)
+    positions = {key: i for i, key in enumerate(names)}
+    column_keys = np.array(
+        [positions[tag.lower() if fold_case else tag] for tag in tag_matrix.tags],
+        dtype=np.int64,
+    )
+    entries = column_keys[tag_matrix.indices]
+    if len(names) < len(tags):
+        # Count an asset once even if it carries several spellings of a tag
+        pairs = np.unique(tag_matrix.row_ids() * len(names) + entries)
+        entries = pairs % len(names)
+    counts = np.bincount(entries, minlength=len(names))
+    return pd.DataFrame(
+        {"assets": counts, "share": counts / max(len(tag_matrix), 1)},
+        index=pd.Index(list(names.values()), name="tag"),
+    )
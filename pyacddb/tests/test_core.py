@@ -0,0 +1,113 @@
+import pandas as pd
+import pytest
+
+from ..core import extract_keywords, iter_asset_chunks, iter_assets
+from ..parallel import extract_keywords_parallel, split_assets
+
+ACDDB_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<ACDDB Version="1.20.0">
+<AssetList>
+<Asset>
+<Name>IMG_0001.JPG</Name>
+<Folder>\\\\Server\\Public\\Fotos\\1995\\</Folder>
+<FileType>JPEG</FileType>
+<DBDate>19950601 12:00:00.000</DBDate>
+<Caption>Im Garten</Caption>
+<AssetCategoryList>
+<AssetCategory>Personen\\Micha</AssetCategory>
+<AssetCategory>Orte\\Münster\\Kemperweg</AssetCategory>
+</AssetCategoryList>
+<AssetKeywordList><AssetKeyword>Haus</AssetKeyword></AssetKeywordList>
+</Asset>
+<Asset>
+<Name>IMG_0001.JPG</Name>
+<Folder>\\\\Server\\Public\\Fotos\\1998\\</Folder>
+<FileType>JPEG</FileType>
+<DBDate>19980130 08:30:00.000</DBDate>
+<AssetCategoryList>
+<AssetCategory>Personen\\Jannis</AssetCategory>
+</AssetCategoryList>
+</Asset>
+<Asset>
+<Name>IMG_0002.JPG</Name>
+<Folder>\\\\Server\\Public\\Fotos\\1998\\</Folder>
+<FileType>JPEG</FileType>
+<DBDate>19980212 18:00:00.000</DBDate>
+<Caption>Dach (neu)</Caption>
+<AssetKeywordList><AssetKeyword>Haus</AssetKeyword></AssetKeywordList>
+</Asset>
+</AssetList>
+</ACDDB>
+"""
+
+
+@pytest.fixture
+def acddb_path(tmp_path):
+    path = tmp_path / "export.xml"
+    path.write_text(ACDDB_XML, encoding="utf-8")
+    return str(path)
+
+
+def test_extract_keywords_schema(acddb_path):
+    df = extract_keywords(acddb_path, ["Name", "Folder", "Caption"])
+    assert list(df.columns[:6]) == [
+        "Name",
+        "Folder",
+        "Caption",
+        "AssetCategories",
+        "AssetKeywords",
+        "Tags",
+    ]
+    assert sorted(df.columns[6:]) == ["Haus", "Jannis", "Kemperweg", "Micha"]
+    assert df["Caption"].tolist() == ["Im Garten", None, "Dach (neu)"]
+    assert df["Haus"].tolist() == [True, False, True]
+
+
+def test_extract_keywords_duplicate_names(acddb_path):
+    df = extract_keywords(acddb_path, ["Name"])
+    assert df["Tags"].tolist() == [
+        ["Micha", "Kemperweg", "Haus"],
+        ["Jannis"],
+        ["Haus"],
+    ]
+    assert df["Micha"].tolist() == [True, False, False]
+    assert df["Jannis"].tolist() == [False, True, False]
+
+
+def test_iter_assets_streams_records(acddb_path):
+    records = iter_assets(acddb_path, ["Name", "Folder"])
+    first = next(records)
+    assert first["Name"] == "IMG_0001.JPG"
+    assert first["AssetCategories"] == [
+        "Personen\\Micha",
+        "Orte\\Münster\\Kemperweg",
+    ]
+    assert [r["Folder"][-5:] for r in records] == ["1998\\", "1998\\"]
+
+
+def test_iter_asset_chunks(acddb_path):
+    chunks = list(iter_asset_chunks(acddb_path, ["Name"], chunksize=2))
+    assert [len(c) for c in chunks] == [2, 1]
+    assert list(chunks[0].columns) == [
+        "Name",
+        "AssetCategories",
+        "AssetKeywords",
+        "Tags",
+    ]
+
+
+@pytest.mark.parametrize("workers", [1, 2, 3])
+def test_extract_keywords_parallel(acddb_path, workers):
+    expected = extract_keywords(acddb_path)
+    result = extract_keywords_parallel(acddb_path, workers=workers)
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_split_assets(acddb_path):
+    declaration, ranges = split_assets(acddb_path, 10)
+    assert declaration == b'<?xml version="1.0" encoding="UTF-8"?>'
+    assert len(ranges) == 3
+    with open(acddb_path, "rb") as f:
+        data = f.read()
+    assert all(data[start:end].startswith(b"<Asset>") for start, end in ranges)
+    assert all(data[start:end].endswith(b"</Asset>\n") for start, end in ranges[:-1])
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from ..hierarchy import CategoryTree, split_path
+from ..synthetic import categories
+
+
+@pytest.fixture
+def tree():
+    return CategoryTree.from_category_lists(
+        [
+            ["Orte\\Deutschland\\Münster\\Kemperweg", "Personen\\Micha"],
+            ["Orte\\Deutschland\\Köln"],
+            [],
+            ["Orte\\Deutschland\\Münster", "orte\\deutschland\\münster\\Aasee"],
+            ["Personen\\Jannis"],
+        ]
+    )
+
+
+def test_split_path():
+    assert split_path("Orte\\ Münster \\") == ["Orte", "Münster"]
+
+
+def test_subtree_rows(tree):
+    assert tree["Orte"].tolist() == [0, 1, 3]
+    assert tree["orte\\deutschland\\münster\\"].tolist() == [0, 3]
+    assert tree["Orte\\Deutschland\\Münster\\Kemperweg"].tolist() == [0]
+    assert tree["Personen"].tolist() == [0, 4]
+    assert "Orte\\Münster" not in tree
+
+
+def test_structure(tree):
+    assert tree.roots() == ["Orte", "Personen"]
+    assert tree.subcategories("orte\\deutschland") == [
+        "Orte\\Deutschland\\Köln",
+        "Orte\\Deutschland\\Münster",
+    ]
+    assert tree.descendants("Orte\\Deutschland\\Münster") == [
+        "Orte\\Deutschland\\Münster\\Aasee",
+        "Orte\\Deutschland\\Münster\\Kemperweg",
+    ]
+
+
+def test_case_sensitive():
+    tree = CategoryTree.from_category_lists(
+        [["Orte\\Münster"], ["orte\\Köln"]], fold_case=False
+    )
+    assert tree.roots() == ["Orte", "orte"]
+    assert tree["Orte"].tolist() == [0]
+
+
+def test_synthetic_vocabulary():
+    vocabulary = categories(n_people=3, n_places=4, n_events=2)
+    tree = CategoryTree.from_category_lists([[path] for path in vocabulary])
+    assert len(tree["Orte\\Deutschland"]) == 4
+    assert tree["Personen\\Familie"].tolist() == [0, 1, 2]
+
+
+def test_merged(tree):
+    # Row 1 (Köln) was removed, row 4 moved up and a new row added at the end
+    renumber = np.array([0, -1, 1, 2, 3], dtype=np.int32)
+    merged = tree.merged(
+        renumber,
+        [["Orte\\Deutschland\\Münster\\Aasee", "orte\\Deutschland\\Bonn"]],
+        np.array([4], dtype=np.int32),
+    )
+    assert "Orte\\Deutschland\\Köln" not in merged
+    assert merged["Orte"].tolist() == [0, 2, 4]
+    assert merged["Orte\\Deutschland\\Münster\\Aasee"].tolist() == [2, 4]
+    assert merged["Orte\\Deutschland\\Bonn"].tolist() == [4]
+    assert merged["Personen"].tolist() == [0, 3]
+    assert merged.subcategories("Orte\\Deutschland") == [
+        "Orte\\Deutschland\\Bonn",
+        "Orte\\Deutschland\\Münster",
+    ]
+    # The tree itself is left as it was
+    assert tree["Orte"].tolist() == [0, 1, 3]
@@ -0,0 +1,75 @@
+import pytest
+
+from ..core import extract_assets
+from ..incremental import asset_keys, read_delta, update_snapshot
+from ..snapshot import read_meta, read_snapshot, write_snapshot
+
+
+def asset_xml(name: str, folder: str, date: str, tags=()) -> str:
+    keywords = "".join(f"<AssetKeyword>{tag}</AssetKeyword>" for tag in tags)
+    return (
+        f"<Asset><Name>{name}</Name><Folder>{folder}</Folder>"
+        f"<FileType>JPEG</FileType><DBDate>{date}</DBDate>"
+        f"<AssetKeywordList>{keywords}</AssetKeywordList></Asset>\n"
+    )
+
+
+def export_xml(*assets: str) -> str:
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n<ACDDB Version="1.20.0">\n'
+        f"<AssetList>\n{''.join(assets)}</AssetList>\n</ACDDB>\n"
+    )
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    export = tmp_path / "v1.xml"
+    export.write_text(
+        export_xml(
+            asset_xml("a.jpg", "F1\\", "19950601 12:00:00.000", ["Haus"]),
+            asset_xml("a.jpg", "F2\\", "19960601 12:00:00.000", ["Micha"]),
+            asset_xml("b.jpg", "F2\\", "19970601 12:00:00.000", ["Dach"]),
+        ),
+        encoding="utf-8",
+    )
+    path = str(tmp_path / "wholedb.snapshot")
+    write_snapshot(path, *extract_assets(str(export), digest=True))
+    return path
+
+
+@pytest.fixture
+def export_v2(tmp_path):
+    export = tmp_path / "v2.xml"
+    export.write_text(
+        export_xml(
+            asset_xml("a.jpg", "F1\\", "19950601 12:00:00.000", ["Haus"]),
+            asset_xml("a.jpg", "F2\\", "19960601 12:00:00.000", ["Micha", "Haus"]),
+            asset_xml("c.jpg", "F3\\", "19990601 12:00:00.000", ["Jannis"]),
+        ),
+        encoding="utf-8",
+    )
+    return str(export)
+
+
+def test_update_snapshot(snapshot, export_v2):
+    delta = update_snapshot(export_v2, snapshot)
+    assert delta.added == ["F3\\c.jpg"]
+    assert delta.changed == ["F2\\a.jpg"]
+    assert delta.removed == ["F2\\b.jpg"]
+    assert read_meta(snapshot)["generation"] == 1
+    assert read_delta(snapshot).to_dict() == delta.to_dict()
+
+    assets_df, tag_matrix = read_snapshot(snapshot)
+    assert asset_keys(assets_df).tolist() == ["F1\\a.jpg", "F2\\a.jpg", "F3\\c.jpg"]
+    assert tag_matrix.tags == ["Haus", "Jannis", "Micha"]
+    assert tag_matrix.rows("Haus").tolist() == [0, 1]
+    assert assets_df["Date"].dt.year.tolist() == [1995, 1996, 1999]
+
+    new_rows, new_tags = read_snapshot(snapshot, start=delta.start)
+    assert new_rows["Name"].tolist() == ["a.jpg", "c.jpg"]
+    assert new_tags.tags == ["Haus", "Jannis", "Micha"]
+
+
+def test_update_snapshot_without_changes(tmp_path, snapshot):
+    assert not update_snapshot(str(tmp_path / "v1.xml"), snapshot)
+    assert read_meta(snapshot)["generation"] == 0
@@ -0,0 +1,139 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from .. import snapshot
+from ..snapshot import (
+    read_meta,
+    read_snapshot,
+    resolve_snapshot,
+    snapshot_path,
+    write_snapshot,
+)
+from ..tags import TagMatrix
+
+
+@pytest.fixture
+def assets():
+    assets_df = pd.DataFrame(
+        {
+            "Name": ["a.jpg", "b.jpg", "c.mp4"],
+            "FileType": ["JPEG", "JPEG", None],
+            "DBDate": [
+                "19950601 12:00:00.000",
+                "19970315 08:30:00.000",
+                "19980212 18:00:00.000",
+            ],
+            "AssetCategories": [["Personen\\Micha"], [], ["Orte\\Münster"]],
+            "Rating": [1, 5, 3],
+        }
+    )
+    return assets_df, TagMatrix.from_tag_lists([["Micha"], [], ["Münster"]])
+
+
+def test_snapshot_roundtrip(tmp_path, assets):
+    assets_df, tag_matrix = assets
+    path = str(tmp_path / "wholedb.snapshot")
+    write_snapshot(path, assets_df, tag_matrix)
+    loaded_df, loaded_tags = read_snapshot(path)
+
+    assert loaded_df["Name"].tolist() == ["a.jpg", "b.jpg", "c.mp4"]
+    assert loaded_df["FileType"].tolist() == ["JPEG", "JPEG", None]
+    assert (
+        loaded_df["AssetCategories"].tolist() == assets_df["AssetCategories"].tolist()
+    )
+    assert loaded_df["Rating"].tolist() == [1, 5, 3]
+    assert loaded_df["Date"].dt.year.tolist() == [1995, 1997, 1998]
+    assert loaded_tags.tags == ["Micha", "Münster"]
+    assert isinstance(loaded_tags.indices.base, np.memmap)
+    assert loaded_tags.rows("Münster").tolist() == [2]
+    # The table's numeric and datetime columns are mapped as well, not copied
+    for name in ["Rating", "Date"]:
+        values = loaded_df[name].to_numpy()
+        while not isinstance(values, np.memmap) and values.base is not None:
+            values = values.base
+        assert isinstance(values, np.memmap)
+
+
+def test_snapshot_categorical(tmp_path, assets):
+    assets_df, tag_matrix = assets
+    path = str(tmp_path / "wholedb.snapshot")
+    write_snapshot(path, assets_df, tag_matrix)
+    loaded_df, _ = read_snapshot(path, start=1, categorical=["FileType", "Name"])
+    assert loaded_df["FileType"].dtype == "category"
+    assert loaded_df["FileType"].cat.categories.tolist() == ["JPEG"]
+    assert loaded_df["FileType"].isna().tolist() == [False, True]
+    assert loaded_df["Name"].tolist() == ["b.jpg", "c.mp4"]
+
+
+def test_snapshot_replaces_existing(tmp_path, assets):
+    assets_df, tag_matrix = assets
+    path = str(tmp_path / "wholedb.snapshot")
+    (tmp_path / "wholedb.snapshot").mkdir()
+    (tmp_path / "wholedb.snapshot" / "notes.txt").write_text("kept")
+    versions = []
+    for generation in range(3):
+        write_snapshot(path, assets_df.iloc[:1], tag_matrix.take([0]), generation)
+        versions.append(os.path.basename(resolve_snapshot(path)))
+    loaded_df, _ = read_snapshot(path)
+    assert len(loaded_df) == 1
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["wholedb.snapshot"]
+    # The current and the previous version are kept, other files left alone
+    assert sorted(os.listdir(path)) == sorted(["current", "notes.txt"] + versions[1:])
+
+
+def test_snapshot_reads_one_version(tmp_path, assets):
+    assets_df, tag_matrix = assets
+    path = str(tmp_path / "wholedb.snapshot")
+    write_snapshot(path, assets_df, tag_matrix)
+    version = resolve_snapshot(path)
+    assert resolve_snapshot(version) == version
+    write_snapshot(path, assets_df.iloc[:1], tag_matrix.take([0]), generation=1)
+    assert resolve_snapshot(path) != version
+    assert read_meta(path)["generation"] == 1
+    # A reader that resolved the pointer before the write still finds its version
+    assert len(read_snapshot(version)[0]) == len(assets_df)
+
+
+def test_snapshot_resolved_again(tmp_path, assets, monkeypatch):
+    assets_df, tag_matrix = assets
+    path = str(tmp_path / "wholedb.snapshot")
+    write_snapshot(path, assets_df, tag_matrix)
+    stale = [resolve_snapshot(path)]
+    for generation in (1, 2):
+        write_snapshot(path, assets_df.iloc[:1], tag_matrix.take([0]), generation)
+    assert not os.path.exists(stale[0])
+
+    # The pointer was resolved before the two writes removed that version
+    resolve = snapshot.resolve_snapshot
+    monkeypatch.setattr(
+        snapshot, "resolve_snapshot", lambda p: stale.pop() if stale else resolve(p)
+    )
+    assert len(read_snapshot(path)[0]) == 1
+
+
+def test_snapshot_without_versions(tmp_path, assets):
+    assets_df, tag_matrix = assets
+    path = str(tmp_path / "wholedb.snapshot")
+    write_snapshot(path, assets_df, tag_matrix)
+    # The layout of snapshots written before versions were introduced
+    version = resolve_snapshot(path)
+    os.remove(os.path.join(path, "current"))
+    for name in os.listdir(version):
+        os.replace(os.path.join(version, name), os.path.join(path, name))
+    os.rmdir(version)
+    assert resolve_snapshot(path) == path
+    assert len(read_snapshot(path)[0]) == len(assets_df)
+
+    write_snapshot(path, assets_df.iloc[:1], tag_matrix.take([0]))
+    assert resolve_snapshot(path) != path
+    assert len(read_snapshot(path)[0]) == 1
+
+
+def test_snapshot_path(tmp_path, assets):
+    csv_path = str(tmp_path / "wholedb.csv")
+    assert snapshot_path(csv_path) is None
+    write_snapshot(str(tmp_path / "wholedb.snapshot"), *assets)
+    assert snapshot_path(csv_path) == str(tmp_path / "wholedb.snapshot")
@@ -0,0 +1,30 @@
+import io
+
+from ..core import extract_assets, iter_assets
+from ..synthetic import write_acddb
+
+
+def test_deterministic():
+    first, second, other = io.BytesIO(), io.BytesIO(), io.BytesIO()
+    write_acddb(first, 50, seed=1)
+    write_acddb(second, 50, seed=1)
+    write_acddb(other, 50, seed=2)
+    assert first.getvalue() == second.getvalue()
+    assert first.getvalue() != other.getvalue()
+
+
+def test_parses_as_export(tmp_path):
+    path = str(tmp_path / "export.xml")
+    size = write_acddb(path, 500, n_people=20)
+    assert size == len(open(path, "rb").read())
+
+    assets_df, tag_matrix = extract_assets(path)
+    assert len(assets_df) == len(tag_matrix) == 500
+    assert assets_df["Name"].is_unique
+    assert assets_df["DBDate"].str.match(r"\d{8} \d\d:\d\d:\d\d\.000").all()
+    categories = {c for cs in assets_df["AssetCategories"] for c in cs}
+    assert "Personen\\Familie\\Micha" in categories
+    assert any(c.count("\\") == 3 for c in categories)
+    # Tags are the leaves of the categories, umlauts intact
+    assert "Micha" in tag_matrix and "Jürgen" in tag_matrix
+    assert sum(1 for _ in iter_assets(path)) == 500
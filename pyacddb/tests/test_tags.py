@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ..tags import TagMatrix, tag_statistics
+
+
+@pytest.fixture
+def tag_lists():
+    return [["Micha", "Haus"], ["Jannis"], [], ["Haus", "Micha", "Haus"]]
+
+
+def test_from_tag_lists(tag_lists):
+    matrix = TagMatrix.from_tag_lists(tag_lists)
+    assert matrix.shape == (4, 3)
+    assert matrix.tags == ["Haus", "Jannis", "Micha"]
+    assert matrix.counts().tolist() == [2, 1, 2]
+    assert matrix.rows("Haus").tolist() == [0, 3]
+    assert "Jannis" in matrix and "Dach" not in matrix
+
+
+def test_to_frame_matches_membership(tag_lists):
+    matrix = TagMatrix.from_tag_lists(tag_lists)
+    expected = pd.DataFrame(
+        {tag: [tag in tags for tags in tag_lists] for tag in matrix.tags}
+    )
+    pd.testing.assert_frame_equal(matrix.to_frame(), expected)
+    sparse = matrix.to_frame(sparse=True)
+    assert all(isinstance(dtype, pd.SparseDtype) for dtype in sparse.dtypes)
+    pd.testing.assert_frame_equal(sparse.sparse.to_dense(), expected)
+
+
+def test_from_frame_roundtrip(tag_lists):
+    matrix = TagMatrix.from_tag_lists(tag_lists)
+    rebuilt = TagMatrix.from_frame(matrix.to_frame(), matrix.tags)
+    assert rebuilt.indptr.tolist() == matrix.indptr.tolist()
+    assert rebuilt.rows("Micha").tolist() == [0, 3]
+
+
+def test_take(tag_lists):
+    matrix = TagMatrix.from_tag_lists(tag_lists).take([3, 1])
+    assert len(matrix) == 2
+    assert matrix.rows("Haus").tolist() == [0]
+    assert matrix.rows("Jannis").tolist() == [1]
+
+
+def test_save_load(tmp_path, tag_lists):
+    matrix = TagMatrix.from_tag_lists(tag_lists)
+    matrix.save(tmp_path / "db.tags.npz")
+    loaded = TagMatrix.load(tmp_path / "db.tags.npz")
+    assert loaded.tags == matrix.tags
+    assert np.array_equal(loaded.indices, matrix.indices)
+
+
+def test_tag_statistics(tag_lists):
+    stats = tag_statistics(TagMatrix.from_tag_lists(tag_lists + [["haus"]]))
+    assert stats.index.tolist() == ["Haus", "Jannis", "Micha"]
+    assert stats["assets"].tolist() == [3, 1, 2]
+    assert stats["share"].tolist() == [0.6, 0.2, 0.4]
+
+    both = TagMatrix.from_tag_lists([["Haus", "haus"], ["haus"]])
+    assert tag_statistics(both)["assets"].tolist() == [2]
+    assert tag_statistics(both, fold_case=False)["assets"].tolist() == [1, 2]